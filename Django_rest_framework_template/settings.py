@@ -61,6 +61,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.ProfilingMiddleware",
+    "core.middleware.QueryInstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "debug_toolbar.middleware.DebugToolbarMiddleware",
@@ -74,6 +77,33 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Per-request query count, DB/view/serializer/render time and N+1 detection
+QUERY_INSTRUMENTATION_ENABLED = config(
+    "QUERY_INSTRUMENTATION_ENABLED", default=False, cast=bool
+)
+QUERY_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = config(
+    "QUERY_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD", default=5, cast=int
+)
+QUERY_INSTRUMENTATION_REPORT_DIR = config(
+    "QUERY_INSTRUMENTATION_REPORT_DIR", default=""
+)
+QUERY_INSTRUMENTATION_SAMPLE_RATE = config(
+    "QUERY_INSTRUMENTATION_SAMPLE_RATE", default=0.01, cast=float
+)
+
+# Prometheus metrics served at /metrics, METRICS_TOKEN is a static bearer
+# token for scrapers, admins can use their own token
+METRICS_ENABLED = config("METRICS_ENABLED", default=False, cast=bool)
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+# cProfile a share of requests, or admin requests sending PROFILING_HEADER,
+# keeping the newest PROFILING_MAX_FILES profiles in PROFILING_DIR
+PROFILING_ENABLED = config("PROFILING_ENABLED", default=False, cast=bool)
+PROFILING_SAMPLE_RATE = config("PROFILING_SAMPLE_RATE", default=0.0, cast=float)
+PROFILING_HEADER = config("PROFILING_HEADER", default="X-Profile")
+PROFILING_DIR = config("PROFILING_DIR", default=str(BASE_DIR / "profiles"))
+PROFILING_MAX_FILES = config("PROFILING_MAX_FILES", default=200, cast=int)
+
 ROOT_URLCONF = "Django_rest_framework_template.urls"
 
 TEMPLATES = [
@@ -128,12 +158,12 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 # Use nose to run all tests
-TEST_RUNNER = 'django_nose.NoseTestSuiteRunner'
+TEST_RUNNER = "django_nose.NoseTestSuiteRunner"
 
 # Tell nose to measure coverage on the apps
 NOSE_ARGS = [
-    '--with-coverage',
-    '--cover-package=user,core',
+    "--with-coverage",
+    "--cover-package=user,core",
 ]
 
 # Internationalization
@@ -161,6 +191,26 @@ STATIC_ROOT = BASE_DIR / "static"
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# python streams files from Django, nginx and sendfile hand them off to the
+# front proxy with X-Accel-Redirect or X-Sendfile
+MEDIA_SERVE_MODE = config("MEDIA_SERVE_MODE", default="python")
+MEDIA_ACCEL_REDIRECT_PREFIX = config(
+    "MEDIA_ACCEL_REDIRECT_PREFIX", default="/protected-media/"
+)
+MEDIA_CACHE_MAX_AGE = config("MEDIA_CACHE_MAX_AGE", default=3600, cast=int)
+
+PROFILE_PHOTO_MAX_UPLOAD_SIZE = config(
+    "PROFILE_PHOTO_MAX_UPLOAD_SIZE", default=5 * 1024 * 1024, cast=int
+)
+
+# Worker processes rendering resized profile photos, 0 disables the variants
+IMAGE_PROCESSING_WORKERS = config("IMAGE_PROCESSING_WORKERS", default=2, cast=int)
+
+# Soft deleted rows older than this are removed by purge_soft_deleted
+SOFT_DELETE_RETENTION_DAYS = config("SOFT_DELETE_RETENTION_DAYS", default=30, cast=int)
+
+# 7 generates time-ordered primary keys for CoreModel, 4 random ones
+CORE_MODEL_UUID_VERSION = config("CORE_MODEL_UUID_VERSION", default=4, cast=int)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -173,13 +223,30 @@ USE_X_FORWARDED_HOST = True
 SITE_ID = 1
 
 # Email Configuration
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
-EMAIL_HOST = "smtp.gmail.com"
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+EMAIL_BACKEND = config(
+    "EMAIL_BACKEND", default="django.core.mail.backends.smtp.EmailBackend"
+)
+EMAIL_HOST = config("EMAIL_HOST", default="smtp.gmail.com")
+EMAIL_PORT = config("EMAIL_PORT", default=587, cast=int)
+EMAIL_USE_TLS = config("EMAIL_USE_TLS", default=True, cast=bool)
 EMAIL_HOST_USER = config("EMAIL_HOST_USER", None)
 EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD", None)
 
+# Outbox worker retries failed emails with exponential backoff
+EMAIL_OUTBOX_MAX_ATTEMPTS = config("EMAIL_OUTBOX_MAX_ATTEMPTS", default=5, cast=int)
+EMAIL_OUTBOX_RETRY_SECONDS = config("EMAIL_OUTBOX_RETRY_SECONDS", default=30, cast=int)
+# Emails leased by a worker that died unnoticed are retried after this
+EMAIL_OUTBOX_LEASE_SECONDS = config("EMAIL_OUTBOX_LEASE_SECONDS", default=300, cast=int)
+
+# The delete_queued_files worker retries failed deletions the same way
+FILE_DELETION_MAX_ATTEMPTS = config("FILE_DELETION_MAX_ATTEMPTS", default=5, cast=int)
+FILE_DELETION_RETRY_SECONDS = config(
+    "FILE_DELETION_RETRY_SECONDS", default=30, cast=int
+)
+FILE_DELETION_LEASE_SECONDS = config(
+    "FILE_DELETION_LEASE_SECONDS", default=300, cast=int
+)
+
 FRONTEND_URL = config("FRONTEND_URL", "")
 
 CORS_ORIGIN_ALLOW_ALL = True
@@ -206,6 +273,20 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Largest page a client may request, default page size of keyset pagination
+PAGINATION_MAX_LIMIT = config("PAGINATION_MAX_LIMIT", default=100, cast=int)
+PAGINATION_DEFAULT_LIMIT = config("PAGINATION_DEFAULT_LIMIT", default=20, cast=int)
+
+# How list endpoints count their results: "exact", "cached" or "estimated"
+PAGINATION_COUNT_STRATEGY = config("PAGINATION_COUNT_STRATEGY", default="exact")
+PAGINATION_COUNT_CACHE_ALIAS = config("PAGINATION_COUNT_CACHE_ALIAS", default="default")
+PAGINATION_COUNT_CACHE_TTL_SECONDS = config(
+    "PAGINATION_COUNT_CACHE_TTL_SECONDS", default=60, cast=int
+)
+PAGINATION_ESTIMATE_EXACT_THRESHOLD = config(
+    "PAGINATION_ESTIMATE_EXACT_THRESHOLD", default=1000, cast=int
+)
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Template API",
     "DESCRIPTION": "Template API documentation",
@@ -214,6 +295,26 @@ SPECTACULAR_SETTINGS = {
 
 USER_AUTH_TOKEN_EXPIRATION_SECONDS = 3600 * 24 * 30
 
+# Authentication token cache, the shared tier is used only when an alias is set
+USER_AUTH_TOKEN_CACHE_TTL_SECONDS = config(
+    "USER_AUTH_TOKEN_CACHE_TTL_SECONDS", default=300, cast=int
+)
+USER_AUTH_TOKEN_CACHE_MAX_SIZE = config(
+    "USER_AUTH_TOKEN_CACHE_MAX_SIZE", default=10000, cast=int
+)
+USER_AUTH_TOKEN_CACHE_ALIAS = config("USER_AUTH_TOKEN_CACHE_ALIAS", default=None)
+# Without a shared tier other processes cannot be told about invalidations
+USER_AUTH_TOKEN_CACHE_LOCAL_TTL_SECONDS = config(
+    "USER_AUTH_TOKEN_CACHE_LOCAL_TTL_SECONDS", default=5, cast=int
+)
+# How stale a local entry may get before its user generation is read again
+USER_AUTH_TOKEN_CACHE_GENERATION_CHECK_SECONDS = config(
+    "USER_AUTH_TOKEN_CACHE_GENERATION_CHECK_SECONDS", default=1, cast=float
+)
+
+# Threads used by the async auth views for password hashing
+PASSWORD_HASHING_POOL_SIZE = config("PASSWORD_HASHING_POOL_SIZE", default=4, cast=int)
+
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
@@ -0,0 +1,180 @@
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+
+
+class ServeMediaTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Files next to MEDIA_ROOT must never be served
+        with open(os.path.join(directory.name, "secret.txt"), "wb") as file:
+            file.write(b"secret")
+        media_root = os.path.join(directory.name, "media")
+        os.makedirs(os.path.join(media_root, "profile_photo"))
+        with open(os.path.join(media_root, "profile_photo", "a.txt"), "wb") as file:
+            file.write(b"0123456789")
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root, MEDIA_SERVE_MODE="python"
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+
+    def get(self, path="/media/profile_photo/a.txt", **headers):
+        return self.client.get(path, **headers)
+
+    def test_file_is_streamed(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+        self.assertEqual(response["Content-Type"], "text/plain")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("max-age=3600", response["Cache-Control"])
+        self.assertTrue(response["ETag"])
+        self.assertTrue(response["Last-Modified"])
+
+    def test_head_has_the_headers_without_a_body(self):
+        response = self.client.head("/media/profile_photo/a.txt")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(b"".join(response.streaming_content), b"")
+
+    def test_other_methods_are_not_allowed(self):
+        self.assertEqual(
+            self.client.post("/media/profile_photo/a.txt").status_code, 405
+        )
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get()["ETag"]
+
+        response = self.get(HTTP_IF_NONE_MATCH=f'W/{etag}, "other"')
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_single_ranges_are_served(self):
+        for header, content, content_range in (
+            ("bytes=2-4", b"234", "bytes 2-4/10"),
+            ("bytes=7-", b"789", "bytes 7-9/10"),
+            ("bytes=-2", b"89", "bytes 8-9/10"),
+            ("bytes=8-100", b"89", "bytes 8-9/10"),
+        ):
+            with self.subTest(header):
+                response = self.get(HTTP_RANGE=header)
+
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(b"".join(response.streaming_content), content)
+                self.assertEqual(response["Content-Range"], content_range)
+                self.assertEqual(response["Content-Length"], str(len(content)))
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE="bytes=10-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */10")
+
+    def test_ignored_ranges_serve_the_whole_file(self):
+        etag = self.get()["ETag"]
+
+        for headers in (
+            {"HTTP_RANGE": "bytes=0-1,4-5"},
+            {"HTTP_RANGE": "bytes=5-2"},
+            {"HTTP_RANGE": "bytes=2-4", "HTTP_IF_RANGE": '"stale"'},
+        ):
+            with self.subTest(headers):
+                response = self.get(**headers)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+
+        response = self.get(HTTP_RANGE="bytes=2-4", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+    def test_missing_files_and_directories_are_not_found(self):
+        for path in (
+            "/media/profile_photo/missing.txt",
+            "/media/profile_photo/",
+            "/media/",
+        ):
+            with self.subTest(path):
+                self.assertEqual(self.get(path).status_code, 404)
+
+    def test_paths_outside_of_media_root_are_not_found(self):
+        for path in (
+            "/media/../secret.txt",
+            "/media/profile_photo/../../secret.txt",
+            "/media/%2E%2E/secret.txt",
+            "/media//etc/passwd",
+        ):
+            with self.subTest(path):
+                self.assertEqual(self.get(path).status_code, 404)
+
+    def test_hashed_names_are_cached_forever(self):
+        name = "profile_photo/" + "a" * 64 + ".txt"
+        with open(os.path.join(self.media_root, name), "wb") as file:
+            file.write(b"hashed")
+
+        response = self.get(f"/media/{name}")
+
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+
+    @override_settings(
+        MEDIA_SERVE_MODE="nginx", MEDIA_ACCEL_REDIRECT_PREFIX="/protected-media/"
+    )
+    def test_nginx_mode_hands_off_with_x_accel_redirect(self):
+        response = self.get("/media/profile_photo/a.txt", HTTP_RANGE="bytes=2-4")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["X-Accel-Redirect"], "/protected-media/profile_photo/a.txt"
+        )
+        self.assertNotIn("X-Sendfile", response)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["Content-Type"], "text/plain")
+        self.assertTrue(response["ETag"])
+
+    @override_settings(MEDIA_SERVE_MODE="sendfile")
+    def test_sendfile_mode_hands_off_with_x_sendfile(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["X-Sendfile"],
+            os.path.join(self.media_root, "profile_photo", "a.txt"),
+        )
+        self.assertNotIn("X-Accel-Redirect", response)
+        self.assertEqual(response.content, b"")
+
+    @override_settings(MEDIA_SERVE_MODE="nginx")
+    def test_offload_modes_still_check_the_path(self):
+        self.assertEqual(self.get("/media/../secret.txt").status_code, 404)
+        self.assertEqual(self.get("/media/profile_photo/missing.txt").status_code, 404)
+
+
+@override_settings(METRICS_TOKEN="metrics-token")
+class MetricsViewTests(TestCase):
+    def get(self, token="metrics-token"):
+        return self.client.get("/metrics", HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_metrics_are_served_when_enabled(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(b"# TYPE", response.content)
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_metrics_need_the_token_when_enabled(self):
+        self.assertEqual(self.get("wrong").status_code, 401)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_metrics_are_not_found_when_disabled(self):
+        self.assertEqual(self.get().status_code, 404)
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
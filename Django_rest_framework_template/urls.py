@@ -24,10 +24,9 @@ from drf_spectacular.views import (
     SpectacularSwaggerView,
 )
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
-from django.views.static import serve
 from rest_framework.documentation import include_docs_urls
 
-from .views import Custom404
+from .views import Custom404, MetricsView, serve_media
 
 
 urlpatterns = [
@@ -46,11 +45,8 @@ urlpatterns = [
     path("user/", include("user.urls")),
     path("docs/", include_docs_urls(title="Template API")),
     path("__debug__/", include(debug_toolbar.urls)),
-    url(
-        r"^media/(?P<path>.*)$",
-        serve,
-        {"document_root": settings.MEDIA_ROOT, "show_indexes": True},
-    ),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    url(r"^media/(?P<path>.*)$", serve_media, name="media"),
 ]
 
 urlpatterns += staticfiles_urlpatterns()
@@ -1,8 +1,33 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.status import HTTP_404_NOT_FOUND
 from rest_framework.permissions import AllowAny
-from django.http import JsonResponse
+from rest_framework.renderers import BaseRenderer
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+)
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from core.classes import MetricsTokenAuthentication
+from core.metrics import render_metrics
+from core.permissions import MetricsPermission
+
+HASHED_NAME_PATTERN = re.compile(r"[0-9a-f]{32,}")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
 
 
 class Custom404(APIView):
@@ -26,8 +51,183 @@ class Custom404(APIView):
         return self.get(*args, **kwargs)
 
 
+class PlainTextRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "txt"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+class MetricsView(APIView):
+    """
+    Prometheus metrics of every worker in the text exposition format.
+    Not found unless METRICS_ENABLED.
+    """
+
+    authentication_classes = [MetricsTokenAuthentication]
+    permission_classes = [MetricsPermission]
+    renderer_classes = [PlainTextRenderer]
+    schema = None
+
+    def initial(self, request, *args, **kwargs):
+        # Before authentication, so a disabled endpoint never asks for a token
+        if not settings.METRICS_ENABLED:
+            raise Http404("Not found!")
+        super().initial(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        content, content_type = render_metrics()
+        return HttpResponse(content, content_type=content_type)
+
+
 def custom_500_handler(request, *args, **argv):
     return JsonResponse(
         {"status_code": 500, "message": "Internal Server Error!", "result": None},
         status=500,
     )
+
+
+class RangeFileWrapper:
+    """
+    File-like object that reads at most ``length`` bytes from ``offset``.
+    """
+
+    def __init__(self, file, offset: int, length: int):
+        self.file = file
+        self.file.seek(offset)
+        self.remaining = length
+
+    def read(self, size=-1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def get_media_etag(stat_result: os.stat_result) -> str:
+    return '"{:x}-{:x}-{:x}"'.format(
+        stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+    )
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def parse_range_header(header: str, size: int):
+    """
+    Returns the ``(start, end)`` byte positions of a single range, None when
+    the header should be ignored and the whole file served, or
+    ``(None, None)`` when the range cannot be satisfied.
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        # Malformed or multiple ranges, serve the whole file
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range, the last N bytes
+        length = int(end)
+        if length == 0:
+            return None, None
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and start > int(end):
+        return None
+    if start >= size:
+        return None, None
+    end = int(end) if end else size - 1
+    return start, min(end, size - 1)
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serves a file from MEDIA_ROOT. Depending on MEDIA_SERVE_MODE the file is
+    handed off to the front proxy with X-Accel-Redirect (``nginx``) or
+    X-Sendfile (``sendfile``), or streamed by Django (``python``) with
+    single Range support. Directories are never listed.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat_result = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("Not found!")
+    if not os.path.isfile(full_path):
+        raise Http404("Not found!")
+
+    etag = get_media_etag(stat_result)
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match and etag_matches(if_none_match, etag):
+        response = HttpResponseNotModified()
+        return set_media_headers(response, path, etag, stat_result)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or "application/octet-stream"
+    mode = settings.MEDIA_SERVE_MODE
+
+    if mode == "nginx":
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(
+            path
+        )
+    elif mode == "sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = full_path
+    else:
+        response = stream_media(request, full_path, content_type, etag, stat_result)
+
+    if encoding:
+        response["Content-Encoding"] = encoding
+    return set_media_headers(response, path, etag, stat_result)
+
+
+def stream_media(request, full_path, content_type, etag, stat_result):
+    size = stat_result.st_size
+    byte_range = None
+    range_header = request.META.get("HTTP_RANGE")
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = parse_range_header(range_header, size)
+
+    if byte_range == (None, None):
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, "rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(
+            RangeFileWrapper(open(full_path, "rb"), start, end - start + 1),
+            content_type=content_type,
+            status=206,
+        )
+        response["Content-Length"] = str(end - start + 1)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def set_media_headers(response, path, etag, stat_result):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat_result.st_mtime)
+    if HASHED_NAME_PATTERN.search(os.path.basename(path)):
+        # The name changes with the content, so it can be cached forever
+        patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
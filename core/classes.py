@@ -1,10 +1,20 @@
 import os
+import copy
+import hashlib
+import hmac
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 from cryptography.fernet import Fernet, InvalidToken
 from datetime import datetime, timedelta, timezone
 
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
 from django.core.files.storage import FileSystemStorage
 from django.conf import settings
+from django.db import transaction
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import AuthenticationFailed, ValidationError
 
@@ -16,21 +26,329 @@ class OverwriteFileSystemStorage(FileSystemStorage):
         return name
 
 
+class ContentAddressedFileSystemStorage(FileSystemStorage):
+    """
+    Stores every file under the SHA-256 of its content, so identical uploads
+    share one blob. The content is hashed while it is streamed to a temporary
+    file, which is then renamed atomically into place. References are counted
+    in ``ContentBlob`` and a blob is only removed with its last reference.
+    """
+
+    temp_directory = ".tmp"
+
+    def get_available_name(self, name: str, max_length: Optional[int] = None):
+        # The final name is derived from the content in _save
+        return name
+
+    def get_content_name(self, name: str, digest: str) -> str:
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def get_relative_name(self, name: str) -> str:
+        return os.path.relpath(self.path(name), self.location).replace("\\", "/")
+
+    def _save(self, name: str, content) -> str:
+        from .models import ContentBlob
+
+        temp_directory = os.path.join(self.location, self.temp_directory)
+        os.makedirs(temp_directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=temp_directory, delete=False) as temp:
+            try:
+                if hasattr(content, "seek"):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.unlink(temp.name)
+                raise
+
+        name = self.get_relative_name(self.get_content_name(name, digest.hexdigest()))
+        full_path = self.path(name)
+        with transaction.atomic():
+            # The locked row serialises saves and deletes of the same blob
+            ContentBlob.objects.get_or_create(name=name, defaults={"size": size})
+            blob = ContentBlob.objects.select_for_update().get(name=name)
+            if os.path.exists(full_path):
+                # Same content is already stored
+                os.unlink(temp.name)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp.name, self.file_permissions_mode)
+                os.replace(temp.name, full_path)
+            blob.refcount += 1
+            blob.save(update_fields=["refcount"])
+        return name
+
+    def delete(self, name: str):
+        from .models import ContentBlob
+
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        name = self.get_relative_name(name)
+        with transaction.atomic():
+            blob = ContentBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.refcount > 1:
+                blob.refcount -= 1
+                blob.save(update_fields=["refcount"])
+                return
+            if blob is not None:
+                blob.delete()
+            super().delete(name)
+
+
 class FileManager:
     def __init__(self):
-        self.storage_system = OverwriteFileSystemStorage()
+        self.storage_system = ContentAddressedFileSystemStorage()
 
     def save_file(self, file: any, *folder_path):
-        file_path = os.path.join(settings.MEDIA_ROOT, *folder_path, file.name)
-        self.storage_system.save(file_path, file)
-        return file_path
+        file_path = os.path.join(*folder_path, file.name)
+        return self.storage_system.path(self.storage_system.save(file_path, file))
 
     def delete_file(self, path: str):
         self.storage_system.delete(path)
 
 
+class TokenCache:
+    """
+    Two-tier cache of resolved ``(user, token, expires_at)`` tuples keyed by
+    token key. The first tier is a per-process TTL/LRU dictionary, the second
+    one an optional shared Django cache selected by alias.
+
+    Invalidating a user bumps a generation counter in the shared cache and
+    hits are checked against it, so all processes stop serving the user's
+    tokens. Local hits only read the counter once every
+    ``generation_check_interval`` seconds per entry, which bounds how long
+    another process may keep serving an invalidated token while saving the
+    shared cache round trip on most requests. Without a shared cache there
+    is no way to reach other processes, so local entries only live for
+    ``local_ttl`` seconds.
+    """
+
+    KEY_PREFIX = "auth_token:"
+    GENERATION_PREFIX = "auth_token_generation:"
+
+    def __init__(
+        self,
+        ttl=None,
+        max_size=None,
+        cache_alias=None,
+        local_ttl=None,
+        generation_check_interval=None,
+    ):
+        self.ttl = settings.USER_AUTH_TOKEN_CACHE_TTL_SECONDS if ttl is None else ttl
+        self.max_size = (
+            settings.USER_AUTH_TOKEN_CACHE_MAX_SIZE if max_size is None else max_size
+        )
+        self.cache_alias = cache_alias or settings.USER_AUTH_TOKEN_CACHE_ALIAS
+        self.local_ttl = (
+            settings.USER_AUTH_TOKEN_CACHE_LOCAL_TTL_SECONDS
+            if local_ttl is None
+            else local_ttl
+        )
+        self.generation_check_interval = (
+            settings.USER_AUTH_TOKEN_CACHE_GENERATION_CHECK_SECONDS
+            if generation_check_interval is None
+            else generation_check_interval
+        )
+        self._local = OrderedDict()
+        self._user_keys = {}
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @property
+    def shared(self):
+        if not self.cache_alias:
+            return None
+        return caches[self.cache_alias]
+
+    @staticmethod
+    def _detach(user, token) -> tuple:
+        """
+        Copies the cached instances so requests never share mutable objects.
+        """
+        user = copy.copy(user)
+        token = copy.copy(token)
+        token.user = user
+        return user, token
+
+    def _timeout(self, expires_at: datetime) -> int:
+        remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+        return max(0, min(self.ttl, int(remaining)))
+
+    def _local_timeout(self, timeout: int) -> int:
+        if self.shared is None:
+            return min(timeout, self.local_ttl)
+        return timeout
+
+    def _generation_key(self, user_id) -> str:
+        return f"{self.GENERATION_PREFIX}{user_id}"
+
+    def get_generation(self, user_id) -> int:
+        if self.shared is None:
+            return 0
+        return self.shared.get(self._generation_key(user_id), 0)
+
+    def _store_local(self, key: str, entry: tuple, timeout: int):
+        user = entry[0]
+        now = time.monotonic()
+        with self._lock:
+            self._local[key] = (now + timeout, now, entry)
+            self._local.move_to_end(key)
+            self._user_keys.setdefault(user.pk, set()).add(key)
+            while len(self._local) > self.max_size:
+                evicted_key, (_, _, evicted) = self._local.popitem(last=False)
+                self._forget_user_key(evicted[0].pk, evicted_key)
+
+    def _forget_user_key(self, user_id, key: str):
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+    def _drop_local(self, key: str):
+        with self._lock:
+            cached = self._local.pop(key, None)
+            if cached is not None:
+                self._forget_user_key(cached[2][0].pk, key)
+
+    def get(self, key: str) -> Optional[tuple]:
+        """
+        Returns a copy of the cached ``(user, token, expires_at)`` tuple or None.
+        """
+        entry = None
+        check_generation = False
+        now = time.monotonic()
+        with self._lock:
+            cached = self._local.get(key)
+            if cached is not None:
+                deadline, checked_at, entry = cached
+                if deadline < now:
+                    del self._local[key]
+                    self._forget_user_key(entry[0].pk, key)
+                    entry = None
+                elif now - checked_at >= self.generation_check_interval:
+                    check_generation = True
+
+        if check_generation:
+            if entry[3] != self.get_generation(entry[0].pk):
+                # Invalidated by another process
+                self._drop_local(key)
+                entry = None
+            else:
+                with self._lock:
+                    if key in self._local:
+                        self._local[key] = (deadline, now, entry)
+        tier = "local"
+
+        if entry is None and self.shared is not None:
+            tier = "shared"
+            entry = self.shared.get(self.KEY_PREFIX + key)
+            if entry is not None and entry[3] != self.get_generation(entry[0].pk):
+                entry = None
+            if entry is not None:
+                self._store_local(
+                    key, entry, self._local_timeout(self._timeout(entry[2]))
+                )
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            elif tier == "local":
+                self.local_hits += 1
+            else:
+                self.shared_hits += 1
+        if entry is None:
+            return None
+
+        user, token, expires_at, _ = entry
+        return (*self._detach(user, token), expires_at)
+
+    def set(self, key: str, user, token, expires_at: datetime, generation=None):
+        """
+        Caches a resolved token. ``generation`` should be read before the user
+        was loaded, otherwise an invalidation in between is missed and the
+        loaded, already outdated user is cached as current.
+        """
+        timeout = self._timeout(expires_at)
+        if timeout <= 0:
+            return
+        if generation is None:
+            generation = self.get_generation(user.pk)
+        entry = (*self._detach(user, token), expires_at, generation)
+        self._store_local(key, entry, self._local_timeout(timeout))
+        if self.shared is not None:
+            self.shared.set(self.KEY_PREFIX + key, entry, timeout)
+
+    def invalidate(self, *keys: str):
+        for key in keys:
+            self._drop_local(key)
+        if self.shared is not None and keys:
+            self.shared.delete_many([self.KEY_PREFIX + key for key in keys])
+
+    def invalidate_user(self, user_id):
+        """
+        Drops every cached token of a user, in every process sharing the cache.
+        """
+        if self.shared is not None:
+            generation_key = self._generation_key(user_id)
+            if not self.shared.add(generation_key, 1, None):
+                try:
+                    self.shared.incr(generation_key)
+                except ValueError:
+                    # Evicted between add and incr
+                    self.shared.set(generation_key, 1, None)
+        with self._lock:
+            local_keys = set(self._user_keys.get(user_id, ()))
+        for key in local_keys:
+            self._drop_local(key)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self._user_keys.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            local_hits, shared_hits, misses = (
+                self.local_hits,
+                self.shared_hits,
+                self.misses,
+            )
+            size = len(self._local)
+        hits = local_hits + shared_hits
+        lookups = hits + misses
+        return {
+            "local_hits": local_hits,
+            "shared_hits": shared_hits,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "size": size,
+        }
+
+
+token_cache = TokenCache()
+
+
 class CustomTokenAuthentication(TokenAuthentication):
     keyword = "Bearer"
+    cache = token_cache
+
+    def get_expiration_time(self, token) -> datetime:
+        return token.created + timedelta(
+            seconds=settings.USER_AUTH_TOKEN_EXPIRATION_SECONDS
+        )
 
     def expires_in(self, token):
         time_elapsed = datetime.now(timezone.utc) - token.created
@@ -43,21 +361,59 @@ class CustomTokenAuthentication(TokenAuthentication):
         return self.expires_in(token) < timedelta(seconds=0)
 
     def authenticate_credentials(self, key):
+        cached = self.cache.get(key)
+        if cached is not None:
+            user, token, expires_at = cached
+            if expires_at > datetime.now(timezone.utc):
+                return (user, token)
+            self.cache.invalidate(key)
+
+        generation = 0
+        if self.cache.shared is not None:
+            # Read before the user is loaded, so an invalidation racing with
+            # the query leaves the cached entry outdated instead of current
+            user_id = (
+                self.get_model()
+                .objects.filter(key=key)
+                .values_list("user_id", flat=True)
+                .first()
+            )
+            if user_id is None:
+                raise AuthenticationFailed("Invalid token.")
+            generation = self.cache.get_generation(user_id)
+
         try:
-            token = self.get_model().objects.get(key=key)
+            token = self.get_model().objects.select_related("user").get(key=key)
         except self.get_model().DoesNotExist:
             raise AuthenticationFailed("Invalid token.")
 
-        if not token.user.is_active:
+        if not token.user.is_active or token.user.is_deleted:
             raise AuthenticationFailed("User inactive or deleted.")
 
         if self.is_expired(token):
-            token.delete()
             raise AuthenticationFailed("Token expired.")
 
+        self.cache.set(
+            key, token.user, token, self.get_expiration_time(token), generation
+        )
         return (token.user, token)
 
 
+class MetricsTokenAuthentication(CustomTokenAuthentication):
+    """
+    Accepts the static METRICS_TOKEN of the Prometheus scraper, falling back
+    to regular user tokens.
+    """
+
+    def authenticate_credentials(self, key):
+        # Bytes, compare_digest rejects str with non-ASCII characters
+        if settings.METRICS_TOKEN and hmac.compare_digest(
+            key.encode(), settings.METRICS_TOKEN.encode()
+        ):
+            return (AnonymousUser(), "metrics")
+        return super().authenticate_credentials(key)
+
+
 class ExpiringActivationTokenGenerator:
     FERNET_KEY = settings.FERNET_KEY
     fernet = Fernet(FERNET_KEY)
@@ -1,6 +1,13 @@
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import exception_handler
-from rest_framework.exceptions import ErrorDetail
+from rest_framework.exceptions import APIException, ErrorDetail
+
+
+class FileTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Uploaded file is too large."
+    default_code = "file_too_large"
 
 
 def recursive_error_message_creator(error_dict):
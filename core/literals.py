@@ -1 +1,5 @@
 PROFILE_PHOTO_DIRECTORY = "profile_photo"
+PROFILE_PHOTO_VARIANT_SIZES = {"thumbnail": 128, "medium": 512}
+PROFILE_PHOTO_VARIANT_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+# Pillow formats accepted for profile photos and the extension they are stored with
+PROFILE_PHOTO_FORMATS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.modelutils import delete_queued_files
+
+
+class Command(BaseCommand):
+    help = "Deletes the files queued for deletion once their transaction committed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--max-attempts", type=int)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait when the queue is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                report = delete_queued_files(
+                    batch_size=options["batch_size"],
+                    max_attempts=options["max_attempts"],
+                )
+            except Exception as exc:
+                self.stderr.write(self.style.ERROR(f"Deletion batch failed: {exc}"))
+                report = {"deleted": 0, "failed": 0}
+                if options["once"]:
+                    raise
+
+            if report["deleted"] or report["failed"]:
+                self.stdout.write(
+                    "Deleted {deleted} files, {failed} failed".format(**report)
+                )
+            elif options["once"]:
+                break
+            else:
+                time.sleep(options["poll_interval"])
@@ -0,0 +1,119 @@
+import fnmatch
+import io
+import os
+import pstats
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Lists, aggregates and diffs the request profiles written by "
+        "ProfilingMiddleware. Profiles are selected by view name or by a glob "
+        "of file names, e.g. 'user-list' or '20261018*'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["list", "aggregate", "diff"])
+        parser.add_argument(
+            "selectors",
+            nargs="*",
+            help="list/aggregate: optional selector; diff: base and target selectors.",
+        )
+        parser.add_argument("--directory", default=None)
+        parser.add_argument(
+            "--sort",
+            default="cumulative",
+            help="pstats sort key used by aggregate.",
+        )
+        parser.add_argument("--limit", type=int, default=30)
+
+    def get_profiles(self, directory: str, selector: str = None) -> list:
+        if not os.path.isdir(directory):
+            return []
+        profiles = sorted(
+            name for name in os.listdir(directory) if name.endswith(".prof")
+        )
+        if selector is None:
+            selected = profiles
+        elif any(character in selector for character in "*?["):
+            selected = fnmatch.filter(profiles, selector)
+        else:
+            selected = [name for name in profiles if self.get_view(name) == selector]
+        return [os.path.join(directory, name) for name in selected]
+
+    @staticmethod
+    def get_view(name: str) -> str:
+        parts = name[: -len(".prof")].split("__")
+        return parts[1] if len(parts) == 3 else ""
+
+    @staticmethod
+    def get_function_name(function: tuple) -> str:
+        file_name, line, name = function
+        if file_name == "~":
+            return name
+        return f"{file_name}:{line}({name})"
+
+    def get_average_times(self, paths: list) -> dict:
+        """
+        Returns the cumulative time of every function per profiled request.
+        """
+        stats = pstats.Stats(*paths)
+        return {
+            self.get_function_name(function): cumulative_time / len(paths)
+            for function, (_, _, _, cumulative_time, _) in stats.stats.items()
+        }
+
+    def handle(self, *args, **options):
+        directory = options["directory"] or str(settings.PROFILING_DIR)
+        selectors = options["selectors"]
+        getattr(self, f"handle_{options['action']}")(directory, selectors, options)
+
+    def handle_list(self, directory, selectors, options):
+        paths = self.get_profiles(directory, selectors[0] if selectors else None)
+        self.stdout.write(f"{'profile':<64} {'view':<32} {'seconds':>8}")
+        for path in paths[-options["limit"] :]:
+            name = os.path.basename(path)
+            seconds = pstats.Stats(path).total_tt
+            self.stdout.write(f"{name:<64} {self.get_view(name):<32} {seconds:>8.3f}")
+        self.stdout.write(f"{len(paths)} profiles")
+
+    def handle_aggregate(self, directory, selectors, options):
+        paths = self.get_profiles(directory, selectors[0] if selectors else None)
+        if not paths:
+            raise CommandError("No profile matches.")
+        self.stdout.write(f"Aggregated {len(paths)} profiles")
+        output = io.StringIO()
+        stats = pstats.Stats(*paths, stream=output)
+        stats.strip_dirs().sort_stats(options["sort"]).print_stats(options["limit"])
+        self.stdout.write(output.getvalue())
+
+    def handle_diff(self, directory, selectors, options):
+        if len(selectors) != 2:
+            raise CommandError("diff needs a base and a target selector.")
+        base_paths = self.get_profiles(directory, selectors[0])
+        target_paths = self.get_profiles(directory, selectors[1])
+        if not base_paths or not target_paths:
+            raise CommandError("Both selectors must match at least one profile.")
+
+        base = self.get_average_times(base_paths)
+        target = self.get_average_times(target_paths)
+        rows = sorted(
+            (
+                (target.get(name, 0.0) - base.get(name, 0.0), name)
+                for name in base.keys() | target.keys()
+            ),
+            key=lambda row: abs(row[0]),
+            reverse=True,
+        )
+        self.stdout.write(
+            f"Cumulative seconds per request, {len(base_paths)} base and "
+            f"{len(target_paths)} target profiles"
+        )
+        self.stdout.write(f"{'base':>9} {'target':>9} {'delta':>9}  function")
+        for delta, name in rows[: options["limit"]]:
+            self.stdout.write(
+                f"{base.get(name, 0.0):>9.4f} {target.get(name, 0.0):>9.4f} "
+                f"{delta:>+9.4f}  {name}"
+            )
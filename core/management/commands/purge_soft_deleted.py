@@ -0,0 +1,60 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import CoreModel
+from core.utils import purge_soft_deleted
+
+
+class Command(BaseCommand):
+    help = "Hard deletes soft deleted rows past the retention window in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "models",
+            nargs="*",
+            metavar="app_label.ModelName",
+            help="Models to purge, every CoreModel subclass by default.",
+        )
+        parser.add_argument("--retention-days", type=int, default=None)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--max-batches", type=int, default=None)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.0,
+            help="Seconds to pause between batches.",
+        )
+
+    def get_models(self, labels: list) -> list:
+        if not labels:
+            return [
+                model for model in apps.get_models() if issubclass(model, CoreModel)
+            ]
+        models = []
+        for label in labels:
+            try:
+                model = apps.get_model(label)
+            except (LookupError, ValueError) as exc:
+                raise CommandError(str(exc))
+            if not issubclass(model, CoreModel):
+                raise CommandError(f"{label} is not a CoreModel.")
+            models.append(model)
+        return models
+
+    def handle(self, *args, **options):
+        for model in self.get_models(options["models"]):
+            report = purge_soft_deleted(
+                model,
+                retention_days=options["retention_days"],
+                batch_size=options["batch_size"],
+                max_batches=options["max_batches"],
+                sleep_seconds=options["sleep"],
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    "{label}: deleted {deleted} rows in {batches} batches "
+                    "({seconds:.2f}s, {rows_per_second:.0f} rows/s)".format(
+                        label=model._meta.label, **report
+                    )
+                )
+            )
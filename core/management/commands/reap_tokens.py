@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.utils import reap_expired_tokens
+
+
+class Command(BaseCommand):
+    help = "Deletes expired authentication tokens in bounded batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--max-batches", type=int, default=None)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.0,
+            help="Seconds to pause between batches.",
+        )
+
+    def handle(self, *args, **options):
+        report = reap_expired_tokens(
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+            sleep_seconds=options["sleep"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Deleted {deleted} expired tokens in {batches} batches "
+                "({seconds:.2f}s, {rows_per_second:.0f} rows/s)".format(**report)
+            )
+        )
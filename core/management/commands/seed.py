@@ -0,0 +1,210 @@
+import io
+import re
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.db.models import BigIntegerField, Max
+from django.db.models.functions import Cast, Substr
+from rest_framework.authtoken.models import Token
+
+from core.literals import PROFILE_PHOTO_DIRECTORY
+from core.utils import default_uuid
+
+PHOTO_COLORS = [(200, 60, 60), (60, 160, 80), (60, 90, 200), (220, 180, 40)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates COUNT synthetic users named <prefix>-<n> with bulk inserts, "
+        "for benchmarks and capacity tests. Seeding starts after the highest "
+        "index already seeded with the same prefix, so an interrupted run "
+        "resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int, help="Total users to seed.")
+        parser.add_argument("--prefix", default="seed")
+        parser.add_argument("--password", default="password")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--tokens",
+            action="store_true",
+            help="Create an auth token for every user.",
+        )
+        parser.add_argument(
+            "--photos",
+            action="store_true",
+            help="Write a small generated profile photo for every user.",
+        )
+
+    def get_photos(self) -> list:
+        from PIL import Image
+
+        photos = []
+        for color in PHOTO_COLORS:
+            buffer = io.BytesIO()
+            Image.new("RGB", (64, 64), color).save(buffer, "PNG")
+            photos.append(buffer.getvalue())
+        return photos
+
+    def set_sqlite_pragmas(self, connection):
+        # The seeded database is disposable, trade durability for speed
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous = OFF")
+            cursor.execute("PRAGMA temp_store = MEMORY")
+            cursor.execute("PRAGMA cache_size = -65536")
+
+    @staticmethod
+    def get_row_template(instance, connection) -> dict:
+        """
+        Returns the database values of every column of ``instance``, prepared
+        the way ``bulk_create`` prepares them for each row.
+        """
+        return {
+            field.column: field.get_db_prep_save(
+                field.pre_save(instance, True), connection
+            )
+            for field in instance._meta.concrete_fields
+        }
+
+    @staticmethod
+    def insert_rows(connection, model, columns: list, rows: list):
+        quote_name = connection.ops.quote_name
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            quote_name(model._meta.db_table),
+            ", ".join(quote_name(column) for column in columns),
+            ", ".join(["%s"] * len(columns)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    def create_batch(self, start: int, stop: int, password: str, options) -> int:
+        """
+        Inserts users ``start`` to ``stop``. Only the id, names and photo
+        differ between seeded users, so every other column is prepared once
+        per batch instead of once per row.
+        """
+        User = get_user_model()
+        prefix = options["prefix"]
+        connection = connections[router.db_for_write(User)]
+        template = self.get_row_template(
+            User(password=password, is_active=True), connection
+        )
+        varying_fields = [
+            User._meta.get_field(name)
+            for name in ("id", "email", "username", "full_name", "_profile_photo")
+        ]
+        for field in varying_fields:
+            del template[field.column]
+        columns = [field.column for field in varying_fields] + list(template)
+        constant_values = tuple(template.values())
+        id_field = User._meta.pk
+
+        rows = []
+        user_ids = []
+        photos = []
+        try:
+            for index in range(start, stop):
+                user_id = id_field.get_db_prep_save(default_uuid(), connection)
+                photo = None
+                if options["photos"]:
+                    photo = default_storage.save(
+                        f"{PROFILE_PHOTO_DIRECTORY}/{user_id}_seed.png",
+                        ContentFile(self.photos[index % len(self.photos)]),
+                    )
+                    photos.append(photo)
+                rows.append(
+                    (
+                        user_id,
+                        f"{prefix}-{index}@example.com",
+                        f"{prefix}-{index}",
+                        f"Seeded User {index}",
+                        photo,
+                    )
+                    + constant_values
+                )
+                user_ids.append(user_id)
+
+            with transaction.atomic(using=connection.alias):
+                self.insert_rows(connection, User, columns, rows)
+                if options["tokens"]:
+                    token_template = self.get_row_template(Token(), connection)
+                    del token_template["key"], token_template["user_id"]
+                    token_values = tuple(token_template.values())
+                    self.insert_rows(
+                        connection,
+                        Token,
+                        ["key", "user_id"] + list(token_template),
+                        [
+                            (Token.generate_key(), user_id) + token_values
+                            for user_id in user_ids
+                        ],
+                    )
+        except BaseException:
+            # No row references the photos of a batch that was not inserted
+            for photo in photos:
+                default_storage.delete(photo)
+            raise
+        return len(rows)
+
+    @staticmethod
+    def get_next_index(User, prefix: str) -> int:
+        """
+        Returns the index following the highest one seeded with ``prefix``.
+        Unlike a count it is not thrown off by seeded users deleted since or
+        by other users whose name starts with the prefix.
+        """
+        highest = (
+            User.all_objects.filter(username__regex=rf"^{re.escape(prefix)}-[0-9]+$")
+            .annotate(
+                index=Cast(Substr("username", len(prefix) + 2), BigIntegerField())
+            )
+            .aggregate(highest=Max("index"))["highest"]
+        )
+        return 0 if highest is None else highest + 1
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive.")
+        User = get_user_model()
+        total = options["count"]
+        prefix = options["prefix"]
+        done = self.get_next_index(User, prefix)
+        if done >= total:
+            self.stdout.write(f"Users up to {prefix}-{done - 1} exist already.")
+            return
+        if done:
+            self.stdout.write(f"Resuming at {prefix}-{done}.")
+
+        connection = connections[router.db_for_write(User)]
+        # SQLite refuses to change the pragmas inside a transaction
+        if connection.vendor == "sqlite" and not connection.in_atomic_block:
+            self.set_sqlite_pragmas(connection)
+        # Hashing is the expensive part of creating a user, do it once
+        password = make_password(options["password"])
+        if options["photos"]:
+            self.photos = self.get_photos()
+
+        started_at = reported_at = time.perf_counter()
+        created = 0
+        while done < total:
+            stop = min(done + options["batch_size"], total)
+            created += self.create_batch(done, stop, password, options)
+            done = stop
+            now = time.perf_counter()
+            if now - reported_at >= 1 or done == total:
+                reported_at = now
+                self.stdout.write(
+                    f"{done}/{total} users ({created / (now - started_at):.0f} rows/s)"
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {created} users in {time.perf_counter() - started_at:.1f}s"
+            )
+        )
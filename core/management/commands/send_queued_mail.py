@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.modelutils import send_queued_mail
+
+
+class Command(BaseCommand):
+    help = "Delivers the emails waiting in the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--max-attempts", type=int, default=None)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait when the outbox is empty.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once no due email is left instead of polling.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                report = send_queued_mail(
+                    batch_size=options["batch_size"],
+                    max_attempts=options["max_attempts"],
+                )
+            except Exception as exc:
+                self.stderr.write(self.style.ERROR(f"Outbox batch failed: {exc}"))
+                report = {"sent": 0, "failed": 0}
+                if options["once"]:
+                    raise
+
+            if report["sent"] or report["failed"]:
+                self.stdout.write(
+                    "Sent {sent} emails, {failed} failed".format(**report)
+                )
+            elif options["once"]:
+                break
+            else:
+                time.sleep(options["poll_interval"])
@@ -0,0 +1,106 @@
+import os
+import time
+from functools import reduce
+from itertools import islice
+from operator import or_
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.literals import PROFILE_PHOTO_DIRECTORY
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes files in MEDIA_ROOT/profile_photo that no user references, "
+        "in bounded batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--grace-seconds",
+            type=int,
+            default=3600,
+            help="Skip files modified more recently, their row may not be committed yet.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the orphaned files.",
+        )
+
+    def get_referenced(self, names: list) -> set:
+        """
+        Returns the names of the batch that are still in use: originals stored
+        on a user, and variants (``<stem>__<size>.<format>``) of such originals.
+        """
+        originals, stems = [], set()
+        for name in names:
+            if "__" in os.path.basename(name):
+                stems.add(name.rpartition("__")[0])
+            else:
+                originals.append(name)
+
+        referenced = set(
+            User.all_objects.filter(_profile_photo__in=originals).values_list(
+                "_profile_photo", flat=True
+            )
+        )
+        if stems:
+            referenced_stems = {
+                os.path.splitext(name)[0]
+                for name in User.all_objects.filter(
+                    reduce(
+                        or_,
+                        (Q(_profile_photo__startswith=f"{stem}.") for stem in stems),
+                    )
+                ).values_list("_profile_photo", flat=True)
+            }
+            referenced.update(
+                name for name in names if name.rpartition("__")[0] in referenced_stems
+            )
+        return referenced
+
+    def handle(self, *args, **options):
+        directory = default_storage.path(PROFILE_PHOTO_DIRECTORY)
+        if not os.path.isdir(directory):
+            self.stdout.write("Nothing to sweep")
+            return
+
+        cutoff = time.time() - options["grace_seconds"]
+        report = {"scanned": 0, "orphaned": 0, "batches": 0}
+        with os.scandir(directory) as entries:
+            files = (
+                entry
+                for entry in entries
+                if entry.is_file() and entry.stat().st_mtime < cutoff
+            )
+            while True:
+                batch = [
+                    f"{PROFILE_PHOTO_DIRECTORY}/{entry.name}"
+                    for entry in islice(files, options["batch_size"])
+                ]
+                if not batch:
+                    break
+                report["batches"] += 1
+                report["scanned"] += len(batch)
+                referenced = self.get_referenced(batch)
+                for name in batch:
+                    if name in referenced:
+                        continue
+                    report["orphaned"] += 1
+                    if options["dry_run"]:
+                        self.stdout.write(name)
+                    else:
+                        default_storage.delete(name)
+
+        action = "Found" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                "{action} {orphaned} orphaned files out of {scanned} "
+                "in {batches} batches".format(action=action, **report)
+            )
+        )
@@ -0,0 +1,63 @@
+"""
+Prometheus metrics. When PROMETHEUS_MULTIPROC_DIR is set before the workers
+start, every process writes its samples to memory-mapped files in that
+directory and the ``/metrics`` view aggregates them.
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by view class.",
+    ["view", "method"],
+)
+RESPONSES = Counter(
+    "http_responses_total",
+    "Responses by view class and status code.",
+    ["view", "method", "status"],
+)
+PASSWORD_HASHING_LATENCY = Histogram(
+    "password_hashing_duration_seconds",
+    "Time spent hashing or verifying a password.",
+    ["operation"],
+)
+PAGINATION_COUNT_LATENCY = Histogram(
+    "pagination_count_duration_seconds",
+    "Time spent counting the results of a paginated list.",
+    ["strategy"],
+)
+EMAIL_SEND_LATENCY = Histogram(
+    "email_send_duration_seconds",
+    "Time spent in a single email send call, by delivery path.",
+    ["path"],
+)
+EMAILS_SENT = Counter(
+    "emails_sent_total",
+    "Emails handed to the email backend, by delivery path and result.",
+    ["path", "result"],
+)
+
+
+def get_registry():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics() -> tuple:
+    """
+    Returns the metrics of every worker in the text exposition format and
+    their content type.
+    """
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,309 @@
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.exceptions import APIException
+
+from .classes import CustomTokenAuthentication
+from .metrics import REQUEST_LATENCY, RESPONSES
+from .permissions import AdminPermission
+
+logger = logging.getLogger("core.instrumentation")
+
+_current_state = contextvars.ContextVar("query_instrumentation_state", default=None)
+
+FINGERPRINT_SUBSTITUTIONS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def get_query_fingerprint(sql: str) -> str:
+    """
+    Normalises a query so executions differing only in their parameters
+    share one fingerprint.
+    """
+    for pattern, replacement in FINGERPRINT_SUBSTITUTIONS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self.fingerprints = Counter()
+        self.view_started_at = None
+        self.render_started_at = None
+        self.render_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializer_depth = 0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started_at
+            self.query_count += 1
+            self.fingerprints[get_query_fingerprint(sql)] += 1
+
+
+def timed_to_representation(to_representation):
+    """
+    Wraps a serializer ``to_representation`` so the outermost call of each
+    instrumented request is added to its serializer time.
+    """
+
+    def wrapper(self, *args, **kwargs):
+        state = _current_state.get()
+        if state is None:
+            return to_representation(self, *args, **kwargs)
+        state.serializer_depth += 1
+        started_at = time.perf_counter()
+        try:
+            return to_representation(self, *args, **kwargs)
+        finally:
+            state.serializer_depth -= 1
+            if not state.serializer_depth:
+                state.serializer_seconds += time.perf_counter() - started_at
+
+    wrapper.__wrapped__ = to_representation
+    return wrapper
+
+
+def instrument_serializers():
+    from rest_framework.serializers import ListSerializer, Serializer
+
+    for serializer_class in (Serializer, ListSerializer):
+        method = serializer_class.to_representation
+        if not hasattr(method, "__wrapped__"):
+            serializer_class.to_representation = timed_to_representation(method)
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records the query count, database time, repeated query fingerprints and
+    the view, serializer and render time of every request. The timings are
+    sent in a Server-Timing header and a structured log line, and a sample of
+    requests is written as a JSON report to QUERY_INSTRUMENTATION_REPORT_DIR.
+    A fingerprint executed at least QUERY_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD
+    times in one request is reported as a likely N+1 pattern.
+    Removed from the middleware chain unless QUERY_INSTRUMENTATION_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        if not settings.QUERY_INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.n_plus_one_threshold = settings.QUERY_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD
+        self.report_directory = settings.QUERY_INSTRUMENTATION_REPORT_DIR
+        self.sample_rate = settings.QUERY_INSTRUMENTATION_SAMPLE_RATE
+        instrument_serializers()
+
+    def __call__(self, request):
+        state = RequestTimings()
+        token = _current_state.set(state)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(state.execute_wrapper)
+                    )
+                response = self.get_response(request)
+        finally:
+            _current_state.reset(token)
+
+        self.report(request, response, state)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _current_state.get()
+        if state is not None:
+            state.view_started_at = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        state = _current_state.get()
+        if state is not None:
+            state.render_started_at = time.perf_counter()
+
+            def finish_render(response):
+                state.render_seconds = time.perf_counter() - state.render_started_at
+
+            response.add_post_render_callback(finish_render)
+        return response
+
+    def get_report(self, request, response, state: RequestTimings) -> dict:
+        finished_at = time.perf_counter()
+        total_seconds = finished_at - state.started_at
+        view_seconds = 0.0
+        if state.view_started_at is not None:
+            # Without a template response the view runs until the end
+            view_finished_at = state.render_started_at or finished_at
+            view_seconds = view_finished_at - state.view_started_at
+        duplicates = [
+            {"fingerprint": fingerprint, "count": count}
+            for fingerprint, count in state.fingerprints.most_common()
+            if count >= self.n_plus_one_threshold
+        ]
+        resolver_match = getattr(request, "resolver_match", None)
+        return {
+            "method": request.method,
+            "path": request.path,
+            "view": resolver_match.view_name if resolver_match else None,
+            "status": response.status_code,
+            "queries": state.query_count,
+            "db_ms": round(state.db_seconds * 1000, 2),
+            "view_ms": round(view_seconds * 1000, 2),
+            "serializer_ms": round(state.serializer_seconds * 1000, 2),
+            "render_ms": round(state.render_seconds * 1000, 2),
+            "total_ms": round(total_seconds * 1000, 2),
+            "n_plus_one": duplicates,
+        }
+
+    def report(self, request, response, state: RequestTimings):
+        report = self.get_report(request, response, state)
+        server_timing = [
+            f'db;dur={report["db_ms"]};desc="{report["queries"]} queries"',
+            f'view;dur={report["view_ms"]}',
+            f'serializer;dur={report["serializer_ms"]}',
+            f'render;dur={report["render_ms"]}',
+            f'total;dur={report["total_ms"]}',
+        ]
+        if response.has_header("Server-Timing"):
+            # Keep metrics added by inner middleware such as the debug toolbar
+            server_timing.append(response["Server-Timing"])
+        response["Server-Timing"] = ", ".join(server_timing)
+        level = logging.WARNING if report["n_plus_one"] else logging.INFO
+        logger.log(level, json.dumps(report))
+
+        if self.report_directory and random.random() < self.sample_rate:
+            report["fingerprints"] = dict(state.fingerprints.most_common())
+            self.write_report(report)
+
+    def write_report(self, report: dict):
+        os.makedirs(self.report_directory, exist_ok=True)
+        file_name = "{}_{}.json".format(
+            time.strftime("%Y%m%d%H%M%S"), uuid.uuid4().hex[:8]
+        )
+        with open(os.path.join(self.report_directory, file_name), "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+
+class MetricsMiddleware:
+    """
+    Records request latency and response status counts per view class in
+    the Prometheus metrics. Removed from the chain unless METRICS_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started_at = time.perf_counter()
+        response = self.get_response(request)
+        view = getattr(request, "metrics_view_name", "unresolved")
+        REQUEST_LATENCY.labels(view, request.method).observe(
+            time.perf_counter() - started_at
+        )
+        RESPONSES.labels(view, request.method, response.status_code).inc()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, "cls", None) or getattr(
+            view_func, "view_class", None
+        )
+        request.metrics_view_name = (
+            view_class.__name__ if view_class else view_func.__name__
+        )
+
+
+class ProfilingMiddleware:
+    """
+    Runs cProfile for a PROFILING_SAMPLE_RATE share of requests, and for
+    requests of admin users sending the PROFILING_HEADER header. Profiles
+    are stored in PROFILING_DIR as ``<timestamp>__<view>__<id>.prof``, only
+    the newest PROFILING_MAX_FILES are kept; the ``profiles`` command lists,
+    aggregates and diffs them. Removed from the chain unless
+    PROFILING_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+        self.directory = str(settings.PROFILING_DIR)
+        self.max_files = settings.PROFILING_MAX_FILES
+        self.header = "HTTP_" + settings.PROFILING_HEADER.upper().replace("-", "_")
+
+    def is_requested_by_admin(self, request) -> bool:
+        if not request.META.get(self.header):
+            return False
+        try:
+            credentials = CustomTokenAuthentication().authenticate(request)
+        except APIException:
+            return False
+        return credentials is not None and AdminPermission.is_admin(credentials[0])
+
+    def __call__(self, request):
+        if not (
+            random.random() < self.sample_rate or self.is_requested_by_admin(request)
+        ):
+            return self.get_response(request)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.disable()
+
+        response["X-Profile-Id"] = self.save(request, profile)
+        return response
+
+    def save(self, request, profile: cProfile.Profile) -> str:
+        resolver_match = getattr(request, "resolver_match", None)
+        view = resolver_match.view_name if resolver_match else "unresolved"
+        file_name = "{}__{}__{}.prof".format(
+            time.strftime("%Y%m%d%H%M%S"),
+            re.sub(r"[^A-Za-z0-9_.-]", "_", view or "unnamed"),
+            uuid.uuid4().hex[:8],
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, file_name)
+        profile.dump_stats(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        self.prune()
+        return file_name
+
+    def prune(self):
+        profiles = sorted(
+            name for name in os.listdir(self.directory) if name.endswith(".prof")
+        )
+        for name in profiles[: max(len(profiles) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+INDEX = models.Index(fields=["created"], name="authtoken_token_created_idx")
+
+
+def add_token_created_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model("authtoken", "Token"), INDEX)
+
+
+def remove_token_created_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model("authtoken", "Token"), INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authtoken", "0003_tokenproxy"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_token_created_index, remove_token_created_index),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:03
+
+import core.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_pendingfiledeletion"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="bulkmailcheckpoint",
+            name="id",
+            field=models.UUIDField(
+                default=core.utils.default_uuid,
+                editable=False,
+                primary_key=True,
+                serialize=False,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="contentblob",
+            name="id",
+            field=models.UUIDField(
+                default=core.utils.default_uuid,
+                editable=False,
+                primary_key=True,
+                serialize=False,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="emailoutbox",
+            name="id",
+            field=models.UUIDField(
+                default=core.utils.default_uuid,
+                editable=False,
+                primary_key=True,
+                serialize=False,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="pendingfiledeletion",
+            name="id",
+            field=models.UUIDField(
+                default=core.utils.default_uuid,
+                editable=False,
+                primary_key=True,
+                serialize=False,
+            ),
+        ),
+    ]
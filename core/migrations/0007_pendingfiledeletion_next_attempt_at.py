@@ -0,0 +1,25 @@
+# Generated by Django 3.2.15 on 2026-10-18 19:56
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_uuid_default"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pendingfiledeletion",
+            name="next_attempt_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, verbose_name="next attempt at"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="pendingfiledeletion",
+            index=models.Index(fields=["next_attempt_at"], name="core_filedel_due_idx"),
+        ),
+    ]
@@ -1,13 +1,32 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.generics import get_object_or_404
 
+from .modelutils import touch_auto_now_fields
+
 
 class CustomListUpdateModelMixin:
     """
     Updates a list of model instances.
+    With ``bulk_update_mode`` enabled the rows are fetched in one query, every
+    item is validated before anything is written and the changes are stored
+    with ``bulk_create``/``bulk_update`` in batches of ``bulk_update_batch_size``
+    inside a single transaction. Ids given more than once are rejected and
+    unique collisions among the written rows are reported as validation
+    errors. Only the touched rows are returned. The bulk mode writes concrete
+    fields only, serializers with nested or many-to-many writes must use the
+    default mode.
     """
 
+    bulk_update_mode = False
+    bulk_update_batch_size = 500
+
     def update(self, request, *args, **kwargs):
+        if self.bulk_update_mode:
+            return self.bulk_update(request, *args, **kwargs)
+
         partial = kwargs.pop("partial", False)
         data = request.data
         for instance_data in data:
@@ -28,6 +47,100 @@ class CustomListUpdateModelMixin:
     def perform_update(self, serializer):
         serializer.save()
 
+    def get_bulk_ids(self, data) -> list:
+        """
+        Returns the primary key of every item, ``None`` for items to create.
+        Rejects anything but a list of objects and ids given more than once.
+        """
+        if not isinstance(data, list):
+            raise ValidationError("Expected a list of items.")
+        pk_field = self.get_queryset().model._meta.pk
+        ids, seen, errors = [], set(), {}
+        for index, item in enumerate(data):
+            if not isinstance(item, dict):
+                errors[str(index)] = ["Expected an object."]
+                ids.append(None)
+                continue
+            try:
+                id = pk_field.to_python(item.get("id"))
+            except DjangoValidationError:
+                errors[str(index)] = {"id": ["Invalid id."]}
+                id = None
+            if id is not None and id in seen:
+                errors[str(index)] = {"id": ["Duplicate id."]}
+            elif id is not None:
+                seen.add(id)
+            ids.append(id)
+        if errors:
+            raise ValidationError(errors)
+        return ids
+
+    def get_bulk_instances(self, ids) -> dict:
+        queryset = self.get_queryset().filter(
+            id__in=[id for id in ids if id is not None]
+        )
+        return {instance.pk: instance for instance in queryset}
+
+    def bulk_update(self, request, *args, **kwargs):
+        partial = kwargs.pop("partial", False)
+        data = request.data
+        ids = self.get_bulk_ids(data)
+        instances = self.get_bulk_instances(ids)
+
+        serializers = []
+        errors = {}
+        for index, (id, instance_data) in enumerate(zip(ids, data)):
+            instance_data = dict(instance_data)
+            instance_data.pop("id", None)
+            serializer = self.get_serializer(
+                instances.get(id), data=instance_data, partial=partial
+            )
+            if serializer.is_valid():
+                serializers.append(serializer)
+            else:
+                errors[str(index)] = serializer.errors
+        if errors:
+            raise ValidationError(errors)
+
+        model = self.get_queryset().model
+        touched, to_create, to_update, update_fields = [], [], [], set()
+        for serializer in serializers:
+            instance = serializer.instance
+            if instance is None:
+                instance = model(**serializer.validated_data)
+                to_create.append(instance)
+            else:
+                for attr, value in serializer.validated_data.items():
+                    setattr(instance, attr, value)
+                update_fields.update(serializer.validated_data)
+                to_update.append(instance)
+            touched.append(instance)
+
+        if to_update and update_fields:
+            update_fields.update(touch_auto_now_fields(model, to_update))
+
+        self.perform_bulk_update(to_create, to_update, list(update_fields))
+
+        serializer = self.get_serializer(instance=touched, many=True)
+        return Response(serializer.data)
+
+    def perform_bulk_update(self, to_create: list, to_update: list, fields: list):
+        model = self.get_queryset().model
+        try:
+            with transaction.atomic():
+                if to_create:
+                    model.objects.bulk_create(
+                        to_create, batch_size=self.bulk_update_batch_size
+                    )
+                if to_update and fields:
+                    model.objects.bulk_update(
+                        to_update, fields, batch_size=self.bulk_update_batch_size
+                    )
+        except IntegrityError:
+            # Unique values repeated among the items are not caught by the
+            # per item validation
+            raise ValidationError("The items conflict with each other or stored rows.")
+
     def partial_update(self, request, *args, **kwargs):
         return self.update(request, *args, **kwargs)
 
@@ -1,38 +1,204 @@
-import uuid
+from functools import lru_cache
+
 from django.db import models, transaction
+from django.db.models import DEFERRED
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .signals import post_bulk_update, post_soft_delete
+from .utils import default_uuid
+
+
+class SoftDeleteQuerySet(models.QuerySet):
+    def alive(self):
+        return self.filter(is_deleted=False)
+
+    def dead(self):
+        return self.filter(is_deleted=True)
+
+    def soft_delete(self) -> int:
+        """
+        Marks every row of the queryset as deleted with a single UPDATE and
+        returns the number of affected rows.
+        """
+        now = timezone.now()
+        queryset = self.alive()
+        pks = None
+        if post_soft_delete.has_listeners(self.model):
+            pks = list(queryset.values_list("pk", flat=True))
+            queryset = self.model._base_manager.using(self.db).filter(pk__in=pks)
+        updated = models.QuerySet.update(
+            queryset, is_deleted=True, deleted_at=now, updated_at=now
+        )
+        if pks is not None:
+            post_soft_delete.send(sender=self.model, pks=pks, using=self.db)
+        return updated
+
+    def update(self, **kwargs) -> int:
+        """
+        Sends ``post_bulk_update`` with the primary keys of the updated rows
+        when it has listeners.
+        """
+        if not post_bulk_update.has_listeners(self.model):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list("pk", flat=True))
+            updated = self.model._base_manager.using(self.db).filter(pk__in=pks)
+            updated = models.QuerySet.update(updated, **kwargs)
+        post_bulk_update.send(sender=self.model, pks=pks, using=self.db)
+        return updated
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        objs = list(objs)
+        updated = super().bulk_update(objs, fields, batch_size=batch_size)
+        if post_bulk_update.has_listeners(self.model):
+            post_bulk_update.send(
+                sender=self.model, pks=[obj.pk for obj in objs], using=self.db
+            )
+        return updated
+
+
+class CoreManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    """
+    Default manager of CoreModel, hides soft deleted rows.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().alive()
+
+
+@lru_cache(maxsize=None)
+def get_field_names(model) -> tuple:
+    return tuple(field.name for field in model._meta.fields)
+
+
+@lru_cache(maxsize=None)
+def get_auto_now_field_names(model) -> tuple:
+    return tuple(
+        field.name
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False)
+    )
+
 
 # Create your models here.
 class CoreModel(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=default_uuid, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
 
+    objects = CoreManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
+
     @classmethod
     def get_hidden_fields(cls):
         return ["created_at", "updated_at", "is_deleted", "deleted_at"]
 
     @classmethod
-    def from_validated_data(cls, validated_data: dict, *args, **kwargs):
-        fields = [field.name for field in cls._meta.fields]
+    def get_field_names(cls) -> tuple:
+        return get_field_names(cls)
 
+    @classmethod
+    def from_validated_data(cls, validated_data: dict, *args, **kwargs):
         constructor_kwargs = {
             field: validated_data.pop(field)
-            for field in fields
+            for field in cls.get_field_names()
             if field in validated_data
         }
         return cls(**constructor_kwargs)
 
     def update_from_validated_data(self, validated_data: dict, *args, **kwargs):
-        fields = [field.name for field in self._meta.fields]
-
-        for field in fields:
+        for field in self.get_field_names():
             if field in validated_data:
                 setattr(self, field, validated_data.pop(field))
 
         self.save()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if len(values) == len(cls._meta.concrete_fields):
+            # Loaded values are in concrete field order, file fields as names
+            instance._loaded_values = tuple(values)
+        else:
+            instance.take_snapshot()
+        return instance
+
+    def get_snapshot_value(self, field):
+        value = self.__dict__.get(field.attname, DEFERRED)
+        if isinstance(value, FieldFile):
+            return value.name
+        return value
+
+    def take_snapshot(self, field_names=None):
+        """
+        Records the current column values, all of them or only ``field_names``,
+        as the state saved in the database. Values are compared by equality,
+        so in-place changes of mutable values are not detected.
+        """
+        fields = self._meta.concrete_fields
+        previous = getattr(self, "_loaded_values", None)
+        if field_names is None or previous is None:
+            self._loaded_values = tuple(
+                self.get_snapshot_value(field) for field in fields
+            )
+            return
+        self._loaded_values = tuple(
+            self.get_snapshot_value(field)
+            if field.name in field_names or field.attname in field_names
+            else value
+            for field, value in zip(fields, previous)
+        )
+
+    def get_dirty_fields(self):
+        """
+        Returns the names of the fields changed since the instance was loaded
+        or last saved, or None when the instance was never loaded or saved.
+        """
+        loaded_values = getattr(self, "_loaded_values", None)
+        if loaded_values is None:
+            return None
+        return [
+            field.name
+            for field, value in zip(self._meta.concrete_fields, loaded_values)
+            if field.attname in self.__dict__
+            and (value is DEFERRED or self.get_snapshot_value(field) != value)
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Without ``update_fields`` an existing row only gets its changed
+        columns (plus ``auto_now`` ones) written, and nothing at all when no
+        field changed.
+        """
+        if (
+            not args
+            and kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")
+            and not self._state.adding
+        ):
+            dirty_fields = self.get_dirty_fields()
+            if dirty_fields is not None and self._meta.pk.name not in dirty_fields:
+                if not dirty_fields:
+                    return
+                kwargs["update_fields"] = dirty_fields + [
+                    name
+                    for name in get_auto_now_field_names(type(self))
+                    if name not in dirty_fields
+                ]
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None and args[3:4]:
+            update_fields = args[3]
+        self.take_snapshot(update_fields)
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self.take_snapshot(fields)
+
     def __str__(self) -> str:
         return str(self.id)
 
@@ -41,3 +207,69 @@ class CoreModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class EmailOutbox(CoreModel):
+    """
+    Rendered email waiting to be delivered by the ``send_queued_mail`` worker.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", _("pending")
+        SENT = "SENT", _("sent")
+        FAILED = "FAILED", _("failed")
+
+    subject = models.CharField(_("subject"), max_length=255)
+    to_email = models.EmailField(_("to email"))
+    from_email = models.EmailField(_("from email"), blank=True, null=True)
+    body = models.TextField(_("body"))
+    status = models.CharField(
+        _("status"), max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(_("attempts"), default=0)
+    next_attempt_at = models.DateTimeField(_("next attempt at"), default=timezone.now)
+    sent_at = models.DateTimeField(_("sent at"), blank=True, null=True)
+    last_error = models.TextField(_("last error"), blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["status", "next_attempt_at"], name="core_outbox_due_idx"
+            ),
+        ]
+
+
+class BulkMailCheckpoint(CoreModel):
+    """
+    Progress of a named ``send_bulk_mail`` run, used to resume it.
+    """
+
+    name = models.CharField(_("name"), max_length=255, unique=True)
+    last_pk = models.CharField(_("last primary key"), max_length=255, blank=True)
+    sent_count = models.PositiveIntegerField(_("sent count"), default=0)
+
+
+class ContentBlob(CoreModel):
+    """
+    Reference count of a file stored by ``ContentAddressedFileSystemStorage``.
+    """
+
+    name = models.CharField(_("name"), max_length=255, unique=True)
+    size = models.BigIntegerField(_("size"), default=0)
+    refcount = models.PositiveIntegerField(_("reference count"), default=0)
+
+
+class PendingFileDeletion(CoreModel):
+    """
+    Storage name of a file to be removed by the ``delete_queued_files`` worker.
+    """
+
+    name = models.CharField(_("name"), max_length=255)
+    attempts = models.PositiveSmallIntegerField(_("attempts"), default=0)
+    next_attempt_at = models.DateTimeField(_("next attempt at"), default=timezone.now)
+    last_error = models.TextField(_("last error"), blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["next_attempt_at"], name="core_filedel_due_idx"),
+        ]
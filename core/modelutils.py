@@ -1,29 +1,371 @@
 import os
-from django.core.mail import EmailMultiAlternatives
-from django.template.loader import render_to_string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+
+from django.core.files.storage import default_storage
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template, render_to_string
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 
+from .metrics import EMAIL_SEND_LATENCY, EMAILS_SENT
+from .models import BulkMailCheckpoint, EmailOutbox, PendingFileDeletion
 
-def send_mail(subject, to_email, input_context, template_name, cc_list=[], bcc_list=[]):
-    """
-    Send Activation Email To User
-    """
+
+def get_mail_context(input_context) -> dict:
     base_url = input_context.pop("host_url")
 
-    context = {
+    return {
         "site": "template",
         "MEDIA_URL": "/".join((base_url, settings.MEDIA_URL[:-1])),
         **input_context,
     }
 
+
+def render_mail(input_context, template_name) -> str:
+    """
+    Renders an email template with the common context.
+    """
     # render email text
-    email_html_message = render_to_string(template_name, context)
+    return render_to_string(template_name, get_mail_context(input_context))
 
+
+def build_mail_message(
+    subject, to_email, email_html_message, from_email=None, connection=None
+) -> EmailMultiAlternatives:
     msg = EmailMultiAlternatives(
         subject=subject,
         body=email_html_message,
-        from_email=settings.EMAIL_HOST_USER,
+        from_email=from_email or settings.EMAIL_HOST_USER,
         to=[to_email],
+        connection=connection,
     )
     msg.attach_alternative(email_html_message, "text/html")
-    msg.send()
+    return msg
+
+
+def send_mail(subject, to_email, input_context, template_name, cc_list=[], bcc_list=[]):
+    """
+    Send Activation Email To User
+    """
+    email_html_message = render_mail(input_context, template_name)
+    try:
+        with EMAIL_SEND_LATENCY.labels("direct").time():
+            build_mail_message(subject, to_email, email_html_message).send()
+    except Exception:
+        EMAILS_SENT.labels("direct", "failed").inc()
+        raise
+    EMAILS_SENT.labels("direct", "sent").inc()
+
+
+def queue_mail(subject, to_email, input_context, template_name) -> EmailOutbox:
+    """
+    Renders an email and stores it in the outbox. The row is written in the
+    caller's transaction, so the worker only sees it once that transaction
+    commits and a rollback discards it.
+    """
+    return EmailOutbox.objects.create(
+        subject=subject,
+        to_email=to_email,
+        from_email=settings.EMAIL_HOST_USER,
+        body=render_mail(input_context, template_name),
+    )
+
+
+def claim_queued_mail(batch_size, max_attempts, lease_seconds) -> list:
+    """
+    Leases up to ``batch_size`` due outbox emails in a short transaction.
+    Their attempt is counted and ``next_attempt_at`` moves past the lease, so
+    other workers skip them while they are sent and pick them up again if
+    this worker dies before storing the result. Emails whose last attempt
+    was leased that way are marked as failed.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # The lease of the last attempt expired, the worker died while sending
+        EmailOutbox.objects.filter(
+            status=EmailOutbox.Status.PENDING,
+            next_attempt_at__lte=now,
+            attempts__gte=max_attempts,
+        ).update(
+            status=EmailOutbox.Status.FAILED,
+            last_error="The worker stopped during the last attempt.",
+        )
+        outbox = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(
+                status=EmailOutbox.Status.PENDING,
+                next_attempt_at__lte=now,
+                attempts__lt=max_attempts,
+            )
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        if not outbox:
+            return outbox
+        leased_until = now + timedelta(seconds=lease_seconds)
+        EmailOutbox.objects.filter(pk__in=[email.pk for email in outbox]).update(
+            attempts=F("attempts") + 1, next_attempt_at=leased_until
+        )
+    for email in outbox:
+        email.attempts += 1
+        email.next_attempt_at = leased_until
+    return outbox
+
+
+def send_queued_mail(
+    batch_size=100, max_attempts=None, retry_base_seconds=None, lease_seconds=None
+):
+    """
+    Sends one batch of due outbox emails over a single SMTP connection.
+    The batch is leased first and sent outside of any transaction, each
+    result is stored right after its send. Failed emails are retried with
+    exponential backoff until max_attempts.
+    Returns the number of sent and failed emails.
+    """
+    max_attempts = max_attempts or settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+    retry_base_seconds = retry_base_seconds or settings.EMAIL_OUTBOX_RETRY_SECONDS
+    lease_seconds = lease_seconds or settings.EMAIL_OUTBOX_LEASE_SECONDS
+    report = {"sent": 0, "failed": 0}
+
+    outbox = claim_queued_mail(batch_size, max_attempts, lease_seconds)
+    if not outbox:
+        return report
+
+    connection = get_connection()
+    connection.open()
+    try:
+        for email in outbox:
+            message = build_mail_message(
+                email.subject,
+                email.to_email,
+                email.body,
+                from_email=email.from_email,
+                connection=connection,
+            )
+            try:
+                with EMAIL_SEND_LATENCY.labels("outbox").time():
+                    message.send()
+            except Exception as exc:
+                EMAILS_SENT.labels("outbox", "failed").inc()
+                email.last_error = str(exc)
+                if email.attempts >= max_attempts:
+                    email.status = EmailOutbox.Status.FAILED
+                else:
+                    email.next_attempt_at = timezone.now() + timedelta(
+                        seconds=retry_base_seconds * 2 ** (email.attempts - 1)
+                    )
+                email.save(update_fields=["status", "next_attempt_at", "last_error"])
+                report["failed"] += 1
+                # The connection may be broken, start a fresh one
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    # Left closed, the next message opens its own connection
+                    pass
+            else:
+                EMAILS_SENT.labels("outbox", "sent").inc()
+                email.status = EmailOutbox.Status.SENT
+                email.sent_at = timezone.now()
+                email.save(update_fields=["status", "sent_at"])
+                report["sent"] += 1
+    finally:
+        connection.close()
+    return report
+
+
+class MailConnectionPool:
+    """
+    Gives every sending thread its own SMTP connection, opened once and
+    reused for all of the thread's batches.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def send_messages(self, messages: list) -> int:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = get_connection()
+            connection.open()
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        with EMAIL_SEND_LATENCY.labels("bulk").time():
+            sent = connection.send_messages(messages) or 0
+        EMAILS_SENT.labels("bulk", "sent").inc(sent)
+        return sent
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+def send_bulk_mail(
+    subject,
+    queryset,
+    template_name,
+    host_url,
+    get_context=lambda recipient: {},
+    get_email=lambda recipient: recipient.email,
+    common_context=None,
+    chunk_size=1000,
+    connection_count=4,
+    checkpoint_name=None,
+) -> dict:
+    """
+    Sends a templated email to every object of a queryset. The template is
+    compiled once, recipients are streamed in primary key order in chunks of
+    ``chunk_size`` and each rendered chunk is sent over ``connection_count``
+    reused connections with ``send_messages``.
+    With ``checkpoint_name`` the last sent primary key is stored after every
+    chunk and a later run with the same name resumes after it, so a crash
+    re-sends at most one chunk.
+    """
+    template = get_template(template_name)
+    base_context = get_mail_context({"host_url": host_url, **(common_context or {})})
+
+    checkpoint = None
+    queryset = queryset.order_by("pk")
+    if checkpoint_name:
+        checkpoint, _ = BulkMailCheckpoint.objects.get_or_create(name=checkpoint_name)
+        if checkpoint.last_pk:
+            queryset = queryset.filter(pk__gt=checkpoint.last_pk)
+
+    sent = 0
+    started_at = time.monotonic()
+    recipients = queryset.iterator(chunk_size=chunk_size)
+    pool = MailConnectionPool()
+    try:
+        with ThreadPoolExecutor(max_workers=connection_count) as executor:
+            while True:
+                chunk = list(islice(recipients, chunk_size))
+                if not chunk:
+                    break
+                messages = [
+                    build_mail_message(
+                        subject,
+                        get_email(recipient),
+                        template.render({**base_context, **get_context(recipient)}),
+                    )
+                    for recipient in chunk
+                ]
+                batch_size = -(-len(messages) // connection_count)
+                batches = [
+                    messages[start : start + batch_size]
+                    for start in range(0, len(messages), batch_size)
+                ]
+                chunk_sent = sum(executor.map(pool.send_messages, batches))
+                sent += chunk_sent
+
+                if checkpoint is not None:
+                    checkpoint.last_pk = str(chunk[-1].pk)
+                    checkpoint.sent_count += chunk_sent
+                    checkpoint.save(update_fields=["last_pk", "sent_count"])
+    finally:
+        pool.close()
+
+    elapsed = time.monotonic() - started_at
+    return {
+        "sent": sent,
+        "seconds": elapsed,
+        "emails_per_second": sent / elapsed if elapsed else 0.0,
+    }
+
+
+def touch_auto_now_fields(model, instances: list) -> list:
+    """
+    Refreshes ``auto_now`` fields, which ``bulk_update`` leaves untouched.
+    Returns the names of the refreshed fields.
+    """
+    fields = [
+        field
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False)
+    ]
+    for instance in instances:
+        for field in fields:
+            field.pre_save(instance, add=False)
+    return [field.name for field in fields]
+
+
+def queue_file_deletion(*names) -> list:
+    """
+    Schedules files of the default storage for deletion. Like ``queue_mail``
+    the rows are written in the caller's transaction, so a rollback keeps the
+    files and the ``delete_queued_files`` worker only removes them once the
+    transaction commits.
+    """
+    return PendingFileDeletion.objects.bulk_create(
+        [PendingFileDeletion(name=name) for name in names if name]
+    )
+
+
+def claim_queued_file_deletions(batch_size, lease_seconds) -> list:
+    """
+    Leases up to ``batch_size`` due file deletions in a short transaction,
+    like ``claim_queued_mail``. Deleting a file twice is harmless, so rows
+    leased by a worker that died are simply picked up again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        pending = list(
+            PendingFileDeletion.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        if not pending:
+            return pending
+        leased_until = now + timedelta(seconds=lease_seconds)
+        PendingFileDeletion.objects.filter(
+            pk__in=[deletion.pk for deletion in pending]
+        ).update(attempts=F("attempts") + 1, next_attempt_at=leased_until)
+    for deletion in pending:
+        deletion.attempts += 1
+        deletion.next_attempt_at = leased_until
+    return pending
+
+
+def delete_queued_files(
+    batch_size=100, max_attempts=None, retry_base_seconds=None, lease_seconds=None
+) -> dict:
+    """
+    Deletes one batch of due queued files. The batch is leased first and the
+    files are deleted outside of any transaction. Failed deletions are
+    retried with exponential backoff and dropped after ``max_attempts``.
+    Returns the number of deleted and failed files.
+    """
+    max_attempts = max_attempts or settings.FILE_DELETION_MAX_ATTEMPTS
+    retry_base_seconds = retry_base_seconds or settings.FILE_DELETION_RETRY_SECONDS
+    lease_seconds = lease_seconds or settings.FILE_DELETION_LEASE_SECONDS
+    report = {"deleted": 0, "failed": 0}
+
+    done = []
+    for deletion in claim_queued_file_deletions(batch_size, lease_seconds):
+        try:
+            default_storage.delete(deletion.name)
+        except Exception as exc:
+            report["failed"] += 1
+            if deletion.attempts >= max_attempts:
+                done.append(deletion.pk)
+                continue
+            deletion.last_error = str(exc)
+            deletion.next_attempt_at = timezone.now() + timedelta(
+                seconds=retry_base_seconds * 2 ** (deletion.attempts - 1)
+            )
+            deletion.save(update_fields=["next_attempt_at", "last_error"])
+        else:
+            done.append(deletion.pk)
+            report["deleted"] += 1
+
+    PendingFileDeletion.objects.filter(pk__in=done).delete()
+    return report
@@ -1,8 +1,177 @@
-from typing import OrderedDict
-from rest_framework.pagination import LimitOffsetPagination
+import base64
+import binascii
+import hashlib
+import json
+from collections import OrderedDict
+from functools import reduce
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .metrics import PAGINATION_COUNT_LATENCY
+
+
+class ExactCountStrategy:
+    """
+    Runs ``COUNT(*)`` over the filtered queryset.
+    """
+
+    def get_count(self, queryset) -> tuple:
+        return queryset.count(), True
+
+
+class CachedCountStrategy(ExactCountStrategy):
+    """
+    Caches the exact count per filter fingerprint, the fingerprint being the
+    compiled SQL of the queryset without its ordering.
+    """
+
+    KEY_PREFIX = "pagination_count:"
+
+    def __init__(self, ttl=None, cache_alias=None):
+        self.ttl = settings.PAGINATION_COUNT_CACHE_TTL_SECONDS if ttl is None else ttl
+        self.cache = caches[cache_alias or settings.PAGINATION_COUNT_CACHE_ALIAS]
+
+    def get_fingerprint(self, queryset) -> str:
+        sql, params = queryset.order_by().query.sql_with_params()
+        raw_fingerprint = f"{queryset.db}|{sql}|{params!r}"
+        return hashlib.sha1(raw_fingerprint.encode("utf-8")).hexdigest()
+
+    def get_count(self, queryset) -> tuple:
+        key = self.KEY_PREFIX + self.get_fingerprint(queryset)
+        count = self.cache.get(key)
+        if count is not None:
+            return count, False
+        count, is_exact = super().get_count(queryset)
+        self.cache.set(key, count, self.ttl)
+        return count, is_exact
+
+
+class EstimatedCountStrategy(ExactCountStrategy):
+    """
+    Uses planner statistics: ``pg_class.reltuples`` or the ``EXPLAIN`` row
+    estimate on PostgreSQL and the ``ANALYZE`` samples in ``sqlite_stat1`` on
+    SQLite. Falls back to an exact count for small results, other backends and
+    queries the statistics cannot answer.
+    """
+
+    def __init__(self, exact_threshold=None):
+        self.exact_threshold = (
+            settings.PAGINATION_ESTIMATE_EXACT_THRESHOLD
+            if exact_threshold is None
+            else exact_threshold
+        )
+
+    def is_whole_table(self, queryset) -> bool:
+        query = queryset.query
+        return not (query.where or query.distinct or query.combinator)
+
+    def estimate_postgresql(self, queryset, cursor):
+        if self.is_whole_table(queryset):
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def estimate_sqlite(self, queryset, cursor):
+        if not self.is_whole_table(queryset):
+            return None
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'sqlite_stat1'"
+        )
+        if cursor.fetchone() is None:
+            return None
+        cursor.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = %s",
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+        return int(row[0].split()[0]) if row else None
+
+    def get_count(self, queryset) -> tuple:
+        connection = connections[queryset.db]
+        estimate = getattr(self, f"estimate_{connection.vendor}", None)
+        count = None
+        if estimate is not None:
+            try:
+                with connection.cursor() as cursor:
+                    count = estimate(queryset, cursor)
+            except DatabaseError:
+                count = None
+        if count is None or count < self.exact_threshold:
+            return super().get_count(queryset)
+        return count, False
+
+
+COUNT_STRATEGIES = {
+    "exact": ExactCountStrategy,
+    "cached": CachedCountStrategy,
+    "estimated": EstimatedCountStrategy,
+}
 
 
 class CustomPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination whose total comes from a count strategy. Views
+    pick one with ``pagination_count_strategy``, the default being
+    PAGINATION_COUNT_STRATEGY; ``count_is_exact`` tells clients whether the
+    total is exact.
+    """
+
+    max_limit = settings.PAGINATION_MAX_LIMIT
+    count_strategy = settings.PAGINATION_COUNT_STRATEGY
+    count_is_exact = True
+
+    def get_count_strategy_name(self, view=None) -> str:
+        return getattr(view, "pagination_count_strategy", self.count_strategy)
+
+    def get_count_strategy(self, view=None):
+        return COUNT_STRATEGIES[self.get_count_strategy_name(view)]()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        with PAGINATION_COUNT_LATENCY.labels(self.get_count_strategy_name(view)).time():
+            self.count, self.count_is_exact = self.get_count_strategy(view).get_count(
+                queryset
+            )
+        self.offset = self.get_offset(request)
+        self.request = request
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        if self.count_is_exact and (self.count == 0 or self.offset > self.count):
+            return []
+        page = list(queryset[self.offset : self.offset + self.limit])
+
+        if not self.count_is_exact:
+            # The page itself corrects an approximate total: a short page ends
+            # the result, a full one means at least one more row may follow.
+            if len(page) < self.limit and (page or self.offset == 0):
+                self.count = self.offset + len(page)
+                self.count_is_exact = True
+            elif len(page) == self.limit:
+                self.count = max(self.count, self.offset + self.limit + 1)
+        return page
+
     def contruct_dict_from_list(self, data_list: list) -> dict:
         """
         Constructs a dictionary from a list of data.
@@ -33,7 +202,166 @@ class CustomPagination(LimitOffsetPagination):
             {
                 "previous_offset": previous_offset,
                 "next_offset": next_offset,
+                "count_is_exact": self.count_is_exact,
             }
         )
         response.data = raw_data
         return response
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count_is_exact"] = {"type": "boolean"}
+        return response_schema
+
+
+class CustomKeysetPagination(BasePagination):
+    """
+    Keyset pagination over ``CoreModel.created_at`` and ``id``, newest first.
+    Pages are addressed with opaque cursors, so no offset scan or count query
+    is needed. The envelope mirrors CustomPagination with ``count`` left empty
+    and ``previous_cursor``/``next_cursor`` in place of the offsets.
+    """
+
+    cursor_query_param = "cursor"
+    limit_query_param = "limit"
+    default_limit = settings.PAGINATION_DEFAULT_LIMIT
+    max_limit = settings.PAGINATION_MAX_LIMIT
+    ordering = ("created_at", "id")
+    invalid_cursor_message = "Invalid cursor."
+
+    def get_limit(self, request) -> int:
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+            if limit <= 0:
+                raise ValueError
+        except (KeyError, ValueError):
+            limit = self.default_limit
+        return min(limit, self.max_limit)
+
+    def encode_cursor(self, instance, reverse: bool) -> str:
+        position = [str(getattr(instance, field)) for field in self.ordering]
+        raw_cursor = json.dumps([position, reverse], separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw_cursor.encode("utf-8")).decode("ascii")
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            raw_cursor = base64.urlsafe_b64decode(encoded.encode("ascii"))
+            cursor = json.loads(raw_cursor)
+            if not isinstance(cursor, list) or len(cursor) != 2:
+                raise ValueError("A cursor is a [position, reverse] pair.")
+            position, reverse = cursor
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError("A position holds one value per ordering field.")
+            position = [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (
+            TypeError,
+            ValueError,
+            binascii.Error,
+            UnicodeError,
+            DjangoValidationError,
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(reverse)
+
+    def get_keyset_filter(self, position: list, reverse: bool) -> Q:
+        """
+        Builds ``(a < x) OR (a = x AND b < y)`` for the descending ordering,
+        with the comparisons flipped when walking backwards.
+        """
+        lookup = "gt" if reverse else "lt"
+        conditions = []
+        for index, field in enumerate(self.ordering):
+            equal_fields = {
+                previous: position[previous_index]
+                for previous_index, previous in enumerate(self.ordering[:index])
+            }
+            conditions.append(
+                Q(**equal_fields, **{f"{field}__{lookup}": position[index]})
+            )
+        return reduce(lambda left, right: left | right, conditions)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        if reverse:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(*[f"-{field}" for field in self.ordering])
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(position, reverse))
+
+        results = list(queryset[: self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[: self.limit]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+
+        self.next_cursor = None
+        self.previous_cursor = None
+        if results and has_next:
+            self.next_cursor = self.encode_cursor(results[-1], reverse=False)
+        if results and has_previous:
+            self.previous_cursor = self.encode_cursor(results[0], reverse=True)
+        return results
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("count", None),
+                    ("next", self.get_link(self.next_cursor)),
+                    ("previous", self.get_link(self.previous_cursor)),
+                    ("results", data),
+                    ("previous_cursor", self.previous_cursor),
+                    ("next_cursor", self.next_cursor),
+                ]
+            )
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "count": {"type": "integer", "nullable": True},
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+                "previous_cursor": {"type": "string", "nullable": True},
+                "next_cursor": {"type": "string", "nullable": True},
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.limit_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
@@ -3,8 +3,21 @@ from user.models import User
 
 
 class AdminPermission(BasePermission):
+    @staticmethod
+    def is_admin(user) -> bool:
+        return bool(user and getattr(user, "user_type", None) == User.UserType.ADMIN)
+
+    def has_permission(self, request, view):
+        return self.is_admin(request.user)
+
+
+class MetricsPermission(BasePermission):
+    """
+    Allows the metrics scraper token and admin users.
+    """
+
     def has_permission(self, request, view):
-        return bool(request.user and request.user.user_type == User.UserType.ADMIN)
+        return request.auth == "metrics" or AdminPermission.is_admin(request.user)
 
 
 class OwnProfilePermission(BasePermission):
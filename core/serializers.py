@@ -1,3 +1,5 @@
+import uuid
+
 from rest_framework.serializers import (
     Serializer,
     SerializerMethodField,
@@ -7,8 +9,14 @@ from rest_framework.serializers import (
 )
 from rest_framework.exceptions import ValidationError, AuthenticationFailed
 from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
 
 from .models import CoreModel
+from .modelutils import touch_auto_now_fields
 
 
 class ReadWriteSerializerMethodField(SerializerMethodField):
@@ -22,59 +30,151 @@ class ReadWriteSerializerMethodField(SerializerMethodField):
 
 
 class CustomCreateUpdateDeleteObjectOperationSerializer(ModelSerializer):
+    """
+    Applies a list of ``add``/``update``/``delete`` operations in a single
+    transaction. The payload is partitioned in one pass, additions are stored
+    with ``bulk_create``, updates with batched ``bulk_update`` and deletions
+    with one ``DELETE ... WHERE id IN``. Every item is validated through
+    ``operation_serializer``, updates as partial ones. Serializers overriding
+    ``create()``/``update()`` are saved one by one, as are all operations with
+    ``send_instance_signals`` set, for models that rely on ``save()``/``delete()``
+    overrides or model signals.
+    """
+
+    OPERATIONS = ("add", "update", "delete")
+    operation_batch_size = 500
+    send_instance_signals = False
+
+    def _partition_operations(self, data) -> dict:
+        partitions = {operation: [] for operation in self.OPERATIONS}
+        for instance in data:
+            operation = instance.get("operation")
+            if operation in partitions:
+                partitions[operation].append(instance)
+        return partitions
+
     def _operation_filter(self, data, operation):
-        filtered_data = []
-        if operation == "add":
-            filtered_data = [
-                instance for instance in data if operation == instance.get("operation")
-            ]
-
-        elif operation == "delete":
-            filtered_data = [
-                instance.get("id")
-                for instance in data
-                if operation == instance.get("operation")
-            ]
-        elif operation == "update":
-            filtered_data = [
-                instance for instance in data if operation == instance.get("operation")
-            ]
+        filtered_data = self._partition_operations(data).get(operation, [])
+        if operation == "delete":
+            return [instance.get("id") for instance in filtered_data]
         return filtered_data
 
+    def _use_bulk_writes(
+        self,
+        operation_serializer: ModelSerializer,
+        operation_model: CoreModel,
+        method: str,
+        validated_data: list,
+    ) -> bool:
+        """
+        Bulk writes bypass ``serializer.create()``/``update()``, so they are
+        only used while the serializer keeps the ``ModelSerializer`` default
+        and no many-to-many values need ``set()``.
+        """
+        if self.send_instance_signals:
+            return False
+        if getattr(operation_serializer, method) is not getattr(
+            ModelSerializer, method
+        ):
+            return False
+        many_to_many = {field.name for field in operation_model._meta.many_to_many}
+        return not any(many_to_many.intersection(data) for data in validated_data)
+
     def _perform_create(
-        self, data, operation_serializer: ModelSerializer, **extra_create_kwargs
+        self,
+        filtered_data,
+        operation_serializer: ModelSerializer,
+        operation_model: CoreModel,
+        **extra_create_kwargs,
     ) -> int:
-        create_count = 0
-        filtered_data = self._operation_filter(data, "add")
+        serializer_instances = []
         for instance in filtered_data:
             serializer_instance = operation_serializer(
                 data={**instance, **extra_create_kwargs}
             )
             serializer_instance.is_valid(raise_exception=True)
-            serializer_instance.save()
-            create_count += 1
-        return create_count
-
-    def _perform_delete(self, data, operation_model: CoreModel, **kwargs) -> int:
-        delete_count = 0
-        filtered_data = self._operation_filter(data, "delete")
-        filtered_queryset = operation_model.objects.filter(
-            id__in=filtered_data, **kwargs
-        )
-        for instance in filtered_queryset:
-            instance.delete()
-            delete_count += 1
-        return delete_count
-
-    def _perform_update(self, data, operation_model: CoreModel, **kwargs) -> int:
-        update_count = 0
-        filtered_data = self._operation_filter(data, "update")
+            serializer_instances.append(serializer_instance)
+
+        validated_data = [
+            serializer_instance.validated_data
+            for serializer_instance in serializer_instances
+        ]
+        if not self._use_bulk_writes(
+            operation_serializer, operation_model, "create", validated_data
+        ):
+            for serializer_instance in serializer_instances:
+                serializer_instance.save()
+        elif serializer_instances:
+            operation_model.objects.bulk_create(
+                [operation_model(**data) for data in validated_data],
+                batch_size=self.operation_batch_size,
+            )
+        return len(serializer_instances)
+
+    def _perform_delete(self, ids, operation_model: CoreModel, **kwargs) -> int:
+        if not ids:
+            return 0
+        filtered_queryset = operation_model.objects.filter(id__in=ids, **kwargs)
+        if self.send_instance_signals:
+            delete_count = 0
+            for instance in filtered_queryset:
+                instance.delete()
+                delete_count += 1
+            return delete_count
+        _, deleted_per_model = filtered_queryset.delete()
+        return deleted_per_model.get(operation_model._meta.label, 0)
+
+    def _perform_update(
+        self,
+        filtered_data,
+        operation_serializer: ModelSerializer,
+        operation_model: CoreModel,
+        **kwargs,
+    ) -> int:
+        changes = {}
         for instance in filtered_data:
-            instance.pop("operation")
-            update_count += operation_model.objects.filter(
-                id=instance.pop("id"), **kwargs
-            ).update(**instance)
-        return update_count
+            instance = dict(instance)
+            instance.pop("operation", None)
+            try:
+                id = operation_model._meta.pk.to_python(instance.pop("id", None))
+            except DjangoValidationError:
+                raise ValidationError("Invalid id.")
+            changes[id] = instance
+        if not changes:
+            return 0
+
+        serializer_instances = []
+        for instance in operation_model.objects.filter(id__in=changes, **kwargs):
+            serializer_instance = operation_serializer(
+                instance, data=changes[instance.pk], partial=True
+            )
+            serializer_instance.is_valid(raise_exception=True)
+            serializer_instances.append(serializer_instance)
+
+        validated_data = [
+            serializer_instance.validated_data
+            for serializer_instance in serializer_instances
+        ]
+        if not self._use_bulk_writes(
+            operation_serializer, operation_model, "update", validated_data
+        ):
+            for serializer_instance in serializer_instances:
+                serializer_instance.save()
+            return len(serializer_instances)
+
+        instances, update_fields = [], set()
+        for serializer_instance in serializer_instances:
+            instance = serializer_instance.instance
+            for name, value in serializer_instance.validated_data.items():
+                setattr(instance, name, value)
+            update_fields.update(serializer_instance.validated_data)
+            instances.append(instance)
+        if instances and update_fields:
+            update_fields.update(touch_auto_now_fields(operation_model, instances))
+            operation_model.objects.bulk_update(
+                instances, update_fields, batch_size=self.operation_batch_size
+            )
+        return len(instances)
 
     def perform_crud_operations(
         self,
@@ -85,11 +185,31 @@ class CustomCreateUpdateDeleteObjectOperationSerializer(ModelSerializer):
         delete_kwargs={},
         update_kwargs={},
     ) -> dict:
-        return {
-            "add": self._perform_create(data, operation_serializer, **add_kwagrs),
-            "update": self._perform_update(data, operation_model, **update_kwargs),
-            "delete": self._perform_delete(data, operation_model, **delete_kwargs),
-        }
+        partitions = self._partition_operations(data)
+        delete_ids = [instance.get("id") for instance in partitions["delete"]]
+        try:
+            with transaction.atomic():
+                return {
+                    "add": self._perform_create(
+                        partitions["add"],
+                        operation_serializer,
+                        operation_model,
+                        **add_kwagrs,
+                    ),
+                    "update": self._perform_update(
+                        partitions["update"],
+                        operation_serializer,
+                        operation_model,
+                        **update_kwargs,
+                    ),
+                    "delete": self._perform_delete(
+                        delete_ids, operation_model, **delete_kwargs
+                    ),
+                }
+        except IntegrityError:
+            # Items are validated one by one, unique values repeated within
+            # the payload only collide on write
+            raise ValidationError("The operations conflict with each other.")
 
     class Meta:
         model = CoreModel
@@ -97,6 +217,16 @@ class CustomCreateUpdateDeleteObjectOperationSerializer(ModelSerializer):
 
 
 class FieldListUpdateSerializer(ModelSerializer):
+    """
+    Synchronises the values of ``field_name`` stored in ``related_model`` with
+    a list. With ``streaming_list_field_update`` the diff is computed inside the
+    database against a temporary table, so the stored values are never loaded,
+    and changes are applied in batches of ``list_field_update_batch_size``.
+    """
+
+    streaming_list_field_update = False
+    list_field_update_batch_size = 1000
+
     def perform_list_field_update(
         self,
         updated_value: list,
@@ -104,6 +234,12 @@ class FieldListUpdateSerializer(ModelSerializer):
         field_name: str,
         query_params={},
     ) -> int:
+        if self.streaming_list_field_update:
+            counts = self.perform_streaming_list_field_update(
+                updated_value, related_model, field_name, query_params
+            )
+            return counts["add"] + counts["delete"]
+
         new_data = set(updated_value)
         old_data = set(
             related_model.objects.filter(**query_params).values_list(
@@ -120,6 +256,102 @@ class FieldListUpdateSerializer(ModelSerializer):
         )
         return len(to_add) + len(to_delete)
 
+    def perform_streaming_list_field_update(
+        self,
+        updated_value: list,
+        related_model: CoreModel,
+        field_name: str,
+        query_params={},
+    ) -> dict:
+        """
+        Returns the number of deleted rows and of rows sent for insertion. The
+        ``add`` count is not the number of inserted rows: values stored
+        concurrently are skipped by ``ignore_conflicts`` but still counted.
+        Both diffs are ``NOT EXISTS`` anti-joins with the temporary table, so
+        a ``None`` in ``updated_value`` cannot hide every stored row as it
+        would with ``NOT IN``. ``None`` values are ignored and stored rows
+        without a value are deleted as stale.
+        """
+        using = router.db_for_write(related_model)
+        connection = connections[using]
+        field = related_model._meta.get_field(field_name)
+        batch_size = self.list_field_update_batch_size
+        table = connection.ops.quote_name(f"list_update_{uuid.uuid4().hex}")
+        values = [value for value in dict.fromkeys(updated_value) if value is not None]
+        existing = related_model.objects.using(using).filter(**query_params)
+        column = "{}.{}".format(
+            connection.ops.quote_name(related_model._meta.db_table),
+            connection.ops.quote_name(field.column),
+        )
+
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {table} "
+                f"(position integer PRIMARY KEY, value {field.db_type(connection)})"
+            )
+            for start in range(0, len(values), batch_size):
+                cursor.executemany(
+                    f"INSERT INTO {table} (position, value) VALUES (%s, %s)",
+                    [
+                        (start + offset, field.get_db_prep_save(value, connection))
+                        for offset, value in enumerate(
+                            values[start : start + batch_size]
+                        )
+                    ],
+                )
+
+            deleted = 0
+            stale = existing.filter(
+                RawSQL(
+                    f"NOT EXISTS (SELECT 1 FROM {table} WHERE {table}.value = {column})",
+                    [],
+                    output_field=BooleanField(),
+                )
+            )
+            while True:
+                stale_ids = list(stale.values_list("pk", flat=True)[:batch_size])
+                if not stale_ids:
+                    break
+                _, deleted_per_model = (
+                    related_model.objects.using(using).filter(pk__in=stale_ids).delete()
+                )
+                deleted += deleted_per_model.get(related_model._meta.label, 0)
+
+            added = 0
+            # Correlated with the temporary table row of the outer query
+            stored_sql, stored_params = (
+                existing.filter(
+                    RawSQL(f"{column} = {table}.value", [], output_field=BooleanField())
+                )
+                .values("pk")
+                .query.sql_with_params()
+            )
+            last_position = -1
+            while True:
+                cursor.execute(
+                    f"SELECT position FROM {table} WHERE position > %s "
+                    f"AND value IS NOT NULL AND NOT EXISTS ({stored_sql}) "
+                    f"ORDER BY position LIMIT %s",
+                    [last_position, *stored_params, batch_size],
+                )
+                positions = [row[0] for row in cursor.fetchall()]
+                if not positions:
+                    break
+                related_model.objects.using(using).bulk_create(
+                    [
+                        related_model(
+                            **{field.attname: values[position], **query_params}
+                        )
+                        for position in positions
+                    ],
+                    ignore_conflicts=True,
+                )
+                added += len(positions)
+                last_position = positions[-1]
+
+            cursor.execute(f"DROP TABLE {table}")
+        return {"add": added, "delete": deleted}
+
     class Meta:
         model = CoreModel
         fields = "__all__"
@@ -162,7 +394,9 @@ class AbstractAccountSettingsSerializer(Serializer):
         if validated_data.get("account_delete_password"):
             user.is_active = False
             user.is_deleted = True
+            user.deleted_at = timezone.now()
             instance.is_deleted = True
+            instance.deleted_at = user.deleted_at
             if validated_data.get("reason_to_delete"):
                 instance.reason_to_delete = validated_data.pop("reason_to_delete")
         if validated_data.get("notification_email"):
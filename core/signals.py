@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import ModelSignal, post_delete, post_save
+from rest_framework.authtoken.models import Token
+
+from .classes import token_cache
+
+# Sent by SoftDeleteQuerySet.soft_delete with the primary keys of the rows
+post_soft_delete = ModelSignal(use_caching=True)
+
+# Sent by SoftDeleteQuerySet.update and bulk_update with the primary keys of
+# the rows, which are written without post_save
+post_bulk_update = ModelSignal(use_caching=True)
+
+
+def invalidate_user_tokens(*user_ids):
+    """
+    Drops the cached tokens of users now and again once the transaction
+    commits, so no process caches the old row in between.
+    """
+
+    def invalidate():
+        for user_id in user_ids:
+            token_cache.invalidate_user(user_id)
+
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def invalidate_cached_token(sender, instance, **kwargs):
+    """
+    Drops a deleted token from the authentication cache.
+    """
+    token_cache.invalidate(instance.key)
+
+
+def invalidate_cached_user_tokens(sender, instance, **kwargs):
+    """
+    Drops the cached tokens of a saved or deleted user, so deactivation and
+    password changes take effect on the next request.
+    """
+    invalidate_user_tokens(instance.pk)
+
+
+def invalidate_bulk_updated_user_tokens(sender, pks, **kwargs):
+    """
+    Drops the cached tokens of users soft deleted or updated in bulk.
+    """
+    invalidate_user_tokens(*pks)
+
+
+post_delete.connect(invalidate_cached_token, sender=Token)
+post_save.connect(invalidate_cached_user_tokens, sender=settings.AUTH_USER_MODEL)
+post_delete.connect(invalidate_cached_user_tokens, sender=settings.AUTH_USER_MODEL)
+post_soft_delete.connect(
+    invalidate_bulk_updated_user_tokens, sender=settings.AUTH_USER_MODEL
+)
+post_bulk_update.connect(
+    invalidate_bulk_updated_user_tokens, sender=settings.AUTH_USER_MODEL
+)
@@ -1,3 +1,1528 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core import mail
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection, connections, transaction
+from django.http import Http404, HttpResponse
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed, NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from user.models import PasswordResetWhitelist, User
+from .classes import (
+    ContentAddressedFileSystemStorage,
+    CustomTokenAuthentication,
+    MetricsTokenAuthentication,
+    TokenCache,
+    token_cache,
+)
+from .middleware import ProfilingMiddleware, QueryInstrumentationMiddleware
+from .models import BulkMailCheckpoint, ContentBlob, EmailOutbox, PendingFileDeletion
+from .modelutils import (
+    delete_queued_files,
+    queue_file_deletion,
+    send_bulk_mail,
+    send_queued_mail,
+)
+from .pagination import (
+    CachedCountStrategy,
+    CustomKeysetPagination,
+    CustomPagination,
+    EstimatedCountStrategy,
+)
+from .serializers import (
+    CustomCreateUpdateDeleteObjectOperationSerializer,
+    FieldListUpdateSerializer,
+)
+from .utils import default_uuid, reap_expired_tokens, uuid7
+from .views import CustomAsyncAPIView, CustomListUpdateAPIView
+
+SHARED_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "tokens": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tokens",
+    },
+}
+
+
+def create_user(name="alice", **kwargs) -> User:
+    return User.objects.create(
+        email=f"{name}@example.com", username=name, password="unused", **kwargs
+    )
+
+
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user)
+        self.expires_at = timezone.now() + timedelta(days=1)
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def test_local_hit_returns_copies(self):
+        cache = TokenCache(ttl=60, local_ttl=60)
+        cache.set(self.token.key, self.user, self.token, self.expires_at)
+
+        user, token, expires_at = cache.get(self.token.key)
+
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertIsNot(user, self.user)
+        self.assertIs(token.user, user)
+        self.assertEqual(expires_at, self.expires_at)
+        self.assertEqual(cache.stats()["local_hits"], 1)
+
+    @mock.patch("core.classes.time.monotonic")
+    def test_local_entry_expires_after_ttl(self, monotonic):
+        cache = TokenCache(ttl=60, local_ttl=60)
+        monotonic.return_value = 1000.0
+        cache.set(self.token.key, self.user, self.token, self.expires_at)
+
+        monotonic.return_value = 1061.0
+
+        self.assertIsNone(cache.get(self.token.key))
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["size"], 0)
+
+    @mock.patch("core.classes.time.monotonic")
+    def test_local_ttl_is_short_without_shared_tier(self, monotonic):
+        cache = TokenCache(ttl=300, local_ttl=5)
+        monotonic.return_value = 1000.0
+        cache.set(self.token.key, self.user, self.token, self.expires_at)
+
+        monotonic.return_value = 1006.0
+
+        self.assertIsNone(cache.get(self.token.key))
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_shared_hit_fills_local_tier_of_other_process(self):
+        first = TokenCache(ttl=60, cache_alias="tokens")
+        second = TokenCache(ttl=60, cache_alias="tokens")
+        first.set(self.token.key, self.user, self.token, self.expires_at)
+
+        self.assertIsNotNone(second.get(self.token.key))
+        self.assertIsNotNone(second.get(self.token.key))
+        self.assertEqual(second.stats()["shared_hits"], 1)
+        self.assertEqual(second.stats()["local_hits"], 1)
+
+    @override_settings(CACHES=SHARED_CACHES)
+    @mock.patch("core.classes.time.monotonic")
+    def test_invalidate_user_reaches_other_processes(self, monotonic):
+        monotonic.return_value = 1000.0
+        first = TokenCache(ttl=60, cache_alias="tokens", generation_check_interval=1)
+        second = TokenCache(ttl=60, cache_alias="tokens", generation_check_interval=1)
+        first.set(self.token.key, self.user, self.token, self.expires_at)
+        second.get(self.token.key)
+
+        first.invalidate_user(self.user.pk)
+
+        self.assertIsNone(first.get(self.token.key))
+        # Served until the next generation check of the local entry
+        self.assertIsNotNone(second.get(self.token.key))
+        monotonic.return_value = 1001.0
+        self.assertIsNone(second.get(self.token.key))
+        # Entries cached after the invalidation are served again
+        second.set(self.token.key, self.user, self.token, self.expires_at)
+        self.assertIsNotNone(first.get(self.token.key))
+
+    @override_settings(CACHES=SHARED_CACHES)
+    @mock.patch("core.classes.time.monotonic")
+    def test_local_hits_read_the_generation_periodically(self, monotonic):
+        monotonic.return_value = 1000.0
+        cache = TokenCache(ttl=60, cache_alias="tokens", generation_check_interval=1)
+        cache.set(self.token.key, self.user, self.token, self.expires_at)
+
+        with mock.patch.object(
+            cache, "get_generation", wraps=cache.get_generation
+        ) as get_generation:
+            for _ in range(10):
+                cache.get(self.token.key)
+            self.assertEqual(get_generation.call_count, 0)
+
+            monotonic.return_value = 1001.5
+            cache.get(self.token.key)
+            cache.get(self.token.key)
+            self.assertEqual(get_generation.call_count, 1)
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_entry_loaded_before_an_invalidation_is_outdated(self):
+        cache = TokenCache(ttl=60, cache_alias="tokens", generation_check_interval=0)
+        generation = cache.get_generation(self.user.pk)
+        # Deactivated while the user was being loaded
+        cache.invalidate_user(self.user.pk)
+
+        cache.set(self.token.key, self.user, self.token, self.expires_at, generation)
+
+        self.assertIsNone(cache.get(self.token.key))
+
+    @override_settings(CACHES=SHARED_CACHES)
+    def test_authentication_reads_the_generation_before_loading_the_user(self):
+        cache = TokenCache(ttl=60, cache_alias="tokens", generation_check_interval=0)
+        authentication = CustomTokenAuthentication()
+        authentication.cache = cache
+
+        def invalidate_while_loading(token):
+            # Deactivated after the user was loaded, before it is cached
+            cache.invalidate_user(token.user_id)
+            return False
+
+        with mock.patch.object(
+            authentication, "is_expired", side_effect=invalidate_while_loading
+        ):
+            authentication.authenticate_credentials(self.token.key)
+
+        self.assertIsNone(cache.get(self.token.key))
+
+    def test_authentication_is_served_from_cache(self):
+        authentication = CustomTokenAuthentication()
+        authentication.authenticate_credentials(self.token.key)
+
+        with self.assertNumQueries(0):
+            user, _ = authentication.authenticate_credentials(self.token.key)
+        self.assertEqual(user.pk, self.user.pk)
+
+    def test_queryset_update_invalidates_cached_tokens(self):
+        authentication = CustomTokenAuthentication()
+        authentication.authenticate_credentials(self.token.key)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(self.token.key)
+
+    def test_bulk_update_invalidates_cached_tokens(self):
+        authentication = CustomTokenAuthentication()
+        authentication.authenticate_credentials(self.token.key)
+
+        self.user.is_active = False
+        User.objects.bulk_update([self.user], ["is_active"])
+
+        with self.assertRaises(AuthenticationFailed):
+            authentication.authenticate_credentials(self.token.key)
+
+
+class ReapExpiredTokensTests(TestCase):
+    def tearDown(self):
+        token_cache.clear()
+
+    def create_tokens(self, name: str, count: int, age_seconds=0) -> list:
+        tokens = [
+            Token.objects.create(user=create_user(f"{name}-{index}"))
+            for index in range(count)
+        ]
+        Token.objects.filter(pk__in=[token.pk for token in tokens]).update(
+            created=timezone.now() - timedelta(seconds=age_seconds)
+        )
+        return tokens
+
+    def test_only_expired_tokens_are_deleted(self):
+        expiration = settings.USER_AUTH_TOKEN_EXPIRATION_SECONDS
+        fresh = self.create_tokens("fresh", 2, age_seconds=expiration - 60)
+        expired = self.create_tokens("expired", 3, age_seconds=expiration + 60)
+
+        with mock.patch.object(token_cache, "invalidate") as invalidate:
+            report = reap_expired_tokens(batch_size=2)
+
+        self.assertEqual((report["deleted"], report["batches"]), (3, 2))
+        self.assertEqual(
+            set(Token.objects.values_list("key", flat=True)),
+            {token.key for token in fresh},
+        )
+        invalidated = {key for call in invalidate.call_args_list for key in call.args}
+        self.assertEqual(invalidated, {token.key for token in expired})
+        self.assertEqual(User.objects.count(), 5)
+
+    def test_max_batches_bounds_the_run(self):
+        self.create_tokens(
+            "expired", 3, age_seconds=settings.USER_AUTH_TOKEN_EXPIRATION_SECONDS + 60
+        )
+
+        report = reap_expired_tokens(batch_size=2, max_batches=1)
+
+        self.assertEqual((report["deleted"], report["batches"]), (2, 1))
+        self.assertEqual(Token.objects.count(), 1)
+
+
+class UUID7Tests(TestCase):
+    # 2026-10-18 12:00:00.000250 UTC
+    NOW_NS = 1_792_324_800_000_250_000
+
+    def generate(self, count: int, now_ns=NOW_NS) -> list:
+        with mock.patch("core.utils._uuid7_last_stamp", 0), mock.patch(
+            "core.utils.time.time_ns", return_value=now_ns
+        ):
+            return [uuid7() for _ in range(count)]
+
+    def test_version_variant_and_timestamp(self):
+        for value in self.generate(100):
+            self.assertEqual(value.version, 7)
+            self.assertEqual(value.variant, uuid.RFC_4122)
+            self.assertEqual(value.int >> 80, self.NOW_NS // 1_000_000)
+
+    def test_values_of_the_same_millisecond_are_increasing(self):
+        values = self.generate(5000)
+
+        self.assertEqual(len(set(values)), 5000)
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(
+            [str(value) for value in values], sorted(str(value) for value in values)
+        )
+
+    def test_clock_going_backwards_keeps_the_order(self):
+        with mock.patch("core.utils._uuid7_last_stamp", 0), mock.patch(
+            "core.utils.time.time_ns",
+            side_effect=[self.NOW_NS, self.NOW_NS - 5_000_000_000],
+        ):
+            first, second = uuid7(), uuid7()
+
+        self.assertLess(first, second)
+
+    def test_default_uuid_follows_the_setting(self):
+        with override_settings(CORE_MODEL_UUID_VERSION=7):
+            self.assertEqual(default_uuid().version, 7)
+            self.assertEqual(create_user().pk.version, 7)
+        with override_settings(CORE_MODEL_UUID_VERSION=4):
+            self.assertEqual(default_uuid().version, 4)
+
+
+@override_settings(METRICS_TOKEN="metrics-token")
+class MetricsTokenAuthenticationTests(TestCase):
+    def test_metrics_token_is_accepted(self):
+        user, auth = MetricsTokenAuthentication().authenticate_credentials(
+            "metrics-token"
+        )
+
+        self.assertFalse(user.is_authenticated)
+        self.assertEqual(auth, "metrics")
+
+    def test_non_ascii_token_is_rejected(self):
+        with self.assertRaises(AuthenticationFailed):
+            MetricsTokenAuthentication().authenticate_credentials("métrics-token")
+
+
+class KeysetCursorTests(TestCase):
+    def decode(self, cursor):
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+        request = Request(APIRequestFactory().get("/", {"cursor": encoded}))
+        return CustomKeysetPagination().decode_cursor(request, User)
+
+    def test_valid_cursor_is_decoded(self):
+        position, reverse = self.decode(
+            [["2026-10-18 12:00:00+00:00", "0b8f3c9e-6f1c-4e7a-9d55-0c1e6d7b9a10"], 1]
+        )
+
+        self.assertEqual(position[0].year, 2026)
+        self.assertEqual(str(position[1]), "0b8f3c9e-6f1c-4e7a-9d55-0c1e6d7b9a10")
+        self.assertTrue(reverse)
+
+    def test_tampered_cursors_are_not_found(self):
+        cursors = [
+            ["2026-10-18 12:00:00+00:00", "not-a-uuid"],
+            [["yesterday", "0b8f3c9e-6f1c-4e7a-9d55-0c1e6d7b9a10"], 0],
+            [["2026-10-18 12:00:00+00:00", "not-a-uuid"], 0],
+            {"position": 1, "reverse": 0},
+            [["2026-10-18 12:00:00+00:00"], 0],
+            [["2026-10-18 12:00:00+00:00", "x"], 0, 1],
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor), self.assertRaises(NotFound):
+                self.decode(cursor)
+
+
+def create_whitelist(count: int) -> list:
+    return PasswordResetWhitelist.objects.bulk_create(
+        [
+            PasswordResetWhitelist(
+                email=f"user-{index}@example.com", token=f"token-{index}"
+            )
+            for index in range(count)
+        ]
+    )
+
+
+@override_settings(CACHES=SHARED_CACHES)
+class CountStrategyTests(TestCase):
+    def setUp(self):
+        create_whitelist(25)
+
+    def test_cached_count_is_reused_per_filter(self):
+        strategy = CachedCountStrategy(ttl=60)
+        whitelist = PasswordResetWhitelist.objects.all()
+        filtered = whitelist.filter(email__startswith="user-1")
+
+        with self.assertNumQueries(2):
+            self.assertEqual(strategy.get_count(whitelist), (25, True))
+            self.assertEqual(strategy.get_count(filtered), (11, True))
+        PasswordResetWhitelist.objects.filter(email="user-0@example.com").delete()
+
+        # Cached until the TTL runs out, so no longer known to be exact
+        with self.assertNumQueries(0):
+            # Ordering is not part of the fingerprint
+            self.assertEqual(
+                strategy.get_count(whitelist.order_by("-email")), (25, False)
+            )
+            self.assertEqual(strategy.get_count(filtered), (11, False))
+
+    def test_estimate_is_used_above_the_exact_threshold(self):
+        strategy = EstimatedCountStrategy(exact_threshold=1000)
+        whitelist = PasswordResetWhitelist.objects.all()
+
+        with mock.patch.object(strategy, "estimate_sqlite", return_value=5000):
+            self.assertEqual(strategy.get_count(whitelist), (5000, False))
+        with mock.patch.object(strategy, "estimate_sqlite", return_value=999):
+            self.assertEqual(strategy.get_count(whitelist), (25, True))
+
+    def test_exact_count_without_statistics(self):
+        strategy = EstimatedCountStrategy(exact_threshold=0)
+
+        self.assertEqual(
+            strategy.get_count(PasswordResetWhitelist.objects.all()), (25, True)
+        )
+        self.assertEqual(
+            strategy.get_count(PasswordResetWhitelist.objects.filter(token="token-1")),
+            (1, True),
+        )
+
+
+class EstimatedCountView:
+    pagination_count_strategy = "estimated"
+
+
+@override_settings(PAGINATION_ESTIMATE_EXACT_THRESHOLD=0)
+class CountIsExactTests(TestCase):
+    def setUp(self):
+        create_whitelist(25)
+
+    def paginate(self, estimate: int, offset: int, limit=10):
+        paginator = CustomPagination()
+        request = Request(
+            APIRequestFactory().get("/", {"limit": limit, "offset": offset})
+        )
+        with mock.patch.object(
+            EstimatedCountStrategy, "estimate_sqlite", return_value=estimate
+        ):
+            page = paginator.paginate_queryset(
+                PasswordResetWhitelist.objects.order_by("email"),
+                request,
+                EstimatedCountView(),
+            )
+        data = paginator.get_paginated_response(page).data
+        return len(page), data["count"], data["count_is_exact"]
+
+    def test_short_page_makes_the_count_exact(self):
+        self.assertEqual(self.paginate(100, offset=20), (5, 25, True))
+        self.assertEqual(self.paginate(3, offset=20), (5, 25, True))
+
+    def test_full_page_keeps_the_estimate_above_the_page(self):
+        self.assertEqual(self.paginate(100, offset=0), (10, 100, False))
+        # An estimate below the page means at least one more row may follow
+        self.assertEqual(self.paginate(3, offset=0), (10, 11, False))
+
+    def test_empty_page_past_the_end_keeps_the_estimate(self):
+        self.assertEqual(self.paginate(100, offset=40), (0, 100, False))
+
+    def test_exact_strategy(self):
+        paginator = CustomPagination()
+        request = Request(APIRequestFactory().get("/", {"limit": 10, "offset": 40}))
+
+        with self.assertNumQueries(1):
+            page = paginator.paginate_queryset(
+                PasswordResetWhitelist.objects.all(), request
+            )
+
+        self.assertEqual(page, [])
+        self.assertEqual((paginator.count, paginator.count_is_exact), (25, True))
+
+
+class WhitelistSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PasswordResetWhitelist
+        fields = ["id", "email", "token"]
+        # Leave the unique checks to the database
+        extra_kwargs = {"email": {"validators": []}, "token": {"validators": []}}
+
+
+class WhitelistBulkUpdateView(CustomListUpdateAPIView):
+    bulk_update_mode = True
+    authentication_classes = []
+    permission_classes = []
+    queryset = PasswordResetWhitelist.objects.all()
+    serializer_class = WhitelistSerializer
+
+
+class BulkUpdateTests(TestCase):
+    def setUp(self):
+        self.entries = [
+            PasswordResetWhitelist.objects.create(
+                email=f"user-{index}@example.com", token=f"token-{index}"
+            )
+            for index in range(30)
+        ]
+
+    def put(self, data):
+        request = APIRequestFactory().put("/", data, format="json")
+        return WhitelistBulkUpdateView.as_view()(request)
+
+    def get_items(self, count: int) -> list:
+        items = [
+            {"id": str(entry.pk), "email": entry.email, "token": f"renewed-{index}"}
+            for index, entry in enumerate(self.entries[:count])
+        ]
+        return items + [{"email": f"new-{count}@example.com", "token": f"new-{count}"}]
+
+    def test_query_count_does_not_grow_with_items(self):
+        # select, savepoint, insert, update, release
+        with self.assertNumQueries(5):
+            self.assertEqual(self.put(self.get_items(2)).status_code, 200)
+        with self.assertNumQueries(5):
+            self.assertEqual(self.put(self.get_items(20)).status_code, 200)
+
+    def test_only_touched_rows_are_returned(self):
+        response = self.put(self.get_items(2))
+
+        result = response.data["result"]
+        self.assertEqual(len(result), 3)
+        self.assertEqual(
+            [item["id"] for item in result[:2]],
+            [str(entry.pk) for entry in self.entries[:2]],
+        )
+        self.assertEqual(result[2]["email"], "new-2@example.com")
+        self.assertEqual(
+            PasswordResetWhitelist.objects.get(pk=self.entries[1].pk).token,
+            "renewed-1",
+        )
+
+    def test_duplicate_ids_are_rejected(self):
+        id = str(self.entries[0].pk)
+
+        email = self.entries[0].email
+
+        response = self.put(
+            [
+                {"id": id, "email": email, "token": "a"},
+                {"id": id, "email": email, "token": "b"},
+            ]
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            PasswordResetWhitelist.objects.get(pk=id).token, self.entries[0].token
+        )
+
+    def test_non_object_items_are_rejected(self):
+        item = {"email": "new@example.com", "token": "a"}
+
+        self.assertEqual(self.put([item, "b"]).status_code, 400)
+        self.assertEqual(self.put(item).status_code, 400)
+
+    def test_unique_collision_among_created_rows_is_rejected(self):
+        response = self.put(
+            [
+                {"email": "same@example.com", "token": "first"},
+                {"email": "same@example.com", "token": "second"},
+            ]
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            PasswordResetWhitelist.objects.filter(email="same@example.com").exists()
+        )
+
+
+class LowercaseWhitelistSerializer(WhitelistSerializer):
+    def create(self, validated_data):
+        validated_data["email"] = validated_data["email"].lower()
+        return super().create(validated_data)
+
+
+class CrudOperationTests(TestCase):
+    def setUp(self):
+        self.entry = PasswordResetWhitelist.objects.create(
+            email="kept@example.com", token="kept"
+        )
+
+    def perform(self, data, operation_serializer=WhitelistSerializer) -> dict:
+        return (
+            CustomCreateUpdateDeleteObjectOperationSerializer().perform_crud_operations(
+                data, operation_serializer, PasswordResetWhitelist
+            )
+        )
+
+    def test_operations_are_applied(self):
+        removed = PasswordResetWhitelist.objects.create(
+            email="removed@example.com", token="removed"
+        )
+
+        counts = self.perform(
+            [
+                {"operation": "add", "email": "new@example.com", "token": "new"},
+                {"operation": "update", "id": str(self.entry.pk), "token": "renewed"},
+                {"operation": "delete", "id": str(removed.pk)},
+            ]
+        )
+
+        self.assertEqual(counts, {"add": 1, "update": 1, "delete": 1})
+        self.assertEqual(
+            sorted(PasswordResetWhitelist.objects.values_list("token", flat=True)),
+            ["new", "renewed"],
+        )
+
+    def test_duplicate_unique_values_are_rejected(self):
+        class UniqueWhitelistSerializer(serializers.ModelSerializer):
+            class Meta:
+                model = PasswordResetWhitelist
+                fields = ["id", "email", "token"]
+
+        with self.assertRaises(ValidationError):
+            self.perform(
+                [
+                    {"operation": "add", "email": "same@example.com", "token": "a"},
+                    {"operation": "add", "email": "same@example.com", "token": "b"},
+                ],
+                UniqueWhitelistSerializer,
+            )
+        self.assertFalse(
+            PasswordResetWhitelist.objects.filter(email="same@example.com").exists()
+        )
+
+    def test_overridden_create_is_used(self):
+        self.perform(
+            [{"operation": "add", "email": "NEW@example.com", "token": "new"}],
+            LowercaseWhitelistSerializer,
+        )
+
+        self.assertTrue(
+            PasswordResetWhitelist.objects.filter(email="new@example.com").exists()
+        )
+
+    def test_update_is_validated(self):
+        with self.assertRaises(ValidationError):
+            self.perform(
+                [{"operation": "update", "id": str(self.entry.pk), "email": "invalid"}]
+            )
+        self.assertEqual(
+            PasswordResetWhitelist.objects.get(pk=self.entry.pk).email,
+            "kept@example.com",
+        )
+
+    def test_update_ignores_unknown_fields(self):
+        counts = self.perform(
+            [{"operation": "update", "id": str(self.entry.pk), "unknown": "value"}]
+        )
+
+        self.assertEqual(counts["update"], 1)
+
+
+class StreamingListFieldUpdateTests(TestCase):
+    query_params = {"subject": "list", "body": "list"}
+
+    def setUp(self):
+        for email in ["a@example.com", "b@example.com", "c@example.com"]:
+            EmailOutbox.objects.create(to_email=email, **self.query_params)
+        EmailOutbox.objects.create(to_email="a@example.com", subject="other")
+
+    def update(self, values: list) -> dict:
+        serializer = FieldListUpdateSerializer()
+        serializer.list_field_update_batch_size = 2
+        return serializer.perform_streaming_list_field_update(
+            values, EmailOutbox, "to_email", self.query_params
+        )
+
+    def get_stored(self) -> list:
+        return sorted(
+            EmailOutbox.objects.filter(**self.query_params).values_list(
+                "to_email", flat=True
+            )
+        )
+
+    def test_diff_is_applied(self):
+        counts = self.update(
+            ["b@example.com", "d@example.com", "c@example.com", "d@example.com"]
+        )
+
+        self.assertEqual(counts, {"add": 1, "delete": 1})
+        self.assertEqual(
+            self.get_stored(), ["b@example.com", "c@example.com", "d@example.com"]
+        )
+        self.assertTrue(EmailOutbox.objects.filter(subject="other").exists())
+
+    def test_none_values_do_not_hide_stored_rows(self):
+        counts = self.update([None, "b@example.com", "e@example.com"])
+
+        self.assertEqual(counts, {"add": 1, "delete": 2})
+        self.assertEqual(self.get_stored(), ["b@example.com", "e@example.com"])
+
+
+class RaisingAsyncView(CustomAsyncAPIView):
+    async def post(self, request):
+        raise request.data["exception"]
+
+
+class AsyncAPIViewTests(TestCase):
+    def post(self, exception):
+        request = RequestFactory().post("/")
+        view = RaisingAsyncView.as_view()
+        with mock.patch.object(RaisingAsyncView, "parse") as parse:
+            parse.return_value = {"exception": exception}
+            response = async_to_sync(view)(request)
+        return response.status_code, json.loads(response.content)
+
+    def test_django_exceptions_use_the_error_envelope(self):
+        exceptions = [
+            (Http404("missing"), 404),
+            (PermissionDenied(), 403),
+            (DjangoValidationError("Invalid value."), 400),
+            (DjangoValidationError({"name": ["Required."]}), 400),
+        ]
+        for exception, status_code in exceptions:
+            with self.subTest(exception=exception):
+                response_status, data = self.post(exception)
+                self.assertEqual(response_status, status_code)
+                self.assertEqual(data["status_code"], status_code)
+
+    def test_validation_error_message_is_kept(self):
+        _, data = self.post(DjangoValidationError({"name": ["Required."]}))
+
+        self.assertEqual(
+            data, {"status_code": 400, "message": "name: Required.", "result": None}
+        )
+
+
+def queue_outbox(count: int) -> list:
+    return EmailOutbox.objects.bulk_create(
+        [
+            EmailOutbox(
+                subject=f"Subject {index}",
+                to_email=f"user-{index}@example.com",
+                body="<p>Hello</p>",
+            )
+            for index in range(count)
+        ]
+    )
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError("SMTP is down")
+
+
+class TransactionCheckingEmailBackend(EmailBackend):
+    in_atomic_block = []
+
+    def send_messages(self, messages):
+        self.in_atomic_block.append(connection.in_atomic_block)
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+class SendQueuedMailTests(TestCase):
+    def test_batch_is_sent_with_one_write_per_email(self):
+        queue_outbox(50)
+
+        # expire dead leases, select and lease, then one update per email
+        with self.assertNumQueries(5 + 50):
+            report = send_queued_mail(batch_size=100)
+
+        self.assertEqual(report, {"sent": 50, "failed": 0})
+        self.assertEqual(len(mail.outbox), 50)
+        self.assertFalse(
+            EmailOutbox.objects.exclude(status=EmailOutbox.Status.SENT).exists()
+        )
+        self.assertEqual(send_queued_mail(batch_size=100), {"sent": 0, "failed": 0})
+
+    def test_leased_emails_are_skipped(self):
+        queue_outbox(3)
+        EmailOutbox.objects.filter(to_email="user-0@example.com").update(
+            next_attempt_at=timezone.now() + timedelta(minutes=5)
+        )
+
+        self.assertEqual(send_queued_mail(batch_size=100)["sent"], 2)
+
+    @override_settings(EMAIL_BACKEND="core.tests.FailingEmailBackend")
+    def test_failures_are_retried_with_backoff(self):
+        [email] = queue_outbox(1)
+
+        report = send_queued_mail(max_attempts=2, retry_base_seconds=60)
+
+        email.refresh_from_db()
+        self.assertEqual(report, {"sent": 0, "failed": 1})
+        self.assertEqual(email.status, EmailOutbox.Status.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.last_error, "SMTP is down")
+        self.assertGreater(
+            email.next_attempt_at, timezone.now() + timedelta(seconds=50)
+        )
+
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        send_queued_mail(max_attempts=2, retry_base_seconds=60)
+
+        email.refresh_from_db()
+        self.assertEqual(email.status, EmailOutbox.Status.FAILED)
+        self.assertEqual(email.attempts, 2)
+
+    def test_emails_of_a_dead_worker_are_retried_or_failed(self):
+        retried, exhausted = queue_outbox(2)
+        EmailOutbox.objects.filter(pk=retried.pk).update(attempts=1)
+        EmailOutbox.objects.filter(pk=exhausted.pk).update(attempts=2)
+        # Leases taken by a worker that died before storing any result
+        EmailOutbox.objects.update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        report = send_queued_mail(max_attempts=2)
+
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual(report, {"sent": 1, "failed": 0})
+        self.assertEqual(retried.status, EmailOutbox.Status.SENT)
+        self.assertEqual(retried.attempts, 2)
+        self.assertEqual(exhausted.status, EmailOutbox.Status.FAILED)
+        self.assertEqual(exhausted.attempts, 2)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(EMAIL_BACKEND="core.tests.TransactionCheckingEmailBackend")
+class SendQueuedMailTransactionTests(TransactionTestCase):
+    def test_emails_are_sent_outside_of_transactions(self):
+        queue_outbox(3)
+
+        send_queued_mail()
+
+        self.assertEqual(TransactionCheckingEmailBackend.in_atomic_block, [False] * 3)
+
+
+class InterruptingEmailBackend(EmailBackend):
+    """
+    Fails every send that would go past ``limit`` messages, like a worker
+    killed in the middle of a chunk.
+    """
+
+    limit = None
+    lock = threading.Lock()
+
+    def send_messages(self, messages):
+        with self.lock:
+            if self.limit is not None and len(mail.outbox) + len(messages) > self.limit:
+                raise ConnectionError("Worker stopped")
+            return super().send_messages(messages)
+
+
+class SendBulkMailTests(TestCase):
+    def setUp(self):
+        self.users = sorted(
+            (create_user(f"bulk-{index}") for index in range(7)),
+            key=lambda user: user.pk,
+        )
+
+    def send(self, **kwargs) -> dict:
+        return send_bulk_mail(
+            "Subject",
+            User.objects.all(),
+            "email/account_verification.html",
+            "http://testserver",
+            chunk_size=3,
+            connection_count=2,
+            **kwargs,
+        )
+
+    @override_settings(EMAIL_BACKEND="core.tests.InterruptingEmailBackend")
+    def test_interrupted_run_resumes_from_its_checkpoint(self):
+        # The first chunk and part of the second one are sent
+        InterruptingEmailBackend.limit = 5
+        self.addCleanup(setattr, InterruptingEmailBackend, "limit", None)
+        with self.assertRaises(ConnectionError):
+            self.send(checkpoint_name="newsletter")
+        interrupted = [message.to[0] for message in mail.outbox]
+        self.assertGreater(len(interrupted), 3)
+
+        InterruptingEmailBackend.limit = None
+        report = self.send(checkpoint_name="newsletter")
+
+        recipients = [message.to[0] for message in mail.outbox]
+        emails = [user.email for user in self.users]
+        self.assertEqual(set(recipients), set(emails))
+        self.assertEqual(report["sent"], len(recipients) - len(interrupted))
+        # Only the interrupted chunk is sent again
+        resent = sorted(
+            email for email in set(recipients) if recipients.count(email) > 1
+        )
+        self.assertLessEqual(len(resent), 3)
+        self.assertTrue(set(resent) <= set(emails[3:6]))
+        checkpoint = BulkMailCheckpoint.objects.get(name="newsletter")
+        self.assertEqual(checkpoint.last_pk, str(self.users[-1].pk))
+        self.assertEqual(checkpoint.sent_count, len(recipients) - len(resent))
+
+    @override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+    def test_every_recipient_is_sent_once(self):
+        report = self.send(common_context={"token": "common"})
+
+        self.assertEqual(report["sent"], 7)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            sorted(user.email for user in self.users),
+        )
+        self.assertFalse(BulkMailCheckpoint.objects.exists())
+
+
+class MediaRootTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.root = directory.name
+
+    def create_file(self, name: str, age_seconds=0) -> str:
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(b"content")
+        if age_seconds:
+            modified = time.time() - age_seconds
+            os.utime(path, (modified, modified))
+        return name
+
+    def file_exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.root, name))
+
+
+class DeleteQueuedFilesTests(MediaRootTestCase):
+    def test_committed_deletions_are_deleted(self):
+        names = [self.create_file("profile_photo/a.png"), "profile_photo/gone.png"]
+        queue_file_deletion(*names, "")
+
+        report = delete_queued_files()
+
+        self.assertEqual(report, {"deleted": 2, "failed": 0})
+        self.assertFalse(self.file_exists(names[0]))
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+    def test_rolled_back_deletions_keep_the_file(self):
+        name = self.create_file("profile_photo/a.png")
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            queue_file_deletion(name)
+            raise RuntimeError("rolled back")
+
+        self.assertEqual(delete_queued_files(), {"deleted": 0, "failed": 0})
+        self.assertTrue(self.file_exists(name))
+
+    def test_failures_are_retried_with_backoff(self):
+        [deletion] = queue_file_deletion(self.create_file("profile_photo/a.png"))
+
+        with mock.patch(
+            "core.modelutils.default_storage.delete",
+            side_effect=OSError("disk is busy"),
+        ):
+            report = delete_queued_files(max_attempts=2, retry_base_seconds=60)
+            # Not due before its backoff ran out
+            self.assertEqual(delete_queued_files(), {"deleted": 0, "failed": 0})
+
+            deletion.refresh_from_db()
+            self.assertEqual(report, {"deleted": 0, "failed": 1})
+            self.assertEqual(deletion.attempts, 1)
+            self.assertEqual(deletion.last_error, "disk is busy")
+            self.assertGreater(
+                deletion.next_attempt_at, timezone.now() + timedelta(seconds=50)
+            )
+
+            PendingFileDeletion.objects.update(next_attempt_at=timezone.now())
+            report = delete_queued_files(max_attempts=2, retry_base_seconds=60)
+
+        self.assertEqual(report, {"deleted": 0, "failed": 1})
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+    def test_deletions_of_a_dead_worker_are_retried(self):
+        name = self.create_file("profile_photo/a.png")
+        queue_file_deletion(name)
+        # A lease taken by a worker that died before deleting the file
+        PendingFileDeletion.objects.update(
+            attempts=1, next_attempt_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        self.assertEqual(delete_queued_files(), {"deleted": 1, "failed": 0})
+        self.assertFalse(self.file_exists(name))
+
+
+class DeleteQueuedFilesTransactionTests(TransactionTestCase):
+    def test_files_are_deleted_outside_of_transactions(self):
+        queue_file_deletion("profile_photo/a.png")
+        in_atomic_block = []
+
+        with mock.patch(
+            "core.modelutils.default_storage.delete",
+            side_effect=lambda name: in_atomic_block.append(connection.in_atomic_block),
+        ):
+            delete_queued_files()
+
+        self.assertEqual(in_atomic_block, [False])
+
+
+class SweepOrphanMediaTests(MediaRootTestCase):
+    def sweep(self, *args) -> str:
+        stdout = io.StringIO()
+        call_command("sweep_orphan_media", "--batch-size", "2", *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def setUp(self):
+        super().setUp()
+        create_user(_profile_photo="profile_photo/used.png")
+        self.referenced = [
+            self.create_file("profile_photo/used.png", age_seconds=7200),
+            self.create_file("profile_photo/used__64.webp", age_seconds=7200),
+        ]
+        self.orphaned = [
+            self.create_file("profile_photo/orphan.png", age_seconds=7200),
+            self.create_file("profile_photo/orphan__64.webp", age_seconds=7200),
+        ]
+        # Its row may not be committed yet
+        self.recent = self.create_file("profile_photo/recent.png")
+
+    def test_only_old_unreferenced_files_are_deleted(self):
+        output = self.sweep()
+
+        self.assertIn("Deleted 2 orphaned files out of 4 in 2 batches", output)
+        for name in self.referenced + [self.recent]:
+            self.assertTrue(self.file_exists(name), name)
+        for name in self.orphaned:
+            self.assertFalse(self.file_exists(name), name)
+
+    def test_dry_run_keeps_the_files(self):
+        output = self.sweep("--dry-run")
+
+        self.assertIn("Found 2 orphaned files out of 4", output)
+        for name in self.orphaned:
+            self.assertIn(name, output)
+            self.assertTrue(self.file_exists(name), name)
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.storage = ContentAddressedFileSystemStorage(location=self.directory.name)
+
+    def test_identical_content_shares_one_blob(self):
+        first = self.storage.save("photos/a.PNG", ContentFile(b"same"))
+        second = self.storage.save("photos/b.png", ContentFile(b"same"))
+        other = self.storage.save("photos/c.png", ContentFile(b"other"))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertTrue(first.startswith("photos/") and first.endswith(".png"))
+        self.assertEqual(ContentBlob.objects.get(name=first).refcount, 2)
+        self.assertEqual(ContentBlob.objects.get(name=first).size, 4)
+        with self.storage.open(first) as stored:
+            self.assertEqual(stored.read(), b"same")
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, ".tmp")), [])
+
+    def test_blob_is_removed_with_its_last_reference(self):
+        name = self.storage.save("photos/a.png", ContentFile(b"same"))
+        self.storage.save("photos/b.png", ContentFile(b"same"))
+
+        self.storage.delete(name)
+
+        self.assertEqual(ContentBlob.objects.get(name=name).refcount, 1)
+        self.assertTrue(self.storage.exists(name))
+
+        self.storage.delete(self.storage.path(name))
+
+        self.assertFalse(ContentBlob.objects.filter(name=name).exists())
+        self.assertFalse(self.storage.exists(name))
+
+    def test_save_finishing_during_another_save_of_the_same_blob(self):
+        get_content_name = self.storage.get_content_name
+        names = []
+
+        def save_concurrently(name, digest):
+            # Runs after the outer save hashed its content, before it stores it
+            if save_concurrently.pending:
+                save_concurrently.pending = False
+                names.append(self.storage.save(name, ContentFile(b"same")))
+            return get_content_name(name, digest)
+
+        save_concurrently.pending = True
+
+        with mock.patch.object(
+            self.storage, "get_content_name", side_effect=save_concurrently
+        ):
+            names.append(self.storage.save("photos/a.png", ContentFile(b"same")))
+
+        self.assertEqual(names[0], names[1])
+        self.assertEqual(ContentBlob.objects.get(name=names[0]).refcount, 2)
+        self.assertEqual(os.listdir(os.path.join(self.directory.name, ".tmp")), [])
+
+
+class ContentAddressedStorageConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.storage = ContentAddressedFileSystemStorage(location=self.directory.name)
+
+    # SQLite has no row locks and fails concurrent writers instead
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_concurrent_saves_of_the_same_blob(self):
+        barrier = threading.Barrier(2)
+        names, errors = [], []
+
+        def save():
+            try:
+                barrier.wait()
+                names.append(self.storage.save("photos/a.png", ContentFile(b"same")))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=save) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(names)), 1)
+        self.assertEqual(ContentBlob.objects.get(name=names[0]).refcount, 2)
+        self.assertTrue(self.storage.exists(names[0]))
+
+
+class SeedCommandTests(TestCase):
+    def seed(self, count: int, *args):
+        call_command("seed", count, "--prefix", "bench", *args, stdout=io.StringIO())
+
+    def test_resumes_after_the_highest_seeded_index(self):
+        self.seed(4)
+        User.all_objects.filter(username="bench-1").delete()
+        create_user("bench-other")
+
+        self.seed(6)
+
+        self.assertEqual(
+            sorted(
+                User.all_objects.filter(username__startswith="bench-").values_list(
+                    "username", flat=True
+                )
+            ),
+            ["bench-0", "bench-2", "bench-3", "bench-4", "bench-5", "bench-other"],
+        )
+
+    def test_photos_are_deleted_when_the_batch_fails(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        with override_settings(MEDIA_ROOT=directory.name), mock.patch(
+            "core.management.commands.seed.Command.insert_rows",
+            side_effect=RuntimeError("insert failed"),
+        ), self.assertRaises(RuntimeError):
+            self.seed(3, "--photos")
+
+        stored = [
+            name
+            for _, _, names in os.walk(directory.name)
+            for name in names
+            if name.endswith(".png")
+        ]
+        self.assertEqual(stored, [])
+        self.assertFalse(User.all_objects.exists())
+
+
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.entries = [
+            PasswordResetWhitelist.objects.create(
+                email=f"user-{index}@example.com", token=f"token-{index}"
+            )
+            for index in range(3)
+        ]
+
+    def test_default_manager_hides_soft_deleted_rows(self):
+        kept, deleted, _ = self.entries
+
+        with self.assertNumQueries(1):
+            updated = PasswordResetWhitelist.objects.exclude(pk=kept.pk).soft_delete()
+
+        self.assertEqual(updated, 2)
+        self.assertEqual(list(PasswordResetWhitelist.objects.all()), [kept])
+        self.assertEqual(PasswordResetWhitelist.all_objects.count(), 3)
+        self.assertEqual(PasswordResetWhitelist.all_objects.dead().count(), 2)
+        deleted = PasswordResetWhitelist.all_objects.get(pk=deleted.pk)
+        self.assertTrue(deleted.is_deleted)
+        self.assertIsNotNone(deleted.deleted_at)
+
+    def test_already_deleted_rows_are_not_touched_again(self):
+        PasswordResetWhitelist.objects.filter(pk=self.entries[0].pk).soft_delete()
+        deleted_at = PasswordResetWhitelist.all_objects.get(
+            pk=self.entries[0].pk
+        ).deleted_at
+
+        self.assertEqual(PasswordResetWhitelist.all_objects.soft_delete(), 2)
+        self.assertEqual(
+            PasswordResetWhitelist.all_objects.get(pk=self.entries[0].pk).deleted_at,
+            deleted_at,
+        )
+
+    def test_listeners_get_the_soft_deleted_primary_keys(self):
+        users = [create_user("alice"), create_user("bob")]
+
+        with mock.patch("core.signals.token_cache.invalidate_user") as invalidate:
+            User.objects.filter(username="alice").soft_delete()
+
+        invalidate.assert_called_with(users[0].pk)
+        self.assertEqual(list(User.objects.all()), [users[1]])
+
+
+class PurgeSoftDeletedTests(TestCase):
+    def purge(self, *args) -> str:
+        stdout = io.StringIO()
+        call_command(
+            "purge_soft_deleted",
+            "user.PasswordResetWhitelist",
+            "--batch-size",
+            "2",
+            *args,
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def create_entries(self, name: str, count: int, deleted_days_ago=None) -> list:
+        entries = [
+            PasswordResetWhitelist.objects.create(
+                email=f"{name}-{index}@example.com", token=f"{name}-{index}"
+            )
+            for index in range(count)
+        ]
+        if deleted_days_ago is not None:
+            PasswordResetWhitelist.all_objects.filter(
+                pk__in=[entry.pk for entry in entries]
+            ).update(
+                is_deleted=True,
+                deleted_at=timezone.now() - timedelta(days=deleted_days_ago),
+            )
+        return entries
+
+    @override_settings(SOFT_DELETE_RETENTION_DAYS=30)
+    def test_only_rows_past_the_retention_window_are_deleted(self):
+        alive = self.create_entries("alive", 1)
+        recent = self.create_entries("recent", 2, deleted_days_ago=29)
+        self.create_entries("expired", 3, deleted_days_ago=31)
+
+        output = self.purge()
+
+        self.assertIn(
+            "user.PasswordResetWhitelist: deleted 3 rows in 2 batches", output
+        )
+        self.assertEqual(
+            set(PasswordResetWhitelist.all_objects.all()), set(alive + recent)
+        )
+
+    def test_retention_and_batch_limits(self):
+        self.create_entries("recent", 2, deleted_days_ago=5)
+        self.create_entries("expired", 3, deleted_days_ago=31)
+
+        output = self.purge("--retention-days", "1", "--max-batches", "2")
+
+        self.assertIn("deleted 4 rows in 2 batches", output)
+        self.assertEqual(PasswordResetWhitelist.all_objects.count(), 1)
+
+    def test_models_must_be_core_models(self):
+        with self.assertRaises(CommandError):
+            call_command("purge_soft_deleted", "authtoken.Token")
+
+
+class DirtyFieldSaveTests(TestCase):
+    def setUp(self):
+        PasswordResetWhitelist.objects.create(email="alice@example.com", token="one")
+        self.entry = PasswordResetWhitelist.objects.get()
+
+    def get_update_sql(self, **kwargs) -> str:
+        with CaptureQueriesContext(connection) as queries:
+            self.entry.save(**kwargs)
+        [query] = queries.captured_queries
+        self.assertTrue(query["sql"].startswith("UPDATE"), query["sql"])
+        return query["sql"]
+
+    def test_unchanged_instance_is_not_written(self):
+        with self.assertNumQueries(0):
+            self.entry.save()
+
+    def test_only_changed_and_auto_now_fields_are_written(self):
+        self.entry.token = "two"
+
+        sql = self.get_update_sql()
+
+        self.assertIn('"token"', sql)
+        self.assertIn('"updated_at"', sql)
+        self.assertNotIn('"email"', sql)
+        self.assertNotIn('"created_at"', sql)
+        self.assertEqual(PasswordResetWhitelist.objects.get().token, "two")
+        # The saved values are the new snapshot
+        with self.assertNumQueries(0):
+            self.entry.save()
+
+    def test_update_fields_of_the_caller_are_kept(self):
+        self.entry.token = "two"
+        self.entry.email = "bob@example.com"
+
+        sql = self.get_update_sql(update_fields=["email"])
+
+        self.assertIn('"email"', sql)
+        self.assertNotIn('"token"', sql)
+        self.assertNotIn('"updated_at"', sql)
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.token, "one")
+        self.assertEqual(self.entry.email, "bob@example.com")
+
+    def test_unsaved_change_is_still_written_later(self):
+        self.entry.token = "two"
+        self.entry.email = "bob@example.com"
+        self.entry.save(update_fields=["email"])
+
+        sql = self.get_update_sql()
+
+        self.assertIn('"token"', sql)
+        self.assertNotIn('"email"', sql)
+
+    def test_deferred_instances_are_saved_normally(self):
+        entry = PasswordResetWhitelist.objects.only("token").get()
+        entry.token = "two"
+
+        with CaptureQueriesContext(connection) as queries:
+            entry.save()
+
+        [query] = queries.captured_queries
+        self.assertIn('"token"', query["sql"])
+        self.assertNotIn('"email"', query["sql"])
+        self.assertEqual(PasswordResetWhitelist.objects.get().token, "two")
+
+
+def run_queries(count: int):
+    def get_response(request):
+        for index in range(count):
+            PasswordResetWhitelist.objects.filter(token=f"token-{index}").exists()
+        User.objects.exists()
+        return HttpResponse("ok")
+
+    return get_response
+
+
+class QueryInstrumentationMiddlewareTests(TestCase):
+    def get_middleware(self, queries=6, **overrides):
+        settings_override = override_settings(
+            **{
+                "QUERY_INSTRUMENTATION_ENABLED": True,
+                "QUERY_INSTRUMENTATION_N_PLUS_ONE_THRESHOLD": 5,
+                "QUERY_INSTRUMENTATION_REPORT_DIR": "",
+                **overrides,
+            }
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        return QueryInstrumentationMiddleware(run_queries(queries))
+
+    def get_report(self, middleware, level="INFO") -> tuple:
+        with self.assertLogs("core.instrumentation", level) as logs:
+            response = middleware(RequestFactory().get("/whitelist/"))
+        [record] = logs.records
+        self.assertEqual(record.levelname, level)
+        return response, json.loads(record.getMessage())
+
+    def test_queries_are_counted(self):
+        response, report = self.get_report(self.get_middleware(queries=2))
+
+        self.assertEqual(report["queries"], 3)
+        self.assertEqual(report["n_plus_one"], [])
+        self.assertEqual((report["method"], report["path"]), ("GET", "/whitelist/"))
+        self.assertEqual(report["status"], 200)
+        self.assertIn('desc="3 queries"', response["Server-Timing"])
+
+    def test_repeated_fingerprints_are_reported(self):
+        response, report = self.get_report(self.get_middleware(queries=6), "WARNING")
+
+        self.assertEqual(report["queries"], 7)
+        [duplicate] = report["n_plus_one"]
+        self.assertEqual(duplicate["count"], 6)
+        self.assertIn("user_passwordresetwhitelist", duplicate["fingerprint"])
+        self.assertNotIn("token-", duplicate["fingerprint"])
+
+    def test_sampled_reports_are_written(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        middleware = self.get_middleware(
+            QUERY_INSTRUMENTATION_REPORT_DIR=directory.name,
+            QUERY_INSTRUMENTATION_SAMPLE_RATE=1.0,
+        )
+
+        self.get_report(middleware, "WARNING")
+
+        [file_name] = os.listdir(directory.name)
+        with open(os.path.join(directory.name, file_name)) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report["queries"], 7)
+        self.assertEqual(sorted(report["fingerprints"].values()), [1, 6])
+
+    def test_queries_outside_of_requests_are_not_counted(self):
+        middleware = self.get_middleware(queries=0)
+        self.get_report(middleware)
+
+        with CaptureQueriesContext(connection) as queries:
+            User.objects.exists()
+
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertEqual(connection.execute_wrappers, [])
+
+    @override_settings(QUERY_INSTRUMENTATION_ENABLED=False)
+    def test_disabled_middleware_is_removed(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            QueryInstrumentationMiddleware(run_queries(1))
+
+    @override_settings(QUERY_INSTRUMENTATION_ENABLED=False)
+    def test_disabled_middleware_adds_nothing_to_responses(self):
+        with mock.patch("core.middleware.logger") as logger:
+            response = self.client.get("/media/missing.txt")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("Server-Timing", response)
+        logger.log.assert_not_called()
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def get_middleware(self, sample_rate=0.0, max_files=10):
+        with override_settings(
+            PROFILING_ENABLED=True,
+            PROFILING_SAMPLE_RATE=sample_rate,
+            PROFILING_HEADER="X-Profile",
+            PROFILING_DIR=self.directory,
+            PROFILING_MAX_FILES=max_files,
+        ):
+            return ProfilingMiddleware(run_queries(1))
+
+    def get_profiles(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.listdir(self.directory))
+
+
+class ProfilingMiddlewareTests(ProfilingTestCase):
+    def get(self, middleware, user=None):
+        headers = {}
+        if user is not None:
+            token = Token.objects.create(user=user)
+            headers = {"HTTP_X_PROFILE": "1", "HTTP_AUTHORIZATION": f"Bearer {token}"}
+        return middleware(RequestFactory().get("/whitelist/", **headers))
+
+    def test_sampled_requests_are_profiled(self):
+        response = self.get(self.get_middleware(sample_rate=1.0))
+
+        self.assertEqual(self.get_profiles(), [response["X-Profile-Id"]])
+        self.assertRegex(response["X-Profile-Id"], r"^\d{14}__unresolved__\w{8}\.prof$")
+
+    def test_unsampled_requests_are_not_profiled(self):
+        response = self.get(self.get_middleware(sample_rate=0.0))
+
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(self.get_profiles(), [])
+
+    def test_header_profiles_requests_of_admins_only(self):
+        middleware = self.get_middleware(sample_rate=0.0)
+
+        response = self.get(middleware, create_user("bob"))
+        self.assertNotIn("X-Profile-Id", response)
+
+        response = self.get(
+            middleware, create_user("admin", user_type=User.UserType.ADMIN)
+        )
+        self.assertEqual(self.get_profiles(), [response["X-Profile-Id"]])
+
+    def test_only_the_newest_profiles_are_kept(self):
+        middleware = self.get_middleware(sample_rate=1.0, max_files=2)
+
+        for _ in range(4):
+            self.get(middleware)
+
+        self.assertEqual(len(self.get_profiles()), 2)
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_middleware_is_removed(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(run_queries(1))
+
+
+class ProfilesCommandTests(ProfilingTestCase):
+    def setUp(self):
+        super().setUp()
+        middleware = self.get_middleware(sample_rate=1.0)
+        for _ in range(2):
+            middleware(RequestFactory().get("/whitelist/"))
+        [self.first, self.second] = self.get_profiles()
+
+    @staticmethod
+    def get_glob(name: str) -> str:
+        return name.replace(".prof", "*")
+
+    def profiles(self, *args) -> str:
+        stdout = io.StringIO()
+        call_command("profiles", *args, "--directory", self.directory, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_list(self):
+        output = self.profiles("list")
+
+        self.assertIn(self.first, output)
+        self.assertIn(self.second, output)
+        self.assertIn("2 profiles", output)
+        self.assertIn("0 profiles", self.profiles("list", "user-list"))
+        self.assertIn("1 profiles", self.profiles("list", self.get_glob(self.first)))
+
+    def test_aggregate(self):
+        output = self.profiles("aggregate", "unresolved")
+
+        self.assertIn("Aggregated 2 profiles", output)
+        self.assertIn("(get_response)", output)
+        with self.assertRaises(CommandError):
+            self.profiles("aggregate", "user-list")
+
+    def test_diff(self):
+        output = self.profiles(
+            "diff", self.get_glob(self.first), self.get_glob(self.second)
+        )
+
+        self.assertIn("1 base and 1 target profiles", output)
+        self.assertIn("(get_response)", output)
+        with self.assertRaises(CommandError):
+            self.profiles("diff", "unresolved")
@@ -0,0 +1,31 @@
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .exceptions import FileTooLarge
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """
+    Rejects an upload once it exceeds ``max_size`` bytes, checking the declared
+    content length before anything is read and the received bytes after.
+    Chunks are passed on untouched to the next handler.
+    """
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.received = 0
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        if content_length and content_length > self.max_size:
+            raise FileTooLarge()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            raise FileTooLarge()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
@@ -1 +1,222 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connections, router, transaction
+from rest_framework.authtoken.models import Token
+
+from .classes import token_cache
+from .metrics import PASSWORD_HASHING_LATENCY
+
+logger = logging.getLogger(__name__)
+
+_uuid7_lock = threading.Lock()
+_uuid7_last_stamp = 0
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Returns a time-ordered UUID in the version 7 layout of RFC 9562: a 48 bit
+    Unix timestamp in milliseconds, 12 bits of sub-millisecond precision and
+    62 random bits. Values generated by a process are strictly increasing, so
+    inserts land at the right edge of the primary key index.
+    """
+    global _uuid7_last_stamp
+
+    nanoseconds = time.time_ns()
+    stamp = (nanoseconds // 1_000_000) << 12 | (
+        nanoseconds % 1_000_000 * 4096 // 1_000_000
+    )
+    with _uuid7_lock:
+        stamp = max(stamp, _uuid7_last_stamp + 1)
+        _uuid7_last_stamp = stamp
+    random_bits = int.from_bytes(os.urandom(8), "big") & (1 << 62) - 1
+    return uuid.UUID(
+        int=(stamp >> 12) << 80
+        | 7 << 76
+        | (stamp & 0xFFF) << 64
+        | 0b10 << 62
+        | random_bits
+    )
+
+
+def default_uuid() -> uuid.UUID:
+    """
+    Primary key default of CoreModel, a uuid7 when CORE_MODEL_UUID_VERSION is
+    7 and a random uuid4 otherwise.
+    """
+    if settings.CORE_MODEL_UUID_VERSION == 7:
+        return uuid7()
+    return uuid.uuid4()
+
+
+def reap_expired_tokens(batch_size=1000, max_batches=None, sleep_seconds=0.0):
+    """
+    Deletes authentication tokens older than USER_AUTH_TOKEN_EXPIRATION_SECONDS
+    in bounded batches, each one in its own short transaction.
+    Returns a report with the number of deleted rows and the throughput.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(
+        seconds=settings.USER_AUTH_TOKEN_EXPIRATION_SECONDS
+    )
+    expired = Token.objects.filter(created__lt=cutoff).order_by("created")
+    connection = connections[router.db_for_write(Token)]
+    quote_name = connection.ops.quote_name
+
+    deleted = 0
+    batches = 0
+    started_at = time.monotonic()
+    while max_batches is None or batches < max_batches:
+        keys = list(expired.values_list("key", flat=True)[:batch_size])
+        if not keys:
+            break
+        # A plain DELETE skips loading every row for the post_delete signal,
+        # the cache entries are dropped once for the whole batch instead.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM {table} WHERE {column} IN ({keys})".format(
+                    table=quote_name(Token._meta.db_table),
+                    column=quote_name(Token._meta.pk.column),
+                    keys=", ".join(["%s"] * len(keys)),
+                ),
+                keys,
+            )
+            deleted += cursor.rowcount
+        token_cache.invalidate(*keys)
+        batches += 1
+        if sleep_seconds:
+            time.sleep(sleep_seconds)
+
+    elapsed = time.monotonic() - started_at
+    return {
+        "deleted": deleted,
+        "batches": batches,
+        "seconds": elapsed,
+        "rows_per_second": deleted / elapsed if elapsed else 0.0,
+    }
+
+
+def purge_soft_deleted(
+    model, retention_days=None, batch_size=500, max_batches=None, sleep_seconds=0.0
+):
+    """
+    Hard deletes rows of a CoreModel subclass that were soft deleted more than
+    ``retention_days`` (SOFT_DELETE_RETENTION_DAYS by default) ago, in bounded
+    batches, each one in its own short transaction.
+    Returns a report with the number of deleted rows and the throughput.
+    """
+    if retention_days is None:
+        retention_days = settings.SOFT_DELETE_RETENTION_DAYS
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    expired = (
+        model.all_objects.dead().filter(deleted_at__lt=cutoff).order_by("deleted_at")
+    )
+
+    deleted = 0
+    batches = 0
+    started_at = time.monotonic()
+    while max_batches is None or batches < max_batches:
+        pks = list(expired.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            # Collector delete, so cascades and delete signals still run
+            _, per_model = model.all_objects.filter(pk__in=pks).delete()
+        deleted += per_model.get(model._meta.label, 0)
+        batches += 1
+        if sleep_seconds:
+            time.sleep(sleep_seconds)
+
+    elapsed = time.monotonic() - started_at
+    return {
+        "deleted": deleted,
+        "batches": batches,
+        "seconds": elapsed,
+        "rows_per_second": deleted / elapsed if elapsed else 0.0,
+    }
+
+
+_password_hashing_executor = None
+_password_hashing_executor_lock = threading.Lock()
+
+
+def get_password_hashing_executor() -> ThreadPoolExecutor:
+    """
+    Returns the process wide pool, sized by PASSWORD_HASHING_POOL_SIZE, that
+    async views use for password hashing.
+    """
+    global _password_hashing_executor
+    with _password_hashing_executor_lock:
+        if _password_hashing_executor is None:
+            _password_hashing_executor = ThreadPoolExecutor(
+                max_workers=settings.PASSWORD_HASHING_POOL_SIZE,
+                thread_name_prefix="password-hashing",
+            )
+    return _password_hashing_executor
+
+
+def hash_password(password: str) -> str:
+    """
+    ``make_password`` recorded in the password hashing latency metric.
+    """
+    with PASSWORD_HASHING_LATENCY.labels("make").time():
+        return make_password(password)
+
+
+async def run_password_hashing(func, *args, **kwargs):
+    """
+    Runs a hashing call in the bounded pool so it does not block the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_password_hashing_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+_image_processing_executor = None
+_image_processing_executor_lock = threading.Lock()
+
+
+def get_image_processing_executor() -> ProcessPoolExecutor:
+    """
+    Returns the process wide pool, sized by IMAGE_PROCESSING_WORKERS, that
+    renders image variants off the request path.
+    """
+    global _image_processing_executor
+    with _image_processing_executor_lock:
+        if _image_processing_executor is None:
+            _image_processing_executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+    return _image_processing_executor
+
+
+def _log_background_failure(future):
+    exception = future.exception()
+    if exception is not None:
+        logger.error("Background image processing failed", exc_info=exception)
+
+
+def run_image_processing(func, *args):
+    """
+    Submits ``func`` to the image processing pool once the current transaction
+    commits. Does nothing when IMAGE_PROCESSING_WORKERS is 0.
+    """
+    if not settings.IMAGE_PROCESSING_WORKERS:
+        return
+
+    def submit():
+        future = get_image_processing_executor().submit(func, *args)
+        future.add_done_callback(_log_background_failure)
+
+    transaction.on_commit(submit)
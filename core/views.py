@@ -10,10 +10,26 @@ from rest_framework.generics import (
     DestroyAPIView,
     UpdateAPIView,
 )
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import PermissionDenied
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, JsonResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import (
+    APIException,
+    MethodNotAllowed,
+    ParseError,
+    ValidationError,
+)
+from rest_framework.fields import get_error_detail
 
+from core.classes import CustomTokenAuthentication
+from core.exceptions import custom_exception_handler
 from core.mixins import CustomListUpdateModelMixin, CustomListModelMixin
 
 # Create your views here.
@@ -150,3 +166,71 @@ class CustomAPIView(APIView):
 
     def delete(self, request, response_data=None, *args, **kwargs):
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CustomAsyncAPIView:
+    """
+    Minimal native async view for the ASGI handler, DRF views being sync only.
+    Handlers receive the Django request with the parsed JSON body as
+    ``request.data`` and the token user as ``request.user``, and return a
+    JsonResponse. API exceptions, Http404, PermissionDenied and django
+    ValidationErrors are rendered by ``custom_exception_handler``.
+    """
+
+    http_method_names = ["post", "options"]
+    authentication_class = CustomTokenAuthentication
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            return await self.dispatch(request, *args, **kwargs)
+
+        view.cls = cls
+        view.csrf_exempt = True
+        return view
+
+    def parse(self, request) -> dict:
+        if not request.body:
+            return {}
+        try:
+            return json.loads(request.body)
+        except ValueError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+    def authenticate(self, request):
+        user_auth_tuple = self.authentication_class().authenticate(request)
+        if user_auth_tuple is None:
+            return AnonymousUser(), None
+        return user_auth_tuple
+
+    def handle_exception(self, exc) -> JsonResponse:
+        if isinstance(exc, DjangoValidationError):
+            exc = ValidationError(detail=get_error_detail(exc))
+        response = custom_exception_handler(exc, {"view": self})
+        return JsonResponse(response.data, status=response.status_code)
+
+    async def options(self, request, *args, **kwargs):
+        response = JsonResponse({})
+        response["Allow"] = ", ".join(
+            method.upper() for method in self.http_method_names
+        )
+        return response
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = None
+        if method in self.http_method_names:
+            handler = getattr(self, method, None)
+        try:
+            if handler is None:
+                raise MethodNotAllowed(request.method)
+            request.data = self.parse(request)
+            request.user, request.auth = await sync_to_async(self.authenticate)(request)
+            return await handler(request, *args, **kwargs)
+        except (APIException, Http404, PermissionDenied, DjangoValidationError) as exc:
+            return await sync_to_async(self.handle_exception)(exc)
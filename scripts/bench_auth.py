@@ -0,0 +1,123 @@
+"""
+Compares login and signup throughput of the sync views served through WSGI
+with the async views served through ASGI, in process and against a scratch
+database (a temporary SQLite file unless DATABASE_URL is set).
+
+    python scripts/bench_auth.py --requests 200 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+PASSWORD = "bench-password-123"
+
+
+def setup_django():
+    if "DATABASE_URL" not in os.environ:
+        database_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+        os.environ["DATABASE_URL"] = f"sqlite:///{database_path}"
+    os.environ.setdefault("DEBUG", "False")
+    os.environ.setdefault(
+        "DJANGO_SETTINGS_MODULE", "Django_rest_framework_template.settings"
+    )
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+def signup_payloads(count: int) -> list:
+    payloads = []
+    for _ in range(count):
+        name = uuid.uuid4().hex[:16]
+        payloads.append(
+            {"email": f"{name}@bench.local", "username": name, "password": PASSWORD}
+        )
+    return payloads
+
+
+def create_login_user() -> dict:
+    from django.contrib.auth.hashers import make_password
+    from user.models import User
+
+    name = uuid.uuid4().hex[:16]
+    User.objects.create(
+        email=f"{name}@bench.local", username=name, password=make_password(PASSWORD)
+    )
+    return {"email": f"{name}@bench.local", "password": PASSWORD}
+
+
+def bench_wsgi(path: str, payloads: list, concurrency: int) -> tuple:
+    from django.test import Client
+
+    def post(payload):
+        response = Client().post(path, payload, content_type="application/json")
+        return response.status_code < 400
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(post, payloads))
+    return time.perf_counter() - started_at, results.count(False)
+
+
+def bench_asgi(path: str, payloads: list, concurrency: int) -> tuple:
+    from django.test import AsyncClient
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def post(payload):
+            async with semaphore:
+                response = await AsyncClient().post(
+                    path, payload, content_type="application/json"
+                )
+                return response.status_code < 400
+
+        return await asyncio.gather(*(post(payload) for payload in payloads))
+
+    started_at = time.perf_counter()
+    results = asyncio.run(run())
+    return time.perf_counter() - started_at, results.count(False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    setup_django()
+    login_payload = create_login_user()
+
+    scenarios = [
+        ("login", "wsgi", bench_wsgi, "/user/login/", [login_payload]),
+        ("login", "asgi", bench_asgi, "/user/login/async/", [login_payload]),
+        ("signup", "wsgi", bench_wsgi, "/user/signup/", None),
+        ("signup", "asgi", bench_asgi, "/user/signup/async/", None),
+    ]
+    print(f"{'endpoint':<8} {'server':<6} {'requests':>8} {'errors':>6} {'req/s':>8}")
+    for endpoint, server, bench, path, payloads in scenarios:
+        if payloads is None:
+            payloads = signup_payloads(args.requests)
+        else:
+            payloads = payloads * args.requests
+        elapsed, errors = bench(path, payloads, args.concurrency)
+        print(
+            f"{endpoint:<8} {server:<6} {len(payloads):>8} {errors:>6} "
+            f"{len(payloads) / elapsed:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Measures email throughput against a local SMTP stand-in: direct send_mail
+calls, which open one connection per email, versus the outbox worker, which
+reuses a single connection per batch.
+
+    python scripts/bench_outbox.py --emails 500
+"""
+import argparse
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP to accept and discard messages.
+    """
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost SMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 localhost")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                self.server.messages += 1
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    messages = 0
+    connections = 0
+
+
+def setup_django(port: int):
+    if "DATABASE_URL" not in os.environ:
+        database_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+        os.environ["DATABASE_URL"] = f"sqlite:///{database_path}"
+    os.environ.update(
+        {
+            "DEBUG": "False",
+            "EMAIL_BACKEND": "django.core.mail.backends.smtp.EmailBackend",
+            "EMAIL_HOST": "127.0.0.1",
+            "EMAIL_PORT": str(port),
+            "EMAIL_USE_TLS": "False",
+            "EMAIL_HOST_USER": "bench@localhost",
+            "EMAIL_HOST_PASSWORD": "",
+        }
+    )
+    os.environ.setdefault(
+        "DJANGO_SETTINGS_MODULE", "Django_rest_framework_template.settings"
+    )
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+def mail_arguments(index: int) -> dict:
+    return {
+        "subject": "Password Reset",
+        "to_email": f"user{index}@bench.local",
+        "template_name": "email/password_reset.html",
+        "input_context": {
+            "name": f"User {index}",
+            "link": "http://localhost/password-reset?token=bench",
+            "host_url": "http://localhost",
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+
+    sink = SMTPSink(("127.0.0.1", 0), SMTPSinkHandler)
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+    setup_django(sink.server_address[1])
+
+    from core.modelutils import queue_mail, send_mail, send_queued_mail
+
+    started_at = time.perf_counter()
+    for index in range(args.emails):
+        send_mail(**mail_arguments(index))
+    direct_seconds = time.perf_counter() - started_at
+    direct_connections = sink.connections
+
+    started_at = time.perf_counter()
+    for index in range(args.emails):
+        queue_mail(**mail_arguments(index))
+    queue_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    while send_queued_mail(batch_size=args.batch_size)["sent"]:
+        pass
+    worker_seconds = time.perf_counter() - started_at
+
+    print(f"{'mode':<14} {'emails':>7} {'connections':>11} {'emails/s':>9}")
+    print(
+        f"{'send_mail':<14} {args.emails:>7} {direct_connections:>11} "
+        f"{args.emails / direct_seconds:>9.1f}"
+    )
+    print(
+        f"{'queue_mail':<14} {args.emails:>7} {0:>11} {args.emails / queue_seconds:>9.1f}"
+    )
+    print(
+        f"{'outbox worker':<14} {args.emails:>7} "
+        f"{sink.connections - direct_connections:>11} "
+        f"{args.emails / worker_seconds:>9.1f}"
+    )
+    print(f"SMTP stand-in received {sink.messages} messages")
+    sink.shutdown()
+
+
+if __name__ == "__main__":
+    main()
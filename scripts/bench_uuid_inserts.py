@@ -0,0 +1,155 @@
+"""
+Compares insert throughput of random (uuid4) and time-ordered (uuid7) primary
+keys as a table grows, on SQLite and, when --postgres is given, on Postgres.
+Keys are stored the way Django stores a UUIDField: char(32) hex on SQLite and
+the native uuid type on Postgres.
+
+    python scripts/bench_uuid_inserts.py --rows 1000000
+    python scripts/bench_uuid_inserts.py --rows 1000000 --postgres postgresql://localhost/bench
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+CREATE_TABLE = (
+    "CREATE TABLE bench_uuid "
+    "(id {id_type} PRIMARY KEY, created_at {time_type} NOT NULL)"
+)
+
+
+def setup_django():
+    os.environ.setdefault(
+        "DJANGO_SETTINGS_MODULE", "Django_rest_framework_template.settings"
+    )
+
+    import django
+
+    django.setup()
+
+
+def sqlite_backend(directory: str):
+    connection = sqlite3.connect(os.path.join(directory, "bench.sqlite3"))
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.execute("DROP TABLE IF EXISTS bench_uuid")
+    connection.execute(CREATE_TABLE.format(id_type="char(32)", time_type="datetime"))
+    connection.commit()
+
+    def insert(keys: list, now: str):
+        connection.executemany(
+            "INSERT INTO bench_uuid (id, created_at) VALUES (?, ?)",
+            [(key.hex, now) for key in keys],
+        )
+        connection.commit()
+
+    def index_size() -> int:
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        return page_size * page_count
+
+    return insert, index_size, connection.close
+
+
+def postgres_backend(dsn: str):
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    connection = psycopg2.connect(dsn)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS bench_uuid")
+        cursor.execute(
+            CREATE_TABLE.format(id_type="uuid", time_type="timestamp with time zone")
+        )
+    connection.commit()
+
+    def insert(keys: list, now: str):
+        with connection.cursor() as cursor:
+            execute_values(
+                cursor,
+                "INSERT INTO bench_uuid (id, created_at) VALUES %s",
+                [(str(key), now) for key in keys],
+                page_size=len(keys),
+            )
+        connection.commit()
+
+    def index_size() -> int:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_relation_size('bench_uuid_pkey')")
+            return cursor.fetchone()[0]
+
+    def close():
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS bench_uuid")
+        connection.commit()
+        connection.close()
+
+    return insert, index_size, close
+
+
+def run(backend, generate, args) -> tuple:
+    insert, index_size, close = backend
+    rows_per_report = max(args.rows // args.reports, 1)
+    results = []
+    inserted = segment_rows = 0
+    started_at = segment_started_at = time.perf_counter()
+    try:
+        while inserted < args.rows:
+            count = min(args.batch_size, args.rows - inserted)
+            now = time.strftime("%Y-%m-%d %H:%M:%S")
+            insert([generate() for _ in range(count)], now)
+            inserted += count
+            segment_rows += count
+            if segment_rows >= rows_per_report or inserted == args.rows:
+                elapsed = time.perf_counter() - segment_started_at
+                results.append((inserted, segment_rows / elapsed))
+                segment_rows = 0
+                segment_started_at = time.perf_counter()
+        total = time.perf_counter() - started_at
+        size = index_size()
+    finally:
+        close()
+    return results, args.rows / total, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument(
+        "--reports", type=int, default=10, help="Throughput samples per run."
+    )
+    parser.add_argument("--postgres", help="DSN of a scratch Postgres database.")
+    args = parser.parse_args()
+
+    setup_django()
+    from core.utils import uuid7
+
+    generators = [("uuid4", uuid.uuid4), ("uuid7", uuid7)]
+    backends = [("sqlite", lambda: sqlite_backend(tempfile.mkdtemp()))]
+    if args.postgres:
+        backends.append(("postgres", lambda: postgres_backend(args.postgres)))
+
+    for backend_name, make_backend in backends:
+        for generator_name, generate in generators:
+            samples, average, size = run(make_backend(), generate, args)
+            print(f"{backend_name} {generator_name}")
+            print(f"  {'rows':>10} {'rows/s':>10}")
+            for inserted, rate in samples:
+                print(f"  {inserted:>10} {rate:>10.0f}")
+            print(
+                f"  average {average:.0f} rows/s, "
+                f"{'database' if backend_name == 'sqlite' else 'index'} size "
+                f"{size / 1024 / 1024:.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Compares two result files written by scripts/locustfile.py and exits with
+status 1 when the current run regressed against the baseline.
+
+    python scripts/compare_loadtest.py loadtest-baseline.json loadtest-results.json
+"""
+import argparse
+import json
+import sys
+
+
+def load_entries(path: str) -> dict:
+    with open(path) as results_file:
+        results = json.load(results_file)
+    entries = dict(results["endpoints"])
+    entries["total"] = results["total"]
+    return entries
+
+
+def get_failure_rate(entry: dict) -> float:
+    return entry["failures"] / entry["requests"] if entry["requests"] else 0.0
+
+
+def get_change(base: float, current: float) -> float:
+    return (current - base) / base if base else 0.0
+
+
+def compare_entry(base: dict, current: dict, args) -> list:
+    problems = []
+    for key in ("median_ms", "p95_ms"):
+        change = get_change(base[key], current[key])
+        if change > args.latency_threshold:
+            problems.append(
+                f"{key} {base[key]:.0f} -> {current[key]:.0f} ({change:+.0%})"
+            )
+    change = get_change(base["rps"], current["rps"])
+    if -change > args.throughput_threshold:
+        problems.append(
+            f"rps {base['rps']:.1f} -> {current['rps']:.1f} ({change:+.0%})"
+        )
+    base_failure_rate = get_failure_rate(base)
+    current_failure_rate = get_failure_rate(current)
+    if current_failure_rate - base_failure_rate > args.failure_threshold:
+        problems.append(
+            f"failure rate {base_failure_rate:.2%} -> {current_failure_rate:.2%}"
+        )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument(
+        "--latency-threshold",
+        type=float,
+        default=0.2,
+        help="Allowed relative increase of the median and p95 latency.",
+    )
+    parser.add_argument(
+        "--throughput-threshold",
+        type=float,
+        default=0.1,
+        help="Allowed relative decrease of the requests per second.",
+    )
+    parser.add_argument(
+        "--failure-threshold",
+        type=float,
+        default=0.01,
+        help="Allowed absolute increase of the failure rate.",
+    )
+    parser.add_argument(
+        "--min-requests",
+        type=int,
+        default=50,
+        help="Entries with fewer requests in either run are not compared.",
+    )
+    args = parser.parse_args()
+
+    baseline = load_entries(args.baseline)
+    current = load_entries(args.current)
+    regressions = 0
+    print(f"{'endpoint':<48} {'p95 ms':>15} {'rps':>15} {'failures':>15}  status")
+    for name in sorted(baseline.keys() | current.keys()):
+        base, entry = baseline.get(name), current.get(name)
+        if base is None or entry is None:
+            print(f"{name:<48} {'':>15} {'':>15} {'':>15}  only in one run")
+            continue
+        if min(base["requests"], entry["requests"]) < args.min_requests:
+            status = "too few requests"
+        else:
+            problems = compare_entry(base, entry, args)
+            regressions += bool(problems)
+            status = "; ".join(problems) if problems else "ok"
+        print(
+            f"{name:<48} "
+            f"{base['p95_ms']:>7.0f}{entry['p95_ms']:>8.0f} "
+            f"{base['rps']:>7.1f}{entry['rps']:>8.1f} "
+            f"{get_failure_rate(base):>7.1%}{get_failure_rate(entry):>8.1%}  {status}"
+        )
+
+    if regressions:
+        print(f"{regressions} regressed entries")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Gunicorn settings for serving the API with multiprocess Prometheus metrics.
+PROMETHEUS_MULTIPROC_DIR must be set in the environment of the master.
+
+    PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus gunicorn -c scripts/gunicorn.conf.py \
+        Django_rest_framework_template.wsgi
+"""
+import glob
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+
+def on_starting(server):
+    # Samples of a previous run would be added to the new one
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
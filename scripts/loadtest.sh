@@ -0,0 +1,73 @@
+#!/bin/bash
+# Seeds a throwaway database, serves it with gunicorn and runs the Locust
+# scenarios of scripts/locustfile.py headless. Results are written to
+# $LOADTEST_RESULTS and compared with $LOADTEST_BASELINE when it exists.
+#
+#   LOADTEST_USERS=1000 LOADTEST_DURATION=2m scripts/loadtest.sh
+
+set -euo pipefail
+
+cd "$(dirname "$0")/.."
+
+export LOADTEST_USERS=${LOADTEST_USERS:-1000}
+export LOADTEST_PASSWORD=${LOADTEST_PASSWORD:-loadtest-password}
+export LOADTEST_RESULTS=${LOADTEST_RESULTS:-loadtest-results.json}
+LOADTEST_BASELINE=${LOADTEST_BASELINE:-loadtest-baseline.json}
+LOADTEST_CONCURRENCY=${LOADTEST_CONCURRENCY:-50}
+LOADTEST_SPAWN_RATE=${LOADTEST_SPAWN_RATE:-10}
+LOADTEST_DURATION=${LOADTEST_DURATION:-2m}
+LOADTEST_PORT=${LOADTEST_PORT:-8765}
+
+WORK_DIR=$(mktemp -d)
+export DATABASE_URL="sqlite:///$WORK_DIR/loadtest.sqlite3"
+export EMAIL_BACKEND=django.core.mail.backends.console.EmailBackend
+export DEBUG=False
+export PROMETHEUS_MULTIPROC_DIR="$WORK_DIR/prometheus"
+export GUNICORN_BIND="127.0.0.1:$LOADTEST_PORT"
+
+SERVER_PID=
+cleanup() {
+    if [ -n "$SERVER_PID" ]; then
+        kill "$SERVER_PID" 2>/dev/null || true
+        wait "$SERVER_PID" 2>/dev/null || true
+    fi
+    rm -rf "$WORK_DIR"
+}
+trap cleanup EXIT
+
+python manage.py migrate --no-input > /dev/null
+
+python manage.py seed "$LOADTEST_USERS" --prefix loadtest --password "$LOADTEST_PASSWORD"
+python manage.py shell -c "
+import os
+from django.contrib.auth.hashers import make_password
+from user.models import User
+
+User.objects.create(
+    email='loadtest-admin@example.com',
+    username='loadtest_admin',
+    password=make_password(os.environ['LOADTEST_PASSWORD']),
+    user_type=User.UserType.ADMIN,
+)
+"
+
+gunicorn -c scripts/gunicorn.conf.py Django_rest_framework_template.wsgi \
+    > "$WORK_DIR/gunicorn.log" 2>&1 &
+SERVER_PID=$!
+
+for _ in $(seq 30); do
+    if curl -s -o /dev/null "http://$GUNICORN_BIND/metrics"; then
+        break
+    fi
+    sleep 1
+done
+
+locust -f scripts/locustfile.py --headless --only-summary --exit-code-on-error 0 \
+    -u "$LOADTEST_CONCURRENCY" -r "$LOADTEST_SPAWN_RATE" -t "$LOADTEST_DURATION" \
+    --host "http://$GUNICORN_BIND"
+
+if [ -f "$LOADTEST_BASELINE" ]; then
+    python scripts/compare_loadtest.py "$LOADTEST_BASELINE" "$LOADTEST_RESULTS"
+else
+    echo "No baseline at $LOADTEST_BASELINE, copy $LOADTEST_RESULTS there to compare later runs"
+fi
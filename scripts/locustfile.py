@@ -1,9 +1,161 @@
-from locust import HttpUser, task, between
+"""
+Load test scenarios for the user endpoints. Run through scripts/loadtest.sh,
+which seeds the accounts below, or against any server seeded the same way:
 
+    locust -f scripts/locustfile.py --headless -u 50 -r 10 -t 2m --host http://127.0.0.1:8000
 
-class AccountUser(HttpUser):
-    wait_time = between(1, 2)
+LOADTEST_USERS seeded accounts loadtest-<n>@example.com and the admin
+loadtest-admin@example.com share LOADTEST_PASSWORD. Results are written to
+LOADTEST_RESULTS as JSON when the run ends.
+"""
+import json
+import os
+import random
+import time
+import uuid
+
+from locust import HttpUser, between, events, task
+
+PASSWORD = os.environ.get("LOADTEST_PASSWORD", "loadtest-password")
+SEEDED_USERS = int(os.environ.get("LOADTEST_USERS", 1000))
+ADMIN_EMAIL = "loadtest-admin@example.com"
+RESULTS_PATH = os.environ.get("LOADTEST_RESULTS", "loadtest-results.json")
+
+
+def seeded_email() -> str:
+    return f"loadtest-{random.randrange(SEEDED_USERS)}@example.com"
+
+
+class AuthenticatedUser(HttpUser):
+    abstract = True
+    email = None
+
+    def on_start(self):
+        self.user_id = None
+        self.log_in()
+
+    def log_in(self):
+        with self.client.post(
+            "/user/login/",
+            json={"email": self.email or seeded_email(), "password": PASSWORD},
+            name="/user/login/",
+            catch_response=True,
+        ) as response:
+            if response.status_code != 200:
+                # Retried by the next task instead of ending the simulated user
+                response.failure(f"Login failed with status {response.status_code}")
+                return
+        result = response.json()["result"]
+        self.user_id = result["id"]
+        self.client.headers["Authorization"] = f"Bearer {result['token']}"
+
+
+class MemberUser(AuthenticatedUser):
+    """
+    Logged in user reading profiles.
+    """
+
+    weight = 6
+    wait_time = between(1, 3)
 
     @task
-    def user_info(self):
-        self.client.get("/")
+    def retrieve_profile(self):
+        if self.user_id is None:
+            return self.log_in()
+        self.client.get(f"/user/{self.user_id}/", name="/user/[id]/")
+
+
+class AdminUser(AuthenticatedUser):
+    """
+    Admin paging through and searching the user list.
+    """
+
+    weight = 1
+    wait_time = between(1, 3)
+    email = ADMIN_EMAIL
+
+    @task(3)
+    def list_users(self):
+        if self.user_id is None:
+            return self.log_in()
+        offset = random.randrange(0, SEEDED_USERS, 20)
+        self.client.get(f"/user/?limit=20&offset={offset}", name="/user/?offset")
+
+    @task(1)
+    def search_users(self):
+        if self.user_id is None:
+            return self.log_in()
+        self.client.get(
+            f"/user/?search=loadtest-{random.randrange(SEEDED_USERS)}",
+            name="/user/?search",
+        )
+
+
+class VisitorUser(HttpUser):
+    """
+    Anonymous visitor signing up, logging in and asking for password resets.
+    """
+
+    weight = 3
+    wait_time = between(1, 3)
+
+    @task(1)
+    def signup(self):
+        name = uuid.uuid4().hex[:16]
+        self.client.post(
+            "/user/signup/",
+            json={
+                "email": f"{name}@example.com",
+                "username": name,
+                "password": PASSWORD,
+            },
+            name="/user/signup/",
+        )
+
+    @task(3)
+    def login(self):
+        self.client.post(
+            "/user/login/",
+            json={"email": seeded_email(), "password": PASSWORD},
+            name="/user/login/",
+        )
+
+    @task(1)
+    def request_password_reset(self):
+        with self.client.post(
+            "/user/send-password-reset-email/",
+            json={"email": seeded_email()},
+            name="/user/send-password-reset-email/",
+            catch_response=True,
+        ) as response:
+            # A second request for the same account is rejected by design
+            if response.status_code == 400 and "already sent" in response.text:
+                response.success()
+
+
+def get_entry_results(entry) -> dict:
+    return {
+        "requests": entry.num_requests,
+        "failures": entry.num_failures,
+        "rps": entry.total_rps,
+        "avg_ms": entry.avg_response_time,
+        "median_ms": entry.median_response_time,
+        "p95_ms": entry.get_response_time_percentile(0.95),
+        "p99_ms": entry.get_response_time_percentile(0.99),
+    }
+
+
+@events.quitting.add_listener
+def write_results(environment, **kwargs):
+    stats = environment.stats
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": environment.host,
+        "total": get_entry_results(stats.total),
+        "endpoints": {
+            f"{entry.method} {entry.name}": get_entry_results(entry)
+            for entry in stats.entries.values()
+        },
+    }
+    with open(RESULTS_PATH, "w") as results_file:
+        json.dump(results, results_file, indent=2)
@@ -0,0 +1,310 @@
+"""
+Microbenchmarks of the response, pagination, error, serializer, token and
+model helpers, run in process against a scratch SQLite database. Every
+benchmark is calibrated to take at least --min-time per sample and repeated
+--repeat times; the median time per call is the figure to compare.
+
+    python scripts/microbench.py --filter serializer
+    python scripts/microbench.py --compare HEAD~5 HEAD
+
+--compare checks both revisions out into temporary git worktrees, runs this
+script against each of them and prints the change of the medians.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+PASSWORD = "bench-password-123"
+
+
+def setup_django(root: Path):
+    sys.path.insert(0, str(root))
+    os.chdir(root)
+    database_path = os.path.join(tempfile.mkdtemp(), "microbench.sqlite3")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database_path}"
+    os.environ["DEBUG"] = "False"
+    os.environ["DJANGO_SETTINGS_MODULE"] = "Django_rest_framework_template.settings"
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+
+def create_users(count: int) -> list:
+    from django.contrib.auth.hashers import make_password
+    from rest_framework.authtoken.models import Token
+    from user.models import User
+
+    existing = User.objects.count()
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        [
+            User(
+                email=f"bench{index}@example.com",
+                username=f"bench{index}",
+                password=password,
+            )
+            for index in range(existing, count)
+        ],
+        batch_size=500,
+    )
+    users = list(User.objects.order_by("email")[:count])
+    Token.objects.bulk_create(
+        [Token(key=Token.generate_key(), user=user) for user in users],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    return users
+
+
+def bench_custom_response():
+    from rest_framework.response import Response
+    from core.views import custom_response
+
+    response = Response()
+    data = {"id": "5f0c", "email": "bench@example.com", "username": "bench"}
+
+    def run():
+        response.data = data
+        custom_response(response)
+
+    return run
+
+
+def bench_paginated_response():
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from core.pagination import CustomPagination
+
+    paginator = CustomPagination()
+    paginator.request = Request(APIRequestFactory().get("/user/?limit=20&offset=40"))
+    paginator.limit, paginator.offset, paginator.count = 20, 40, 1000
+    data = [{"id": index, "email": f"bench{index}@example.com"} for index in range(20)]
+
+    return lambda: paginator.get_paginated_response(data)
+
+
+def build_error_tree(depth: int, width: int):
+    from rest_framework.exceptions import ErrorDetail
+
+    if depth == 0:
+        return [ErrorDetail("This field is required.", code="required")] * 2
+    return {
+        f"field_{index}": build_error_tree(depth - 1, width) for index in range(width)
+    }
+
+
+def bench_error_message(depth: int, width: int):
+    from core.exceptions import recursive_error_message_creator
+
+    errors = build_error_tree(depth, width)
+    return lambda: recursive_error_message_creator(errors)
+
+
+def bench_login_serializer(count: int):
+    from user.serializers import UserLoginSerializer
+
+    users = create_users(count)
+    return lambda: UserLoginSerializer(users, many=True).data
+
+
+def bench_generate_token():
+    from core.classes import ExpiringActivationTokenGenerator
+
+    generator = ExpiringActivationTokenGenerator()
+    return lambda: generator.generate_token("bench@example.com")
+
+
+def bench_get_token_value():
+    from core.classes import ExpiringActivationTokenGenerator
+
+    generator = ExpiringActivationTokenGenerator()
+    token = generator.generate_token("bench@example.com").decode("utf-8")
+    return lambda: generator.get_token_value(token)
+
+
+def bench_from_validated_data():
+    from user.models import PasswordResetWhitelist
+
+    validated_data = {
+        "email": "bench@example.com",
+        "token": "bench-token",
+        "unknown": "ignored",
+    }
+    return lambda: PasswordResetWhitelist.from_validated_data(dict(validated_data))
+
+
+BENCHMARKS = [
+    ("custom_response", bench_custom_response, ()),
+    ("CustomPagination.get_paginated_response", bench_paginated_response, ()),
+    ("recursive_error_message_creator[depth=3,width=4]", bench_error_message, (3, 4)),
+    ("recursive_error_message_creator[depth=30,width=1]", bench_error_message, (30, 1)),
+    ("UserLoginSerializer[1]", bench_login_serializer, (1,)),
+    ("UserLoginSerializer[100]", bench_login_serializer, (100,)),
+    ("UserLoginSerializer[10000]", bench_login_serializer, (10000,)),
+    ("ExpiringActivationTokenGenerator.generate_token", bench_generate_token, ()),
+    ("ExpiringActivationTokenGenerator.get_token_value", bench_get_token_value, ()),
+    ("CoreModel.from_validated_data", bench_from_validated_data, ()),
+]
+
+
+def measure(function, repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(function)
+    # Warm caches (Site, serializer fields, imports) before calibrating
+    function()
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    samples = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    return {
+        "loops": number,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "samples": samples,
+    }
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def run_benchmarks(args) -> dict:
+    setup_django(Path(args.root).resolve())
+    results, errors = {}, {}
+    for name, factory, factory_args in BENCHMARKS:
+        if args.filter and args.filter.lower() not in name.lower():
+            continue
+        try:
+            function = factory(*factory_args)
+            results[name] = measure(function, args.repeat, args.min_time)
+        except Exception as error:
+            # Older revisions may lack the code under test
+            errors[name] = f"{type(error).__name__}: {error}"
+            continue
+        result = results[name]
+        print(
+            f"{name:<52} {format_time(result['median']):>10} "
+            f"+- {result['stdev'] / result['median']:>5.1%} "
+            f"(min {format_time(result['min'])}, {result['loops']} loops)",
+            flush=True,
+        )
+    for name, error in errors.items():
+        print(f"{name:<52} failed: {error}")
+    return {"results": results, "errors": errors}
+
+
+def run_revision(revision: str, args, directory: str) -> dict:
+    worktree = os.path.join(directory, revision.replace("/", "_"))
+    output = os.path.join(directory, f"{os.path.basename(worktree)}.json")
+    subprocess.run(
+        ["git", "worktree", "add", "--detach", worktree, revision],
+        cwd=BASE_DIR,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        print(f"== {revision}", flush=True)
+        command = [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "--root",
+            worktree,
+            "--output",
+            output,
+            "--repeat",
+            str(args.repeat),
+            "--min-time",
+            str(args.min_time),
+        ]
+        if args.filter:
+            command += ["--filter", args.filter]
+        subprocess.run(command, check=True)
+    finally:
+        subprocess.run(
+            ["git", "worktree", "remove", "--force", worktree],
+            cwd=BASE_DIR,
+            check=True,
+        )
+    with open(output) as output_file:
+        return json.load(output_file)["results"]
+
+
+def compare_revisions(args):
+    base_revision, target_revision = args.compare
+    with tempfile.TemporaryDirectory() as directory:
+        base = run_revision(base_revision, args, directory)
+        target = run_revision(target_revision, args, directory)
+
+    print(f"\n{'benchmark':<52} {base_revision:>10} {target_revision:>10}  change")
+    for name, _, _ in BENCHMARKS:
+        if name not in base or name not in target:
+            continue
+        base_median, target_median = base[name]["median"], target[name]["median"]
+        change = target_median / base_median - 1
+        # Changes within the spread of the samples are reported as noise
+        noise = max(
+            2 * base[name]["stdev"] / base_median,
+            2 * target[name]["stdev"] / target_median,
+            args.noise,
+        )
+        verdict = (
+            "~" if abs(change) <= noise else ("slower" if change > 0 else "faster")
+        )
+        print(
+            f"{name:<52} {format_time(base_median):>10} "
+            f"{format_time(target_median):>10}  {change:+7.1%} {verdict}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", help="Only run benchmarks containing this text.")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="Minimum seconds per sample, the loop count is doubled until reached.",
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASE", "TARGET"),
+        help="Benchmark two git revisions and compare them.",
+    )
+    parser.add_argument(
+        "--noise",
+        type=float,
+        default=0.05,
+        help="Smallest relative change --compare reports as faster or slower.",
+    )
+    parser.add_argument("--root", default=str(BASE_DIR), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_revisions(args)
+        return
+
+    report = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
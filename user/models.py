@@ -1,28 +1,45 @@
 from __future__ import annotations
 
-from django.db import models, IntegrityError
+from datetime import timedelta
+
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
-from django.contrib.auth.models import AbstractUser
-from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.contrib.sites.models import Site
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import AuthenticationFailed, ValidationError
 
 from core.classes import ExpiringActivationTokenGenerator
-from core.models import CoreModel
+from core.models import CoreManager, CoreModel, SoftDeleteQuerySet
 from core.literals import (
     PROFILE_PHOTO_DIRECTORY,
+    PROFILE_PHOTO_VARIANT_FORMATS,
+    PROFILE_PHOTO_VARIANT_SIZES,
+)
+from core.modelutils import queue_file_deletion, queue_mail
+from core.utils import hash_password, run_image_processing
+from .utils import (
+    generate_file_and_name,
+    generate_profile_photo_variants,
+    get_profile_photo_variant_name,
+    get_profile_photo_variant_names,
 )
-from core.modelutils import send_mail
-from .utils import generate_file_and_name
 
 # Create your models here.
 
 username_validator = UnicodeUsernameValidator()
 
 
+class SoftDeleteUserManager(CoreManager, UserManager):
+    """
+    UserManager that hides soft deleted users, so they can neither log in
+    nor be looked up.
+    """
+
+
 class PasswordResetWhitelist(CoreModel):
     email = models.EmailField(unique=True)
     token = models.CharField(max_length=255, unique=True)
@@ -70,14 +87,30 @@ class User(AbstractUser, CoreModel):
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
 
-    @classmethod
-    def from_validated_data(cls, validated_data: dict):
-        fields = [field.name for field in User._meta.fields]
+    objects = SoftDeleteUserManager()
+    all_objects = SoftDeleteQuerySet.as_manager()
 
-        validated_data["password"] = make_password(validated_data.pop("password"))
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(
+                fields=["created_at", "id"],
+                name="user_live_created_idx",
+                condition=models.Q(is_deleted=False),
+            ),
+            models.Index(
+                fields=["deleted_at"],
+                name="user_deleted_at_idx",
+                condition=models.Q(is_deleted=True),
+            ),
+        ]
+
+    @classmethod
+    def from_validated_data(cls, validated_data: dict, password_is_hashed=False):
+        if not password_is_hashed:
+            validated_data["password"] = hash_password(validated_data.pop("password"))
         constructor_kwargs = {
             field: validated_data.pop(field)
-            for field in fields
+            for field in cls.get_field_names()
             if field in validated_data
         }
         return cls(**constructor_kwargs)
@@ -101,28 +134,94 @@ class User(AbstractUser, CoreModel):
         except Token.DoesNotExist:
             raise AuthenticationFailed("Token expired.")
 
+    def renew_expired_token(self):
+        """
+        Deletes the token when it is older than USER_AUTH_TOKEN_EXPIRATION_SECONDS,
+        so the next ``token`` access issues a new one instead of returning the
+        expired key until the reaper removes it.
+        """
+        cutoff = timezone.now() - timedelta(
+            seconds=settings.USER_AUTH_TOKEN_EXPIRATION_SECONDS
+        )
+        Token.objects.filter(user=self, created__lt=cutoff).delete()
+
     @property
     def profile_photo(self) -> str:
+        return self.get_profile_photo()
+
+    def get_profile_photo(self, size: str = None, image_format="webp") -> str:
+        """
+        Returns the URL of the original photo, or of one of the resized
+        variants when ``size`` is given. Falls back to the original while the
+        variant is still being generated.
+        """
         domain = Site.objects.get_current().domain
-        if self._profile_photo.name:
-            return domain + self._profile_photo.url
+        if not self._profile_photo.name:
+            return None
+        if size is not None:
+            storage = self._profile_photo.storage
+            variant_name = get_profile_photo_variant_name(
+                self._profile_photo.name, size, image_format
+            )
+            if storage.exists(variant_name):
+                return domain + storage.url(variant_name)
+        return domain + self._profile_photo.url
 
     @profile_photo.setter
     def profile_photo(self, profile_photo_data):
-        if self._profile_photo.name:
-            del self.profile_photo
         file_name, file = generate_file_and_name(profile_photo_data, self.id)
-        self._profile_photo.save(file_name, file, save=True)
-        self.save()
+        with transaction.atomic():
+            self.queue_profile_photo_deletion()
+            self._profile_photo.save(file_name, file, save=False)
+            self.save_profile_photo()
+        run_image_processing(generate_profile_photo_variants, self._profile_photo.path)
 
     @profile_photo.deleter
     def profile_photo(self):
         if self._profile_photo.name:
-            self._profile_photo.delete(save=True)
+            with transaction.atomic():
+                self.queue_profile_photo_deletion()
+                self.save_profile_photo()
+
+    @property
+    def profile_photo_variants(self) -> dict:
+        """
+        Returns the URLs of the resized variants by size and format, e.g.
+        ``{"thumbnail": {"webp": ..., "jpeg": ...}}``. Variants still being
+        generated point to the original.
+        """
+        if not self._profile_photo.name:
+            return {}
+        return {
+            size: {
+                image_format: self.get_profile_photo(size, image_format)
+                for image_format in PROFILE_PHOTO_VARIANT_FORMATS
+            }
+            for size in PROFILE_PHOTO_VARIANT_SIZES
+        }
+
+    def queue_profile_photo_deletion(self):
+        """
+        Queues the photo and its variants for deletion once the transaction
+        commits and clears the field without saving.
+        """
+        if self._profile_photo.name:
+            queue_file_deletion(
+                self._profile_photo.name,
+                *get_profile_photo_variant_names(self._profile_photo.name),
+            )
+            self._profile_photo = None
+
+    def save_profile_photo(self):
+        if self._state.adding:
+            self.save()
+        else:
+            self.save(update_fields=["_profile_photo", "updated_at"])
 
     def delete(self, *args, **kwargs):
-        del self.profile_photo
-        return super(User, self).delete(*args, **kwargs)
+        with transaction.atomic():
+            self.queue_profile_photo_deletion()
+            return super(User, self).delete(*args, **kwargs)
 
     def send_email_verification_mail(self):
         template = "email/account_verification.html"
@@ -140,7 +239,7 @@ class User(AbstractUser, CoreModel):
             )
             + f"?token={confirmation_token.decode('utf-8')}"
         )
-        send_mail(
+        queue_mail(
             to_email=self.email,
             subject=f"Welcome, please verify your email address",
             template_name=template,
@@ -173,7 +272,7 @@ class User(AbstractUser, CoreModel):
             )
             + f"?token={reset_token.decode('utf-8')}"
         )
-        send_mail(
+        queue_mail(
             to_email=self.email,
             subject=f"Password Reset",
             template_name=template,
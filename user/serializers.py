@@ -1,22 +1,62 @@
+from django.conf import settings
 from rest_framework.serializers import (
     ModelSerializer,
     Serializer,
     CharField,
     EmailField,
+    ImageField,
 )
 from rest_framework.exceptions import ValidationError
 from cryptography.fernet import InvalidToken
 
 from core.classes import ExpiringActivationTokenGenerator
+from core.exceptions import FileTooLarge
 from .models import (
     User,
 )
+from .utils import (
+    decode_base64_image,
+    get_base64_decoded_size,
+    get_image_extension,
+)
+
+
+def validate_profile_photo_image(value):
+    content_type = getattr(value, "content_type", None)
+    if content_type and not content_type.startswith("image/"):
+        raise ValidationError("Upload a valid image.")
+    try:
+        get_image_extension(value)
+    except ValueError:
+        raise ValidationError("Upload a valid image.")
+    return value
+
+
+class Base64ProfilePhotoField(CharField):
+    """
+    Legacy base64 data URI photo, validated and decoded to a file.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault("validators", [validate_profile_photo_image])
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if ";base64," not in value:
+            raise ValidationError("Invalid profile photo.")
+        if get_base64_decoded_size(value) > settings.PROFILE_PHOTO_MAX_UPLOAD_SIZE:
+            raise FileTooLarge()
+        try:
+            return decode_base64_image(value)
+        except ValueError:
+            raise ValidationError("Invalid profile photo.")
 
 
 class UserSerializer(ModelSerializer):
     class Meta:
         model = User
-        fields = ("id", "email")
+        fields = ("id", "email", "profile_photo", "profile_photo_variants")
 
 
 class UserLoginSerializer(ModelSerializer):
@@ -26,22 +66,28 @@ class UserLoginSerializer(ModelSerializer):
         model = User
         fields = list(
             set(field.name for field in model._meta.fields) - set(["_profile_photo"])
-        ) + ["token", "profile_photo", "username"]
+        ) + ["token", "profile_photo", "profile_photo_variants", "username"]
         extra_kwargs = {field: {"read_only": True} for field in fields}
         extra_kwargs["password"] = {"write_only": True}
         del extra_kwargs["email"]
 
 
 class UserSignUpSerializer(ModelSerializer):
-    profile_photo = CharField(required=False)
+    profile_photo = Base64ProfilePhotoField(required=False)
 
     def validate(self, attrs):
-        if User.objects.filter(email=attrs["email"]).exists():
+        # Soft deleted users still hold their email and username
+        if User.all_objects.filter(email=attrs["email"]).exists():
             raise ValidationError("User with this mail already exists.")
+        if User.all_objects.filter(username=attrs["username"]).exists():
+            raise ValidationError("A user with that username already exists.")
         return super().validate(attrs)
 
     def create(self, validated_data):
-        user = User.from_validated_data(validated_data)
+        user = User.from_validated_data(
+            validated_data,
+            password_is_hashed=self.context.get("password_is_hashed", False),
+        )
 
         if validated_data.get("profile_photo"):
             user.profile_photo = validated_data["profile_photo"]
@@ -63,6 +109,21 @@ class UserSignUpSerializer(ModelSerializer):
         }
 
 
+class ProfilePhotoUploadSerializer(Serializer):
+    """
+    Takes the photo as an uploaded ``file`` or as a legacy base64
+    ``profile_photo`` string.
+    """
+
+    file = ImageField(required=False, validators=[validate_profile_photo_image])
+    profile_photo = Base64ProfilePhotoField(required=False)
+
+    def validate(self, attrs):
+        if not attrs.get("file") and not attrs.get("profile_photo"):
+            raise ValidationError("file or profile_photo is required")
+        return attrs
+
+
 class VerifyEmailSerializer(Serializer):
     token = CharField(required=True, write_only=True)
 
@@ -1,3 +1,342 @@
-from django.test import TestCase
+import base64
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.classes import token_cache
+from core.modelutils import delete_queued_files
+from .models import User
+from .utils import generate_profile_photo_variants
+
+PASSWORD = "test-password-123"
+
+
+def create_user(name="alice", **kwargs) -> User:
+    return User.objects.create(
+        email=f"{name}@example.com",
+        username=name,
+        password=make_password(PASSWORD),
+        **kwargs,
+    )
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def login(self):
+        return self.client.post(
+            "/user/login/",
+            {"email": self.user.email, "password": PASSWORD},
+            format="json",
+        )
+
+    def test_login_replaces_expired_token(self):
+        expired = Token.objects.create(user=self.user)
+        Token.objects.filter(pk=expired.pk).update(
+            created=timezone.now()
+            - timedelta(seconds=settings.USER_AUTH_TOKEN_EXPIRATION_SECONDS + 1)
+        )
+
+        response = self.login()
+
+        self.assertEqual(response.status_code, 200)
+        key = response.data["result"]["token"]
+        self.assertNotEqual(key, expired.key)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {key}")
+        self.assertEqual(self.client.get(f"/user/{self.user.pk}/").status_code, 200)
+
+    def test_login_keeps_valid_token(self):
+        token = Token.objects.create(user=self.user)
+
+        response = self.login()
+
+        self.assertEqual(response.data["result"]["token"], token.key)
+
+    def count_hashes(self, hasher=None):
+        hasher = hasher or get_hasher()
+        return mock.patch.object(
+            type(hasher), "encode", autospec=True, side_effect=type(hasher).encode
+        )
+
+    def test_login_hashes_the_password_once(self):
+        with self.count_hashes() as encode:
+            response = self.login()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(encode.call_count, 1)
+
+    def test_hash_upgrade_is_saved_with_the_token(self):
+        User.objects.filter(pk=self.user.pk).update(
+            password=make_password(PASSWORD, hasher="pbkdf2_sha1")
+        )
+
+        count_verify = self.count_hashes(get_hasher("pbkdf2_sha1"))
+        count_upgrade = self.count_hashes()
+        with count_verify as verify, count_upgrade as upgrade:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.login()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((verify.call_count, upgrade.call_count), (1, 1))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith(f"{get_hasher().algorithm}$"))
+        self.assertTrue(self.user.check_password(PASSWORD))
+        # The upgrade and the token are written in one transaction
+        statements = [query["sql"].split()[0] for query in queries.captured_queries]
+        start = statements.index("SAVEPOINT")
+        end = statements.index("RELEASE", start)
+        transaction_sql = " ".join(
+            query["sql"] for query in queries.captured_queries[start:end]
+        )
+        self.assertIn('UPDATE "user_user" SET "password"', transaction_sql)
+        self.assertIn('INSERT INTO "authtoken_token"', transaction_sql)
+
+        with self.count_hashes() as encode:
+            self.login()
+        self.assertEqual(encode.call_count, 1)
+
+    def test_login_activates_an_inactive_user(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        with self.count_hashes() as encode:
+            response = self.login()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(encode.call_count, 1)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+
+    def test_wrong_password_keeps_the_user_inactive(self):
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        response = self.client.post(
+            "/user/login/",
+            {"email": self.user.email, "password": "wrong"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 401)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+
+    def tearDown(self):
+        token_cache.clear()
+
+    def post(self, path, data):
+        return self.client.post(path, data, format="json")
+
+    def test_async_login_matches_sync_login(self):
+        credentials = {"email": self.user.email, "password": PASSWORD}
+
+        sync_response = self.post("/user/login/", credentials)
+        async_response = self.post("/user/login/async/", credentials)
+
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.json(), sync_response.json())
+        self.assertEqual(async_response.json()["message"], "Login successful.")
+
+    def test_async_login_errors_use_the_error_envelope(self):
+        response = self.post(
+            "/user/login/async/", {"email": self.user.email, "password": "wrong"}
+        )
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["status_code"], 401)
+        self.assertIsNone(response.json()["result"])
+
+    def test_async_signup_envelope(self):
+        response = self.post(
+            "/user/signup/async/",
+            {"email": "bob@example.com", "username": "bob", "password": PASSWORD},
+        )
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data["message"], "success")
+        self.assertEqual(data["status_code"], 201)
+        self.assertEqual(data["result"]["email"], "bob@example.com")
+        self.assertTrue(
+            User.objects.get(email="bob@example.com").check_password(PASSWORD)
+        )
+
+    def test_async_signup_errors_use_the_error_envelope(self):
+        response = self.post(
+            "/user/signup/async/",
+            {"email": self.user.email, "username": "bob", "password": PASSWORD},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["status_code"], 400)
+        self.assertIn("email", response.json()["message"])
+
+
+def get_png(color=(200, 60, 60)) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class ProfilePhotoTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=directory.name, IMAGE_PROCESSING_WORKERS=0
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def put_base64(self, mimetype: str, data: str):
+        return self.client.put(
+            "/user/profile-photo/",
+            {"profile_photo": f"data:{mimetype};base64,{data}"},
+            format="json",
+        )
+
+    def put_file(self, name: str, content: bytes, content_type: str):
+        return self.client.put(
+            "/user/profile-photo/",
+            {"file": SimpleUploadedFile(name, content, content_type=content_type)},
+            format="multipart",
+        )
+
+    def get_stored_name(self) -> str:
+        self.user.refresh_from_db()
+        return self.user._profile_photo.name
+
+
+class ProfilePhotoUploadTests(ProfilePhotoTestCase):
+    def test_legacy_base64_photo_is_stored(self):
+        response = self.put_base64("image/png", base64.b64encode(get_png()).decode())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.get_stored_name().endswith(".png"))
+        self.assertTrue(response.data["result"]["profile_photo"].endswith(".png"))
+
+    def test_signup_photo_is_stored(self):
+        response = APIClient().post(
+            "/user/signup/",
+            {
+                "email": "bob@example.com",
+                "username": "bob",
+                "password": PASSWORD,
+                "profile_photo": "data:image/png;base64,"
+                + base64.b64encode(get_png()).decode(),
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(email="bob@example.com")
+        self.assertTrue(user._profile_photo.name.endswith(".png"))
+
+    def test_multipart_photo_is_stored(self):
+        response = self.put_file("photo.png", get_png(), "image/png")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.get_stored_name().endswith(".png"))
+
+    def test_extension_comes_from_the_detected_format(self):
+        response = self.put_file("photo.gif", get_png(), "text/html")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.get_stored_name().endswith(".png"))
+
+    def test_non_images_are_rejected(self):
+        html = b"<script>alert(1)</script>"
+        responses = [
+            self.put_base64("text/html", base64.b64encode(get_png()).decode()),
+            self.put_base64("image/png", base64.b64encode(html).decode()),
+            self.put_file("photo.png", html, "image/png"),
+        ]
+
+        for response in responses:
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.get_stored_name())
+
+    def test_malformed_base64_is_rejected(self):
+        for data in ["not base64!", "iVBORw0KGgo"]:
+            with self.subTest(data=data):
+                self.assertEqual(self.put_base64("image/png", data).status_code, 400)
+
+    @override_settings(PROFILE_PHOTO_MAX_UPLOAD_SIZE=64)
+    def test_large_photos_are_rejected(self):
+        encoded = base64.b64encode(get_png() + b"\0" * 64).decode()
+
+        self.assertEqual(self.put_base64("image/png", encoded).status_code, 413)
+        self.assertEqual(
+            self.put_file("photo.png", get_png() + b"\0" * 64, "image/png").status_code,
+            413,
+        )
+        self.assertFalse(self.get_stored_name())
+
+
+class ProfilePhotoVariantTests(ProfilePhotoTestCase):
+    def upload(self, color) -> str:
+        response = self.put_file("photo.png", get_png(color), "image/png")
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        # Run inline instead of in the image processing pool
+        return generate_profile_photo_variants(self.user._profile_photo.path)
+
+    def test_variants_are_exposed(self):
+        variants = self.upload((200, 60, 60))
+
+        self.assertEqual(len(variants), 4)
+        self.assertTrue(all(os.path.exists(path) for path in variants))
+        result = self.client.get(f"/user/{self.user.pk}/").data["result"]
+        self.assertTrue(result["profile_photo"].endswith(".png"))
+        self.assertEqual(
+            sorted(result["profile_photo_variants"]), ["medium", "thumbnail"]
+        )
+        self.assertTrue(
+            result["profile_photo_variants"]["thumbnail"]["webp"].endswith(
+                "__thumbnail.webp"
+            )
+        )
+
+    def test_variants_fall_back_to_the_original(self):
+        self.put_file("photo.png", get_png(), "image/png")
+        self.user.refresh_from_db()
+
+        variants = self.user.profile_photo_variants
+
+        self.assertEqual(variants["medium"]["jpeg"], self.user.profile_photo)
+
+    def test_variants_are_deleted_when_the_photo_is_replaced(self):
+        old_files = self.upload((200, 60, 60))
+        old_files.append(self.user._profile_photo.path)
+
+        new_files = self.upload((60, 90, 200))
+        delete_queued_files()
+
+        self.assertFalse(any(os.path.exists(path) for path in old_files))
+        self.assertTrue(all(os.path.exists(path) for path in new_files))
@@ -1,20 +1,32 @@
 from django.urls import path
 
 from .views import (
+    UserListAPIView,
     UserRetrieveAPIView,
     LoginView,
+    AsyncLoginView,
     LogoutView,
     UserSignUpView,
+    AsyncUserSignUpView,
     VerifyEmailView,
     PasswordResetEmailView,
     PasswordResetView,
+    ProfilePhotoUploadView,
 )
 
 urlpatterns = [
+    path("", UserListAPIView.as_view(), name="user-list"),
     path("<uuid:pk>/", UserRetrieveAPIView.as_view(), name="user-retrieve"),
     path("login/", LoginView.as_view(), name="login"),
+    path("login/async/", AsyncLoginView.as_view(), name="login-async"),
     path("signup/", UserSignUpView.as_view(), name="signup"),
+    path("signup/async/", AsyncUserSignUpView.as_view(), name="signup-async"),
     path("logout/", LogoutView.as_view(), name="logout"),
+    path(
+        "profile-photo/",
+        ProfilePhotoUploadView.as_view(),
+        name="profile-photo-upload",
+    ),
     path("activate/<str:token>/", VerifyEmailView.as_view(), name="verify-email"),
     path(
         "send-password-reset-email/",
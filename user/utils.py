@@ -1,18 +1,113 @@
 import base64
+import os
 from datetime import datetime, timezone
 
 from django.core.files.base import ContentFile
 from django.utils.text import get_valid_filename, slugify
 from django.db import models
 
+from core.literals import (
+    PROFILE_PHOTO_FORMATS,
+    PROFILE_PHOTO_VARIANT_FORMATS,
+    PROFILE_PHOTO_VARIANT_SIZES,
+)
 
-def generate_file_and_name(image_data: str, user_id: int):
+
+def decode_base64_image(image_data: str) -> ContentFile:
+    """
+    Decodes a legacy base64 data URI. Raises ValueError unless it declares an
+    image type and its payload is valid base64.
+    """
+    mimetype, _, data = image_data.partition(";base64,")
+    if not data or not mimetype.startswith("data:image/"):
+        raise ValueError("Not a base64 image data URI.")
+    # binascii.Error is a ValueError
+    return ContentFile(base64.b64decode(data, validate=True))
+
+
+def get_image_extension(image_file) -> str:
+    """
+    Returns the extension of the image format Pillow detects in the content.
+    The file name and content type sent by the client are not trusted, an
+    HTML file named photo.png must not be served back as HTML. Raises
+    ValueError for anything but PROFILE_PHOTO_FORMATS.
+    """
+    from PIL import Image
+
+    image_file.seek(0)
+    try:
+        with Image.open(image_file) as image:
+            image_format = image.format
+            image.verify()
+    except Exception:
+        # Pillow raises many different exceptions for broken images
+        raise ValueError("Not an image.")
+    finally:
+        image_file.seek(0)
+    if image_format not in PROFILE_PHOTO_FORMATS:
+        raise ValueError(f"Unsupported image format {image_format}.")
+    return PROFILE_PHOTO_FORMATS[image_format]
+
+
+def generate_file_and_name(image_data, user_id: int):
     """
     This method is used to generate a file name for the profile photo.
+    Accepts an uploaded file or a legacy base64 data URI string, the
+    extension is derived from the detected image format.
     """
     current_timestamp = datetime.now(timezone.utc).strftime("%Y_%m_%d_%H_%M_%S_%f")
-    mimetype, data = image_data.split(";base64,")
-    file_extention = mimetype.split("/")[-1]
+    if isinstance(image_data, str):
+        image_file = decode_base64_image(image_data)
+    else:
+        image_file = image_data
+    file_extention = get_image_extension(image_file)
     image_name = get_valid_filename(f"{user_id}_{current_timestamp}.{file_extention}")
-    image_file = ContentFile(base64.b64decode(data), name=image_name)
+    image_file.name = image_name
     return image_name, image_file
+
+
+def get_base64_decoded_size(image_data: str) -> int:
+    """
+    Returns the decoded size of a base64 data URI without decoding it.
+    """
+    data = image_data.split(";base64,")[-1]
+    return len(data) * 3 // 4 - data[-2:].count("=")
+
+
+def get_profile_photo_variant_name(name: str, size: str, image_format: str) -> str:
+    """
+    Returns the storage name of a resized variant, stored next to the original.
+    """
+    stem, _ = os.path.splitext(name)
+    return f"{stem}__{size}.{image_format}"
+
+
+def get_profile_photo_variant_names(name: str) -> list:
+    return [
+        get_profile_photo_variant_name(name, size, image_format)
+        for size in PROFILE_PHOTO_VARIANT_SIZES
+        for image_format in PROFILE_PHOTO_VARIANT_FORMATS
+    ]
+
+
+def generate_profile_photo_variants(path: str) -> list:
+    """
+    Writes every size and format variant of the photo at ``path`` next to it.
+    Runs in a worker process, each file is written to a temporary name first
+    and renamed into place so readers never see a partial image.
+    """
+    from PIL import Image, ImageOps
+
+    written = []
+    with Image.open(path) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+    for size, edge in PROFILE_PHOTO_VARIANT_SIZES.items():
+        variant = image.copy()
+        variant.thumbnail((edge, edge))
+        for image_format, pil_format in PROFILE_PHOTO_VARIANT_FORMATS.items():
+            variant_path = get_profile_photo_variant_name(path, size, image_format)
+            temporary_path = f"{variant_path}.tmp"
+            variant.save(temporary_path, pil_format, quality=85)
+            os.replace(temporary_path, variant_path)
+            written.append(variant_path)
+    return written
@@ -2,9 +2,16 @@ from rest_framework.generics import GenericAPIView
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import AuthenticationFailed, ValidationError
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.filters import SearchFilter
-from django.contrib.auth import authenticate, logout
+from rest_framework.parsers import FileUploadParser, JSONParser, MultiPartParser
+from rest_framework import status
+from asgiref.sync import sync_to_async
+from django.contrib.auth import logout
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.db import transaction
+from django.http import JsonResponse
 from drf_spectacular.utils import (
     OpenApiExample,
     OpenApiParameter,
@@ -13,11 +20,17 @@ from drf_spectacular.utils import (
 )
 from drf_spectacular.types import OpenApiTypes
 
+from core.exceptions import FileTooLarge
+from core.metrics import PASSWORD_HASHING_LATENCY
+from core.permissions import AdminPermission
+from core.uploadhandlers import MaxSizeUploadHandler
+from core.utils import hash_password, run_password_hashing
 from core.views import (
     CustomListAPIView,
     CustomRetrieveAPIView,
     CustomCreateAPIView,
     CustomAPIView,
+    CustomAsyncAPIView,
 )
 from .models import User
 from .serializers import (
@@ -27,57 +40,110 @@ from .serializers import (
     VerifyEmailSerializer,
     PasswordResetEmailSerializer,
     PasswordResetSerializer,
+    ProfilePhotoUploadSerializer,
 )
 
 
+class UserListAPIView(CustomListAPIView):
+    queryset = User.objects.order_by("-created_at", "-id")
+    serializer_class = UserSerializer
+    permission_classes = [IsAuthenticated, AdminPermission]
+    filter_backends = [SearchFilter]
+    search_fields = ["email", "username", "full_name"]
+
+
 class UserRetrieveAPIView(CustomRetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
 
-class LoginView(GenericAPIView):
-    permission_classes = [AllowAny]
-    serializer_class = UserLoginSerializer
-    queryset = User.objects.all()
+class LoginMixin:
+    """
+    Login steps shared by the sync and async login views.
+    """
 
-    def post(self, request):
-        # Extracting data from request and validating it
-        user = None
+    def get_login_user(self, data) -> User:
         fields = ["email", "password"]
         for field in fields:
-            if field not in request.data:
+            if field not in data:
                 raise ValidationError(f"{field} is required")
         try:
-            user: User = User.objects.get(email=request.data["email"])
-            if user.check_password(request.data["password"]):
-                user.is_active = True
-                user.save()
+            return User.objects.get(email=data["email"])
         except User.DoesNotExist:
             raise ValidationError("Invalid credentials")
-        serializer = UserLoginSerializer(user)
 
+    def check_credentials(self, user: User, password: str) -> tuple:
+        """
+        Verifies the password hashing it once. A hash upgrade requested by the
+        configured hashers is applied to the instance without saving it.
+        Returns whether the password is valid and the fields to save.
+        """
+        update_fields = []
+
+        def upgrade_password(raw_password):
+            user.set_password(raw_password)
+            update_fields.append("password")
+
+        with PASSWORD_HASHING_LATENCY.labels("check").time():
+            is_valid = check_password(password, user.password, upgrade_password)
+        if is_valid and not user.is_active:
+            user.is_active = True
+            update_fields.append("is_active")
+        return is_valid, update_fields
+
+    def get_logged_in_user(self, request, user: User, is_valid: bool) -> User:
         # Checking if user is already logged in
-        result = None
         if request.user.is_authenticated:
-            result = UserLoginSerializer(request.user).data
+            return request.user
+        if not is_valid:
+            raise AuthenticationFailed()
+        return user
 
-        # Authenticating user
-        else:
-            user = authenticate(
-                email=request.data["email"],
-                password=request.data["password"],
-            )
-            if not user:
-                raise AuthenticationFailed()
-            result = serializer.data
+    def complete_login(self, user: User, logged_in_user: User, update_fields) -> dict:
+        # Saving the changed columns and issuing the token together
+        with transaction.atomic():
+            if update_fields:
+                user.save(update_fields=update_fields)
+            logged_in_user.renew_expired_token()
+            result = UserLoginSerializer(logged_in_user).data
+
+        return {
+            "status_code": 200,
+            "message": "Login successful.",
+            "result": result,
+        }
+
+
+class LoginView(LoginMixin, GenericAPIView):
+    permission_classes = [AllowAny]
+    serializer_class = UserLoginSerializer
+    queryset = User.objects.all()
+
+    def post(self, request):
+        # Extracting data from request and validating it
+        user = self.get_login_user(request.data)
+        is_valid, update_fields = self.check_credentials(user, request.data["password"])
+        logged_in_user = self.get_logged_in_user(request, user, is_valid)
 
         # Returning token
-        return Response(
-            {
-                "status_code": 200,
-                "message": "Login successful.",
-                "result": result,
-            }
+        return Response(self.complete_login(user, logged_in_user, update_fields))
+
+
+class AsyncLoginView(LoginMixin, CustomAsyncAPIView):
+    """
+    Login for ASGI deployments, the password is hashed in the bounded pool.
+    """
+
+    async def post(self, request):
+        user = await sync_to_async(self.get_login_user)(request.data)
+        is_valid, update_fields = await run_password_hashing(
+            self.check_credentials, user, request.data["password"]
+        )
+        logged_in_user = self.get_logged_in_user(request, user, is_valid)
+        return JsonResponse(
+            await sync_to_async(self.complete_login)(
+                user, logged_in_user, update_fields
+            )
         )
 
 
@@ -87,6 +153,34 @@ class UserSignUpView(CustomCreateAPIView):
     permission_classes = [AllowAny]
 
 
+class AsyncUserSignUpView(CustomAsyncAPIView):
+    """
+    Sign up for ASGI deployments, the password is hashed in the bounded pool.
+    """
+
+    def create_user(self, serializer: UserSignUpSerializer) -> dict:
+        serializer.save()
+        return serializer.data
+
+    async def post(self, request):
+        serializer = UserSignUpSerializer(
+            data=request.data, context={"password_is_hashed": True}
+        )
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        serializer.validated_data["password"] = await run_password_hashing(
+            hash_password, serializer.validated_data["password"]
+        )
+        result = await sync_to_async(self.create_user)(serializer)
+        return JsonResponse(
+            {
+                "message": "success",
+                "status_code": status.HTTP_201_CREATED,
+                "result": result,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+
 class LogoutView(CustomAPIView):
     http_method_names = ["post", "options"]
 
@@ -96,18 +190,54 @@ class LogoutView(CustomAPIView):
         return super().post(request=request)
 
 
+class ProfilePhotoUploadView(CustomAPIView):
+    """
+    Replaces the profile photo of the current user. The photo is streamed to
+    storage from a multipart ``file`` field or a raw body with a
+    Content-Disposition filename, the legacy base64 JSON form is still
+    accepted. Uploads above PROFILE_PHOTO_MAX_UPLOAD_SIZE are rejected before
+    they are buffered.
+    """
+
+    http_method_names = ["put", "options"]
+    parser_classes = [JSONParser, MultiPartParser, FileUploadParser]
+
+    @extend_schema(request=ProfilePhotoUploadSerializer)
+    def put(self, request):
+        max_size = settings.PROFILE_PHOTO_MAX_UPLOAD_SIZE
+        if int(request.META.get("CONTENT_LENGTH") or 0) > max_size:
+            raise FileTooLarge()
+        request.upload_handlers.insert(
+            0, MaxSizeUploadHandler(request._request, max_size=max_size)
+        )
+
+        serializer = ProfilePhotoUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+        user: User = request.user
+        user.profile_photo = validated_data.get("file") or validated_data.get(
+            "profile_photo"
+        )
+        return super().put(
+            request=request, response_data={"profile_photo": user.profile_photo}
+        )
+
+
 class VerifyEmailView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request, *args, **kwargs):
         serializer = VerifyEmailSerializer(data={"token": kwargs["token"]})
         serializer.is_valid(raise_exception=True)
-        validated_data = serializer.validated_data
+        user = serializer.validated_data["user"]
+        with transaction.atomic():
+            user.renew_expired_token()
+            result = UserLoginSerializer(instance=user).data
         return Response(
             {
                 "status_code": 200,
                 "message": "Email verified successfully.",
-                "result": UserLoginSerializer(instance=validated_data["user"]).data,
+                "result": result,
             }
         )
 